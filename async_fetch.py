@@ -0,0 +1,371 @@
+# This file downloads several Open Data NI resources at once, such as the
+# Invest NI offers of different years, and merges them into one csv with the
+# headings of the Invest NI csv.
+#
+# The first page of every resource is requested together. Once a resource
+# gives its total number of records, the rest of its pages are requested
+# together too, stepping by the number of records the server gave for the
+# first page, as a server can give fewer than the limit asked for. A
+# semaphore caps the number of requests in flight over all the resources,
+# and a request that fails in a way that may pass (a dropped connection, a
+# timeout, a 5xx or 429 response) is tried again after a wait that doubles
+# each time.
+#
+# Resources can name their fields differently. Each heading of our csv is
+# matched to a field of the resource ignoring case, spacing and symbols,
+# trying the Invest NI field and then its aliases, unless the resource is
+# given a field map of its own.
+#
+# Records are written in the order of the resources given and of their
+# pages, each page as soon as it and the pages before it are in, so only the
+# pages that arrive early are held. A record already given by an earlier
+# resource is dropped, matched on the hash of its csv row. Records repeated
+# within one resource are kept, as the single resource retrieval keeps them.
+#
+# aiohttp is used when it is installed. Otherwise each request is made with
+# urllib in a worker thread, which needs nothing outside the standard library
+#
+# Usage: python async_fetch.py resource_id [resource_id ...]
+#            [--output Data/invest_ni.csv] [--overwrite] [--concurrency 8]
+#            [--fields field_maps.json]
+import argparse
+import asyncio
+import http.client
+import json
+import urllib.request
+from urllib.parse import urlencode, urljoin
+import bulk_writer
+import data_manipulation as dm
+import instrumentation
+
+# aiohttp is optional, urllib is used without it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Most requests in flight at once, over every resource
+concurrency = 8
+# Number of times a failed request is tried again, and the first wait
+retries = 3
+backoff = 0.5
+# Seconds to wait for a response
+timeout = 60
+# Other names the fields of the Invest NI headings can go by in other
+# resources, tried after the Invest NI field
+field_aliases = {"Total Assistance": ["Total Assistance Offered (£)",
+                                      "Assistance Offered"],
+                 "Total Investment": ["Total Investment (£)",
+                                      "Total Project Investment"],
+                 "Condition": ["Condition of Offer", "Conditions"],
+                 "Estimated Jobs": ["Jobs to be Created",
+                                    "Jobs to be Created (New)"],
+                 "Country": ["Country of Ownership"],
+                 "Ownership": ["Ownership"],
+                 "Status": ["Status"],
+                 "Constituency": ["Constituency",
+                                  "Westminster Constituency"],
+                 "Sector": ["Sector"]}
+
+
+# Class to request pages with aiohttp, sharing its connections
+class AiohttpClient:
+
+    def __init__(self):
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=timeout))
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+
+    async def get_json(self, url):
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self):
+        await self.session.close()
+
+
+# Class to request pages with urllib, in a worker thread so the event loop
+# isn't held up while it waits
+class UrllibClient:
+
+    def __init__(self):
+        self.errors = (OSError, http.client.HTTPException, ValueError)
+
+    @staticmethod
+    def read_json(url):
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.load(response)
+
+    async def get_json(self, url):
+        return await asyncio.to_thread(self.read_json, url)
+
+    async def close(self):
+        pass
+
+
+# Function to create the client for the requests
+def create_client():
+    if aiohttp is not None:
+        return AiohttpClient()
+    return UrllibClient()
+
+
+# Function to check if a failed request is worth trying again. Responses
+# other than 5xx and 429 won't change, nor will a page that isn't json
+def retryable(error):
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return not isinstance(error, ValueError)
+
+
+# Function to get the url of a page of a resource
+def page_url(api_url, resource_id, limit, offset):
+    return api_url + "?" + urlencode({"resource_id": resource_id,
+                                      "limit": limit, "offset": offset})
+
+
+# Function to get a field name with only its letters and digits, in lower
+# case, so names that only differ in spacing, case or symbols match
+def plain_name(name):
+    return "".join(character for character in name.lower()
+                   if character.isalnum())
+
+
+# Function to work out which field of a resource each heading of our csv is
+# read from. Each heading is matched to the field given in the field map of
+# the resource, or otherwise to the Invest NI field or one of its aliases.
+# The fields are read from the first page of the resource
+def resource_fields(resource_id, result, field_map=None):
+    if field_map is None:
+        field_map = {}
+    if "fields" in result:
+        names = [field["id"] for field in result["fields"]]
+    elif len(result["records"]) > 0:
+        names = list(result["records"][0])
+    else:
+        return dm.source_columns
+    plain_names = {plain_name(name): name for name in names}
+
+    fields = {}
+    for heading, source in dm.source_columns.items():
+        if heading in field_map:
+            candidates = [field_map[heading]]
+        else:
+            candidates = [source] + field_aliases.get(heading, [])
+        for candidate in candidates:
+            if plain_name(candidate) in plain_names:
+                fields[heading] = plain_names[plain_name(candidate)]
+                break
+        else:
+            raise KeyError("No field for " + heading + " in resource " +
+                           resource_id + ", tried " + ", ".join(candidates))
+    return fields
+
+
+# Function to request a page, trying again with a growing wait when the
+# request fails in a way that may pass
+async def fetch_page(client, semaphore, url, attempts=retries,
+                     wait=backoff):
+    for attempt in range(attempts + 1):
+        try:
+            async with semaphore:
+                result = (await client.get_json(url))["result"]
+            instrumentation.count("api_pages")
+            instrumentation.count("api_records", len(result["records"]))
+            return result
+        except client.errors as error:
+            if attempt == attempts or not retryable(error):
+                raise
+            print("Retrying " + url + " - " + repr(error))
+            await asyncio.sleep(wait * 2 ** attempt)
+
+
+# Function to get the records of a resource from offset up to end. A server
+# can give fewer records than were asked for, so the rest are asked for
+# again from where the page stopped
+async def fetch_span(client, semaphore, resource_id, api_url, offset, end,
+                     attempts, wait):
+    records = []
+    while offset < end:
+        result = await fetch_page(
+            client, semaphore,
+            page_url(api_url, resource_id, end - offset, offset),
+            attempts, wait)
+        if len(result["records"]) == 0:
+            break
+        records.extend(result["records"])
+        offset += len(result["records"])
+    return records
+
+
+# Function to download every page of a resource. Each page is put on the
+# pages queue in order, as a task giving its records, followed by None. The
+# fields of the resource are put on the queue first
+async def fetch_resource(client, semaphore, resource_id, api_url, limit,
+                         attempts, wait, field_map, pages):
+    loop = asyncio.get_running_loop()
+    tasks = []
+    try:
+        first = await fetch_page(client, semaphore,
+                                 page_url(api_url, resource_id, limit, 0),
+                                 attempts, wait)
+        pages.put_nowait(resource_fields(resource_id, first, field_map))
+        records = loop.create_future()
+        records.set_result(first["records"])
+        pages.put_nowait(records)
+
+        # Without a total the pages can only be followed one after another
+        if "total" not in first:
+            result = first
+            while len(result["records"]) > 0 and \
+                    result.get("_links", {}).get("next") is not None:
+                result = await fetch_page(
+                    client, semaphore,
+                    urljoin(api_url, result["_links"]["next"]),
+                    attempts, wait)
+                records = loop.create_future()
+                records.set_result(result["records"])
+                pages.put_nowait(records)
+            return
+
+        # Otherwise request the rest of the pages together, as many records
+        # at a time as the server gave for the first page, which can be
+        # fewer than the limit
+        step = len(first["records"])
+        if step == 0:
+            return
+        for offset in range(step, first["total"], step):
+            task = asyncio.create_task(fetch_span(
+                client, semaphore, resource_id, api_url, offset,
+                min(offset + step, first["total"]), attempts, wait))
+            tasks.append(task)
+            pages.put_nowait(task)
+    except Exception as error:
+        # Hand the error to whoever is writing the pages
+        failed = loop.create_future()
+        failed.set_exception(error)
+        pages.put_nowait(failed)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        pages.put_nowait(None)
+
+
+# Function to keep the rows of a page that no earlier resource gave, as a
+# block of columns. The hashes of the rows kept are added to hashes
+def unique_block(columns, seen, hashes, dropped):
+    block = {heading: [] for heading in dm.invest_headers}
+    for values in zip(*[columns[heading] for heading in dm.invest_headers]):
+        row = dict(zip(dm.invest_headers, values))
+        row_hash = dm.record_hash(row)
+        if row_hash in seen:
+            dropped[0] += 1
+            continue
+        hashes.add(row_hash)
+        for heading in dm.invest_headers:
+            block[heading].append(row[heading])
+    return block
+
+
+# Function to download every page of several resources at once and write
+# them to the writer as they arrive, in the order of the resources and of
+# their pages, dropping the records an earlier resource already gave. Field
+# maps gives the fields of the resources whose headings differ from ours
+async def fetch_resources(resource_ids, writer, dropped,
+                          api_url=dm.invest_ni_base_api,
+                          limit=dm.page_limit, max_requests=concurrency,
+                          attempts=retries, wait=backoff, field_maps=None):
+    if field_maps is None:
+        field_maps = {}
+    semaphore = asyncio.Semaphore(max_requests)
+    client = create_client()
+    queues = [asyncio.Queue() for _ in resource_ids]
+    producers = [asyncio.create_task(fetch_resource(
+        client, semaphore, resource_id, api_url, limit, attempts, wait,
+        field_maps.get(resource_id), queue))
+        for resource_id, queue in zip(resource_ids, queues)]
+    try:
+        seen = set()
+        for queue in queues:
+            fields = await queue.get()
+            if isinstance(fields, asyncio.Future):
+                await fields
+            hashes = set()
+            page = await queue.get()
+            while page is not None:
+                columns = dm.record_columns(await page, fields)
+                writer.write(unique_block(columns, seen, hashes, dropped))
+                page = await queue.get()
+            seen.update(hashes)
+    finally:
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+        await client.close()
+
+
+# Function to download several resources and merge them into one csv,
+# replacing it once every page is in. Returns the number of records written
+@instrumentation.timed()
+def merge_resources(file_name, resource_ids, overwrite=False,
+                    compress=None, **options):
+    # Check if the file name exists already
+    if dm.check_file(file_name):
+        # If we want to overwrite, the original is replaced once the new
+        # file is written
+        if overwrite:
+            print("Overwriting file - replacing original")
+        # Otherwise, we want to print an error and return
+        else:
+            # Print out that the file exists
+            print("File exists already")
+            return None
+
+    # Each page is written as it arrives, to a temporary file which only
+    # replaces the csv once every page is in
+    dropped = [0]
+    with bulk_writer.block_writer(file_name, dm.invest_headers,
+                                  compress) as writer:
+        asyncio.run(fetch_resources(resource_ids, writer, dropped,
+                                    **options))
+    print("Merged " + str(writer.rows) + " records from " +
+          str(len(resource_ids)) + " resources, dropped " +
+          str(dropped[0]) + " duplicates")
+    return writer.rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Download Open Data NI resources and merge them into "
+                    "one csv")
+    parser.add_argument("resource_ids", nargs="*",
+                        default=[dm.invest_ni_resource],
+                        help="resources to merge, in order (the Invest NI "
+                             "resource by default)")
+    parser.add_argument("--output", default="Data/invest_ni.csv")
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--api", default=dm.invest_ni_base_api)
+    parser.add_argument("--limit", type=int, default=dm.page_limit,
+                        help="records requested for each page")
+    parser.add_argument("--concurrency", type=int, default=concurrency,
+                        help="most requests in flight at once")
+    parser.add_argument("--compress", choices=list(bulk_writer.compressions),
+                        help="also write a compressed copy")
+    parser.add_argument("--fields",
+                        help="json file mapping a resource id to the field "
+                             "each heading is read from")
+    arguments = parser.parse_args()
+
+    field_maps = None
+    if arguments.fields is not None:
+        with open(arguments.fields, encoding="utf-8") as fields_file:
+            field_maps = json.load(fields_file)
+    merge_resources(arguments.output, arguments.resource_ids,
+                    arguments.overwrite, arguments.compress,
+                    api_url=arguments.api, limit=arguments.limit,
+                    max_requests=arguments.concurrency,
+                    field_maps=field_maps)
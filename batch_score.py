@@ -0,0 +1,68 @@
+# This file scores a csv of investments with the saved models, without
+# training anything. The csv is read in chunks and the predictions for each
+# chunk are written out before the next is read, so files of any size can be
+# scored.
+#
+# Usage: python batch_score.py <input csv> <output csv> [models folder]
+import sys
+import pandas as pd
+import instrumentation
+import model_store
+
+# Number of rows scored at a time
+chunk_size = 10000
+
+
+# Function to add any features the models need that can be worked out from
+# the Invest NI columns, so the raw data can be scored as well
+def add_features(chunk):
+    if "Jobs Created" not in chunk and "Estimated Jobs" in chunk:
+        chunk["Jobs Created"] = chunk["Estimated Jobs"] != 0
+    return chunk
+
+
+# Function to score a csv with the saved models, writing the prediction and
+# probability from each model for every row
+def score_csv(input_path, output_path, directory=model_store.models_path,
+              chunk_rows=chunk_size):
+    # Load every saved model, which must have been trained already
+    manifest = model_store.load_manifest(directory)
+    if len(manifest) == 0:
+        print("No saved models found in " + directory)
+        return None
+    models = {target: model_store.load_model(target, directory)
+              for target in manifest}
+
+    rows = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as output:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_rows,
+                                 encoding="utf-8"):
+            chunk = add_features(chunk)
+
+            # Keep the client name so predictions can be matched back up
+            scores = pd.DataFrame({"Client Name": chunk["Client Name"]})
+            for target, model in models.items():
+                with instrumentation.stage("predict", rows=len(chunk),
+                                           target=target):
+                    probability = model.predict_proba(chunk)[:, 1]
+                scores[target] = (probability > 0.5).astype(int)
+                scores[target + " probability"] = probability
+
+            # Only write the header with the first chunk
+            scores.to_csv(output, index=False, header=rows == 0)
+            rows += len(chunk)
+
+    print("Scored " + str(rows) + " rows")
+    return rows
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python batch_score.py <input csv> <output csv> "
+              "[models folder]")
+        sys.exit(1)
+
+    if len(sys.argv) > 3:
+        score_csv(sys.argv[1], sys.argv[2], sys.argv[3])
+    else:
+        score_csv(sys.argv[1], sys.argv[2])
@@ -0,0 +1,2 @@
+# Benchmarks for the analysis scripts - run from the top of the repository
+# with python -m benchmarks.<name> so the scripts and Data/ paths resolve
@@ -0,0 +1,46 @@
+# Benchmark of the native categorical xgboost backend against the one-hot
+# pipeline, comparing the grid search time, the best cross validation score
+# and the accuracy on the held out data for each target
+import time
+import numpy as np
+from sklearn.metrics import accuracy_score
+import classifiers
+import model_tests
+import native_backend
+import search_modes
+
+# The held out data for each target
+testing_sets = {"average_grade": model_tests.overall_testing,
+                "non_zero_grade": model_tests.zero_removed_testing,
+                "business_plan": model_tests.overall_testing}
+
+
+# Function to time a grid search and score it on the held out data
+def run_backend(target, backend):
+    start = time.perf_counter()
+    if backend == "native":
+        search = native_backend.native_classifier(target)
+    else:
+        # Run the one-hot grid search in this process, like the native one
+        features, labels = classifiers.target_data(target)
+        search = search_modes.make_search(
+            classifiers.build_pipeline(target),
+            classifiers.targets[target]["param_grid"], "grid", n_jobs=1)
+        search.fit(features, np.ravel(labels))
+    seconds = time.perf_counter() - start
+
+    label = classifiers.targets[target]["label"]
+    testing = testing_sets[target]()
+    holdout = accuracy_score(testing[label].astype(int),
+                             search.predict(testing.drop(columns=[label])))
+    return seconds, search.best_score_, holdout
+
+
+if __name__ == '__main__':
+    print("{:<16}{:<8}{:>10}{:>12}{:>10}".format(
+        "target", "backend", "fit (s)", "cv score", "holdout"))
+    for target in classifiers.targets:
+        for backend in ["onehot", "native"]:
+            seconds, cv_score, holdout = run_backend(target, backend)
+            print("{:<16}{:<8}{:>10.2f}{:>12.4f}{:>10.4f}".format(
+                target, backend, seconds, cv_score, holdout))
@@ -0,0 +1,61 @@
+# Benchmark of the time taken to import the classifiers and model_tests
+# modules, now that the data is only read in when it is first used.
+# Each case is run in a fresh interpreter so nothing is already imported
+import subprocess
+import sys
+
+# Number of times to run each case
+repeats = 5
+
+# Code for each case, each of which prints the seconds it took
+cases = {
+    # Importing the modules, which no longer reads any data
+    "import": """
+import time
+start = time.perf_counter()
+import classifiers, model_tests
+print(time.perf_counter() - start)
+""",
+    # Importing and then using the data, which reads it in once for both
+    "import + first use": """
+import time
+start = time.perf_counter()
+import classifiers, model_tests
+classifiers.training_data()
+classifiers.zero_train_data()
+model_tests.overall_testing()
+model_tests.zero_removed_testing()
+print(time.perf_counter() - start)
+""",
+    # What importing used to cost - both files read by each module with the
+    # python csv engine
+    "previous eager import": """
+import time
+start = time.perf_counter()
+import pandas as pd
+import classifiers, model_tests
+for module in range(2):
+    pd.read_csv(classifiers.data_path, engine="python")
+    pd.read_csv(classifiers.zero_removed_path, engine="python")
+print(time.perf_counter() - start)
+""",
+}
+
+
+# Function to run a case a number of times and get the fastest time
+def time_case(code):
+    timings = []
+    for repeat in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code],
+                                capture_output=True, text=True, check=True)
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+
+if __name__ == '__main__':
+    results = {name: time_case(code) for name, code in cases.items()}
+    for name, seconds in results.items():
+        print("{:<24}{:.3f}s".format(name, seconds))
+
+    print("\nSpeed-up of import over the previous eager import: {:.1f}x"
+          .format(results["previous eager import"] / results["import"]))
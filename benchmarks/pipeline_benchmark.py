@@ -0,0 +1,160 @@
+# Benchmark of each stage of the nightly run - loading the csv, deriving the
+# added columns, writing the derived csv files, encoding the features,
+# fitting the grid search and predicting - on the bundled data and on
+# synthetic data learnt from it, a number of times its size. The time and peak resident memory of every stage is
+# written as json, which can be compared against an earlier run.
+#
+# Usage: python -m benchmarks.pipeline_benchmark [--scales 1 10 100]
+#            [--output results.json] [--baseline baseline.json]
+#            [--fit-rows 200000]
+import argparse
+import json
+import os
+import tempfile
+import time
+import threading
+import numpy as np
+from sklearn.model_selection import GridSearchCV
+from sklearn.pipeline import Pipeline
+from xgboost.sklearn import XGBClassifier
+import classifiers
+import data_cache
+import data_investigation
+import feature_engine
+import feature_store
+import instrumentation
+import synthetic_data
+
+# The target used for the grid fit and predict stages
+benchmark_target = "average_grade"
+
+
+# Class to time a stage and record its peak memory. The memory is sampled
+# from a background thread so the stage itself runs at full speed
+class Stage:
+
+    def __init__(self, results, name, interval=0.01):
+        self.results = results
+        self.name = name
+        self.interval = interval
+
+    def sample(self):
+        while not self.finished.wait(self.interval):
+            self.peak = max(self.peak, instrumentation.resident_bytes())
+
+    def __enter__(self):
+        self.peak = instrumentation.resident_bytes()
+        self.finished = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.finished.set()
+        self.sampler.join()
+        self.results[self.name] = {
+            "seconds": seconds,
+            "peak_rss_bytes": max(self.peak,
+                                  instrumentation.resident_bytes())}
+
+
+# Function to run every stage on one csv of Invest NI data
+def run_stages(source_path, work_dir, fit_rows):
+    stages = {}
+    append_path = os.path.join(work_dir, "appended_data.csv")
+    zero_removed_path = os.path.join(work_dir, "zero_removed_data.csv")
+
+    # The streaming reference path, which loads, derives and writes together
+    with Stage(stages, "derive_reference"):
+        data_investigation.derive_data(source_path, append_path,
+                                       zero_removed_path, True)
+
+    # The columnar engine, one stage at a time
+    with Stage(stages, "csv_load"):
+        frame, columns = feature_engine.load_columns(source_path)
+    with Stage(stages, "feature_derivation"):
+        appended, zero_removed, averages = \
+            feature_engine.derive_features(frame, columns)
+    with Stage(stages, "csv_write"):
+        feature_engine.write_frame(appended, append_path, True)
+        feature_engine.write_frame(zero_removed, zero_removed_path, True)
+    del frame, columns, appended, zero_removed
+
+    # Load the derived data as the classifiers do and encode it
+    with Stage(stages, "derived_load"):
+        data = data_cache.read_typed_csv(append_path)
+    with Stage(stages, "encoding"):
+        store = feature_store.FeatureStore(data)
+
+    # Fit the grid search on up to fit_rows rows and predict the rest
+    label = classifiers.targets[benchmark_target]["label"]
+    training_rows = min(fit_rows, int(len(data) * 0.75))
+    training = data[:training_rows]
+    testing = data[training_rows:]
+    model = Pipeline(steps=[
+        ("preprocessor", feature_store.StoreEncoder(store)),
+        ("regressor", XGBClassifier(objective="binary:logistic", seed=1))
+    ])
+    search = GridSearchCV(
+        model, classifiers.targets[benchmark_target]["param_grid"], cv=5,
+        n_jobs=1, scoring="accuracy")
+    with Stage(stages, "grid_fit"):
+        search.fit(training.drop(columns=[label]),
+                   np.ravel(training[label]))
+    with Stage(stages, "predict"):
+        search.predict(testing.drop(columns=[label]))
+
+    return {"rows": len(data), "fit_rows": training_rows, "stages": stages}
+
+
+# Function to print how each stage compares to a baseline run
+def compare_baseline(results, baseline):
+    print("\nCompared to baseline (new / old time):")
+    for dataset, result in results.items():
+        if dataset not in baseline:
+            continue
+        for stage, timing in result["stages"].items():
+            old_timing = baseline[dataset]["stages"].get(stage)
+            if old_timing is None:
+                continue
+            print("    {:<12}{:<20}{:>8.2f}x".format(
+                dataset, stage, timing["seconds"] / old_timing["seconds"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the Invest NI pipeline")
+    parser.add_argument("--scales", type=float, nargs="+",
+                        default=[1, 10, 100],
+                        help="sizes of the data to run, as multiples of the "
+                             "bundled csv (1 is the bundled csv itself)")
+    parser.add_argument("--fit-rows", type=int, default=200000,
+                        help="most rows to fit the grid search on")
+    parser.add_argument("--output", help="json file to write results to")
+    parser.add_argument("--baseline", help="json file of an earlier run")
+    arguments = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in arguments.scales:
+            dataset = "x{:g}".format(scale)
+            source_path = data_investigation.invest_path
+            if scale != 1:
+                source_path = os.path.join(work_dir, dataset + ".csv")
+                synthetic_data.generate_scaled(source_path, scale)
+            print("Running " + dataset)
+            results[dataset] = run_stages(source_path, work_dir,
+                                          arguments.fit_rows)
+            for stage, timing in results[dataset]["stages"].items():
+                print("    {:<20}{:>9.3f}s{:>12.1f}MB".format(
+                    stage, timing["seconds"], timing["peak_rss_bytes"] / 1e6))
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=1)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline, encoding="utf-8") as baseline_file:
+            compare_baseline(results, json.load(baseline_file))
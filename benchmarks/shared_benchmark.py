@@ -0,0 +1,153 @@
+# Benchmark of the grid search with the training data frame pickled out to
+# the workers, as the classifiers do by default, against the shared memory
+# mapped matrix of shared_matrix. Each mode is run in a fresh interpreter,
+# and the memory of it and all of its worker processes is sampled while it
+# fits. Memory is the proportional set size (shared pages are split between
+# the processes mapping them), so the memory mapped pages aren't counted
+# once per worker.
+#
+# Usage: python -m benchmarks.shared_benchmark [--scale 5] [--n-jobs 2]
+#            [--output results.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from sklearn.pipeline import Pipeline
+from xgboost.sklearn import XGBClassifier
+import classifiers
+import data_cache
+import feature_engine
+import feature_store
+import search_modes
+import shared_matrix
+import synthetic_data
+
+# The target whose grid is searched
+benchmark_target = "average_grade"
+# Ways of running the search
+modes = ["pickled", "shared"]
+
+
+# Function to get the ids of a process and every process below it
+def process_tree(root):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", entry, "stat")) as stat:
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    tree = [root]
+    for pid in tree:
+        tree.extend(children.get(pid, []))
+    return tree
+
+
+# Function to get the proportional set size of a process in bytes
+def process_pss(pid):
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as smaps:
+            for line in smaps:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+# Function to sample the memory of this process and its workers until told
+# to stop, keeping the peak
+def sample_tree(peak, finished, interval=0.05):
+    while not finished.wait(interval):
+        peak[0] = max(peak[0], sum(process_pss(pid)
+                                   for pid in process_tree(os.getpid())))
+
+
+# Function to run one mode of the search on a derived csv, printing the
+# time and peak memory as json
+def run_mode(mode, csv_path, n_jobs):
+    data = data_cache.read_typed_csv(csv_path)
+    store = feature_store.FeatureStore(data)
+    label = classifiers.targets[benchmark_target]["label"]
+    param_grid = classifiers.targets[benchmark_target]["param_grid"]
+    features, labels = data.drop(columns=[label]), data[[label]]
+    pipeline = Pipeline(steps=[
+        ("preprocessor", feature_store.StoreEncoder(store)),
+        ("regressor", XGBClassifier(objective="binary:logistic", seed=1))
+    ])
+
+    peak = [0]
+    finished = threading.Event()
+    sampler = threading.Thread(target=sample_tree, args=(peak, finished),
+                               daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    if mode == "shared":
+        search = shared_matrix.shared_search(pipeline, features, labels,
+                                             param_grid, n_jobs=n_jobs)
+    else:
+        search = search_modes.make_search(pipeline, param_grid,
+                                          n_jobs=n_jobs)
+        search.fit(features, labels)
+    seconds = time.perf_counter() - start
+    finished.set()
+    sampler.join()
+
+    print(json.dumps({"rows": len(data), "seconds": seconds,
+                      "peak_pss_bytes": peak[0],
+                      "best_score": float(search.best_score_)}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Compare pickled and shared data for the grid search")
+    parser.add_argument("--scale", type=float, default=5,
+                        help="size of the data as a multiple of the bundled "
+                             "csv")
+    parser.add_argument("--n-jobs", type=int, default=2)
+    parser.add_argument("--output", help="json file to write results to")
+    parser.add_argument("--run", choices=modes, help=argparse.SUPPRESS)
+    parser.add_argument("--data", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    # Run a single mode, in the interpreter started for it
+    if arguments.run is not None:
+        run_mode(arguments.run, arguments.data, arguments.n_jobs)
+        sys.exit(0)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, "invest.csv")
+        csv_path = os.path.join(work_dir, "appended.csv")
+        synthetic_data.generate_scaled(source_path, arguments.scale)
+        feature_engine.derive_files(source_path, csv_path,
+                                    os.path.join(work_dir, "zero.csv"), True)
+
+        for mode in modes:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.shared_benchmark",
+                 "--run", mode, "--data", csv_path,
+                 "--n-jobs", str(arguments.n_jobs)],
+                check=True, capture_output=True, text=True).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            print("{:<10}{:>9.2f}s{:>12.1f}MB  best score {:.5f}".format(
+                mode, results[mode]["seconds"],
+                results[mode]["peak_pss_bytes"] / 1e6,
+                results[mode]["best_score"]))
+
+    print("Shared / pickled time: {:.2f}x, memory: {:.2f}x".format(
+        results["shared"]["seconds"] / results["pickled"]["seconds"],
+        results["shared"]["peak_pss_bytes"] /
+        results["pickled"]["peak_pss_bytes"]))
+
+    if arguments.output is not None:
+        with open(arguments.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=1)
@@ -0,0 +1,175 @@
+# This file writes csv files a block of rows at a time from columns of
+# values, rather than building a dict for every row and handing it to
+# csv.DictWriter. A block is given as a dict of column name to a list (or
+# array) of values, or as a data frame. Each block is turned into text in
+# one go and written with a single call, in the same format as DictWriter.
+#
+# Files are written to a temporary file which then replaces the original,
+# so anything reading the file sees either the old file or the new one,
+# never a missing or half written one. A compressed copy can be written
+# alongside in the same pass
+import csv
+import gzip
+import io
+import os
+import contextlib
+
+# zstd compression needs the zstandard package, gzip is always there
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Number of rows turned into text at a time
+block_size = 10000
+# File endings of the compressed copies
+compressions = {"gzip": ".gz", "zstd": ".zst"}
+
+
+# Function to get the values of a column of a block as a list
+def column_values(block, heading):
+    values = block[heading]
+    if hasattr(values, "tolist"):
+        return values.tolist()
+    return values
+
+
+# Function to turn a block of columns into csv text, in the order of the
+# headings. Data frames are written by pandas, with the same line endings as
+# the csv writer
+def block_text(headings, block):
+    if hasattr(block, "to_csv"):
+        return block[headings].to_csv(header=False, index=False,
+                                      lineterminator="\r\n")
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        zip(*[column_values(block, heading) for heading in headings]))
+    return buffer.getvalue()
+
+
+# Function to get the number of rows in a block
+def block_rows(headings, block):
+    return len(block[headings[0]])
+
+
+# Generator that gathers rows (dicts or anything else that can be indexed
+# by name) into blocks of columns. Names maps a heading to the key it has in
+# the rows, where they differ. Data frames are passed on as blocks of their
+# own
+def row_blocks(rows, headings, names=None, rows_per_block=block_size):
+    if names is None:
+        names = {}
+    keys = [(heading, names.get(heading, heading)) for heading in headings]
+
+    # A single data frame is one block
+    if hasattr(rows, "to_csv"):
+        rows = [rows]
+
+    block = []
+    for row in rows:
+        if hasattr(row, "to_csv"):
+            if len(block) > 0:
+                yield {heading: [entry[key] for entry in block]
+                       for heading, key in keys}
+                block = []
+            yield row
+            continue
+        block.append(row)
+        if len(block) == rows_per_block:
+            yield {heading: [entry[key] for entry in block]
+                   for heading, key in keys}
+            block = []
+    if len(block) > 0:
+        yield {heading: [entry[key] for entry in block]
+               for heading, key in keys}
+
+
+# Context manager giving a temporary path for a file, which replaces the
+# file when the block finishes and is removed if it fails
+@contextlib.contextmanager
+def atomic_path(file_path):
+    temp_path = "{}.{}.tmp".format(file_path, os.getpid())
+    try:
+        yield temp_path
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+# Function to open a file for writing compressed bytes
+def open_compressed(file_path, compress):
+    if compress == "gzip":
+        return gzip.open(file_path, "wb")
+    if compress == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(
+            open(file_path, "wb"), closefd=True)
+    raise ValueError("Unknown compression: " + str(compress))
+
+
+# Class to write blocks of columns to every open output, counting the rows
+class BlockWriter:
+
+    def __init__(self, headings, outputs):
+        self.headings = headings
+        self.outputs = outputs
+        self.rows = 0
+
+    def write(self, block):
+        data = block_text(self.headings, block).encode("utf-8")
+        for output in self.outputs:
+            output.write(data)
+        self.rows += block_rows(self.headings, block)
+
+
+# Context manager giving a writer for blocks of columns to a csv, along with
+# a compressed copy if asked for. The header is written first, and the
+# files replace the originals in one step when the block finishes, or are
+# removed if it fails
+@contextlib.contextmanager
+def block_writer(file_path, headings, compress=None):
+    with contextlib.ExitStack() as stack:
+        # Open a temporary file for each output
+        paths = [file_path]
+        if compress is not None:
+            paths.append(file_path + compressions[compress])
+        outputs = []
+        for position, path in enumerate(paths):
+            temp_path = stack.enter_context(atomic_path(path))
+            if position == 0:
+                outputs.append(stack.enter_context(open(temp_path, "wb")))
+            else:
+                outputs.append(stack.enter_context(
+                    open_compressed(temp_path, compress)))
+
+        # Write the header to every output, then hand out the writer
+        text = block_text(headings, {heading: [heading]
+                                     for heading in headings})
+        for output in outputs:
+            output.write(text.encode("utf-8"))
+        yield BlockWriter(headings, outputs)
+
+        # Close the files before they replace the originals
+        for output in outputs:
+            output.close()
+
+
+# Function to write blocks of columns to a csv, replacing it in one step,
+# along with a compressed copy if asked for. Returns the number of rows
+def write_blocks(file_path, headings, blocks, compress=None):
+    with block_writer(file_path, headings, compress) as writer:
+        for block in blocks:
+            writer.write(block)
+    return writer.rows
+
+
+# Function to write a compressed copy of a file that has already been
+# written
+def compress_file(file_path, compress):
+    with atomic_path(file_path + compressions[compress]) as temp_path:
+        with open(file_path, "rb") as source, \
+                open_compressed(temp_path, compress) as output:
+            for data in iter(lambda: source.read(1 << 20), b""):
+                output.write(data)
@@ -33,72 +33,173 @@ different metric of success.
 """
 
 # Imports
-import pandas as pd
+import argparse
 import numpy as np
-from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.model_selection import GridSearchCV
 from xgboost.sklearn import XGBClassifier
+from xgboost.callback import TrainingCallback
+import data_cache
+import feature_store
+import instrumentation
+import search_modes
+import shared_matrix
 
 # Get the Invest Data
 data_path = "Data/appended_data.csv"
 zero_removed_path = "Data/zero_removed_data.csv"
 
-# Read in the training data
-overall_data = pd.read_csv(data_path, engine="python")
-zero_removed_data = pd.read_csv(zero_removed_path, engine="python")
+# Number of rows used for training - the rest are used for testing in the
+# model_tests.py file
+training_rows = 6500
+zero_training_rows = 6000
 
-# Split out the overall data - Testing is used in the model_tests.py file
-training_data = overall_data[:6500]
-
-# Split out zero removed data - Testing is used in the model_tests.py file
-zero_train_data = zero_removed_data[:6000]
+# Backends the classifiers can be trained with: the one-hot encoded sklearn
+# pipeline, or xgboost's own categorical support (see native_backend.py)
+backends = ["sklearn", "native"]
 
 # Set our random seed
 np.random.seed(0)
 
 
-# Function to classify the average grade data
-def grade_classifier():
-    # Create our testing and training data from the overall data
-    grade_trainer = training_data.drop(columns=["Average Grade"])
-    grade_tester = training_data[["Average Grade"]]
+# Functions to get our data, which is only read in the first time it is used
+# and then shared with model_tests.py
+def overall_data():
+    return data_cache.get_data(data_path)
+
+
+def zero_removed_data():
+    return data_cache.get_data(zero_removed_path)
+
+
+# Split out the overall data
+def training_data():
+    return overall_data()[:training_rows]
+
+
+# Split out zero removed data
+def zero_train_data():
+    return zero_removed_data()[:zero_training_rows]
+
+
+# The classification problems, with the training data for each, the column
+# we are predicting, the csv its features are encoded from and the
+# parameters for its search grid
+targets = {
+    "average_grade": {
+        "data": training_data, "label": "Average Grade", "source": data_path,
+        "param_grid": {
+            'regressor__n_estimators': [100, 300],
+            'regressor__max_depth': [10, 20]
+        }
+    },
+    "non_zero_grade": {
+        "data": zero_train_data, "label": "Average Grade",
+        "source": zero_removed_path,
+        "param_grid": {
+            'regressor__n_estimators': [50, 100],
+            'regressor__max_depth': [10, 20]
+        }
+    },
+    "business_plan": {
+        "data": training_data, "label": "Business Plan Grade",
+        "source": data_path,
+        "param_grid": {
+            'regressor__n_estimators': [50, 100],
+            'regressor__max_depth': [10, 20]
+        }
+    }
+}
 
-    # Categorical features of our data
-    categorical_features = ["SME", "Ownership", "Jobs Created",
-                            "Sector", "Condition"]
 
-    # Create our categorical transformer
-    categorical_pipeline = Pipeline(steps=[
-        ('imputer', SimpleImputer(strategy='constant', fill_value="missing")),
-        ('onehot', OneHotEncoder(handle_unknown="ignore"))
-    ])
+# Function to split the training data of a target into the features and the
+# column we are predicting
+def target_data(target):
+    data = targets[target]["data"]()
+    label = targets[target]["label"]
+    return data.drop(columns=[label]), data[[label]]
+
+
+# Callback that times each fit of a booster when the instrumentation is on.
+# It goes into the worker processes with the booster, so every fold of every
+# search is traced
+class FitTimer(TrainingCallback):
+
+    def before_training(self, model):
+        self.stage = instrumentation.stage("booster_fit")
+        self.stage.__enter__()
+        return model
+
+    def after_training(self, model):
+        self.stage.set(rounds=model.num_boosted_rounds())
+        self.stage.__exit__(None, None, None)
+        del self.stage
+        return model
+
+
+# Function to get the callbacks for the boosters, which are only timed when
+# the instrumentation is on
+def booster_callbacks():
+    if instrumentation.enabled():
+        return [FitTimer()]
+    return None
 
-    # Apply our pipeline to the given features
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("cat", categorical_pipeline, categorical_features)
-        ]
-    )
+
+# Function to run the grid search for a target with a backend other than the
+# one-hot pipeline. The native backend searches its own DMatrix, so it can
+# only run the exhaustive search without early stopping
+def backend_search(target, backend, search, shared, early_stopping_rounds):
+    if backend not in backends:
+        raise ValueError("Unknown backend: " + str(backend))
+    if search != "grid" or shared or early_stopping_rounds is not None:
+        raise ValueError("The native backend only runs the grid search")
+
+    # The native backend imports this file, so it is only imported here
+    import native_backend
+    return native_backend.native_classifier(target)
+
+
+# Function to create the pipeline for a target
+def build_pipeline(target, per_fold=False):
+    # Get the encoded categorical features, shared between the classifiers
+    # unless we want the encoder fitted in each fold
+    preprocessor = feature_store.preprocessor(targets[target]["source"],
+                                              per_fold)
 
     # Perform logistic regression using XGB Boosting
-    regr = Pipeline(steps=[
+    return Pipeline(steps=[
         ("preprocessor", preprocessor),
-        ("regressor", XGBClassifier(objective="binary:logistic", seed=1))
+        ("regressor", XGBClassifier(objective="binary:logistic", seed=1,
+                                    callbacks=booster_callbacks()))
     ])
 
-    # Create the parameters for our search grid
-    param_grid = {
-        'regressor__n_estimators': [100, 300],
-        'regressor__max_depth': [10, 20]
-    }
 
-    # Perform a grid search to find the best combination of features
-    grid_search = GridSearchCV(
-        regr, param_grid, cv=5, verbose=3, n_jobs=2, scoring="accuracy"
-    )
+# Function to classify the average grade data
+@instrumentation.timed()
+def grade_classifier(per_fold=False, search="grid", shared=False,
+                     early_stopping_rounds=None, backend="sklearn"):
+    # Train with another backend if asked
+    if backend != "sklearn":
+        return backend_search("average_grade", backend, search, shared,
+                              early_stopping_rounds)
+
+    # Create our testing and training data from the overall data
+    grade_trainer, grade_tester = target_data("average_grade")
+
+    # Create our pipeline and the parameters for our search grid
+    regr = build_pipeline("average_grade", per_fold)
+    param_grid = targets["average_grade"]["param_grid"]
+
+    # Search over the shared memory mapped matrix of the features if asked
+    if shared:
+        return shared_matrix.shared_search(
+            regr, grade_trainer, grade_tester, param_grid, search, verbose=3,
+            early_stopping_rounds=early_stopping_rounds)
+
+    # Perform a search to find the best combination of features, exhaustive
+    # unless another search mode is given
+    grid_search = search_modes.make_search(
+        regr, param_grid, search, verbose=3,
+        early_stopping_rounds=early_stopping_rounds)
 
     # Fit to our training data
     grid_search.fit(grade_trainer, grade_tester)
@@ -108,44 +209,32 @@ def grade_classifier():
 
 
 # Function to classify the grade data not including the zero removed values
-def non_zero_grade_classifier():
-    # Testing data for the zero removed data
-    grade_trainer = zero_train_data.drop(columns=["Average Grade"])
-    grade_tester = zero_train_data[["Average Grade"]]
+@instrumentation.timed()
+def non_zero_grade_classifier(per_fold=False, search="grid", shared=False,
+                              early_stopping_rounds=None, backend="sklearn"):
+    # Train with another backend if asked
+    if backend != "sklearn":
+        return backend_search("non_zero_grade", backend, search, shared,
+                              early_stopping_rounds)
 
-    # Categorical features of our data
-    categorical_features = ["SME", "Ownership", "Jobs Created",
-                            "Sector", "Condition"]
+    # Testing data for the zero removed data
+    grade_trainer, grade_tester = target_data("non_zero_grade")
 
-    # Create our categorical transformer
-    categorical_pipeline = Pipeline(steps=[
-        ('imputer', SimpleImputer(strategy='constant', fill_value="missing")),
-        ('onehot', OneHotEncoder(handle_unknown="ignore"))
-    ])
+    # Create our pipeline and the parameters for our search grid
+    regr = build_pipeline("non_zero_grade", per_fold)
+    param_grid = targets["non_zero_grade"]["param_grid"]
 
-    # Apply our pipeline to the given features
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("cat", categorical_pipeline, categorical_features)
-        ]
-    )
+    # Search over the shared memory mapped matrix of the features if asked
+    if shared:
+        return shared_matrix.shared_search(
+            regr, grade_trainer, grade_tester, param_grid, search, verbose=3,
+            early_stopping_rounds=early_stopping_rounds)
 
-    # Perform logistic regression using XGB Boosting
-    regr = Pipeline(steps=[
-        ("preprocessor", preprocessor),
-        ("regressor", XGBClassifier(objective="binary:logistic", seed=1))
-    ])
-
-    # Create the parameters for our search grid
-    param_grid = {
-        'regressor__n_estimators': [50, 100],
-        'regressor__max_depth': [10, 20]
-    }
-
-    # Perform a grid search to find the best combination of features
-    grid_search = GridSearchCV(
-        regr, param_grid, cv=5, verbose=3, n_jobs=2, scoring="accuracy"
-    )
+    # Perform a search to find the best combination of features, exhaustive
+    # unless another search mode is given
+    grid_search = search_modes.make_search(
+        regr, param_grid, search, verbose=3,
+        early_stopping_rounds=early_stopping_rounds)
 
     # Fit to our training data
     grid_search.fit(grade_trainer, grade_tester)
@@ -155,44 +244,32 @@ def non_zero_grade_classifier():
 
 
 # Function to classify the business grade of the investment
-def business_plan_classifier():
-    # Create our testing and training data from the overall data
-    grade_trainer = training_data.drop(columns=["Business Plan Grade"])
-    grade_tester = training_data[["Business Plan Grade"]]
-
-    # Categorical features of our data
-    categorical_features = ["SME", "Ownership", "Jobs Created",
-                            "Sector", "Condition"]
+@instrumentation.timed()
+def business_plan_classifier(per_fold=False, search="grid", shared=False,
+                             early_stopping_rounds=None, backend="sklearn"):
+    # Train with another backend if asked
+    if backend != "sklearn":
+        return backend_search("business_plan", backend, search, shared,
+                              early_stopping_rounds)
 
-    # Create our categorical transformer
-    categorical_pipeline = Pipeline(steps=[
-        ('imputer', SimpleImputer(strategy='constant', fill_value="missing")),
-        ('onehot', OneHotEncoder(handle_unknown="ignore"))
-    ])
-
-    # Apply our pipeline to the given features
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ("cat", categorical_pipeline, categorical_features)
-        ]
-    )
+    # Create our testing and training data from the overall data
+    grade_trainer, grade_tester = target_data("business_plan")
 
-    # Perform logistic regression using XGB Boosting
-    regr = Pipeline(steps=[
-        ("preprocessor", preprocessor),
-        ("regressor", XGBClassifier(objective="binary:logistic", seed=1))
-    ])
+    # Create our pipeline and the parameters for our search grid
+    regr = build_pipeline("business_plan", per_fold)
+    param_grid = targets["business_plan"]["param_grid"]
 
-    # Create the parameters for our search grid
-    param_grid = {
-        'regressor__n_estimators': [50, 100],
-        'regressor__max_depth': [10, 20]
-    }
+    # Search over the shared memory mapped matrix of the features if asked
+    if shared:
+        return shared_matrix.shared_search(
+            regr, grade_trainer, grade_tester, param_grid, search,
+            early_stopping_rounds=early_stopping_rounds)
 
-    # Perform a grid search to find the best combination of features
-    grid_search = GridSearchCV(
-        regr, param_grid, cv=5, n_jobs=2, scoring="accuracy"
-    )
+    # Perform a search to find the best combination of features, exhaustive
+    # unless another search mode is given
+    grid_search = search_modes.make_search(
+        regr, param_grid, search,
+        early_stopping_rounds=early_stopping_rounds)
 
     # Fit to our training data
     grid_search.fit(grade_trainer, grade_tester)
@@ -203,22 +280,37 @@ def business_plan_classifier():
 
 # If main function, print out values for best scores
 if __name__ == '__main__':
-
-    # Call the average grade classifier
-    avg_grade_grid = grade_classifier()
-
-    # Call the zero removed grade classifier
-    non_zero_grid = non_zero_grade_classifier()
-
-    # Call the business plan grade classifier
-    business_grade_grid = business_plan_classifier()
+    # The training engine imports this file, so it is only imported here
+    import training_engine
+
+    parser = argparse.ArgumentParser(
+        description="Train the Invest NI classifiers")
+    parser.add_argument("--early-stopping-rounds", type=int,
+                        help="stop each fit once a validation split hasn't "
+                             "improved for this many rounds")
+    parser.add_argument("--backend", choices=backends, default="sklearn",
+                        help="train the one-hot pipeline or xgboost's own "
+                             "categorical support")
+    arguments = parser.parse_args()
+
+    if arguments.backend == "sklearn":
+        # Train every target together, on a process for each core
+        results = training_engine.train_all(
+            early_stopping_rounds=arguments.early_stopping_rounds)
+    else:
+        results = {
+            "average_grade": grade_classifier(backend=arguments.backend),
+            "non_zero_grade": non_zero_grade_classifier(
+                backend=arguments.backend),
+            "business_plan": business_plan_classifier(
+                backend=arguments.backend)}
 
     # Output the scores for each and print the best features
     print("\n\nAverage Grade Grid Search\nBest Score: {}"
-          .format(avg_grade_grid.best_score_))
+          .format(results["average_grade"].best_score_))
 
     print("\n\nNon-Zero Grade Grid Search\nBest Score: {}"
-          .format(non_zero_grid.best_score_))
+          .format(results["non_zero_grade"].best_score_))
 
     print("\n\nBusiness Grade Grid Search\nBest Score: {}"
-          .format(business_grade_grid.best_score_))
+          .format(results["business_plan"].best_score_))
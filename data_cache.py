@@ -0,0 +1,131 @@
+# This file keeps a typed binary copy of the derived data sets next to their
+# csv files, so they can be loaded without parsing the csv and inferring the
+# types every time. The copy is rebuilt whenever the csv changes
+import os
+import json
+import hashlib
+import pandas as pd
+import instrumentation
+import parallel_csv
+
+# Feather keeps the columns typed and can be memory mapped, but needs pyarrow.
+# Without it we fall back to a pickle of the data frame
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Columns that hold a small set of repeated values
+categorical_columns = ["Condition", "Country", "SME", "Ownership", "Status",
+                       "Constituency", "Sector"]
+# Columns that hold True/False markers
+boolean_columns = ["Business Plan Grade", "Average Grade", "Jobs Created"]
+# The data sets loaded in this process, along with the signature of the csv
+# each was loaded from
+loaded = {}
+
+
+# Function to get the path of the cache and its metadata for a csv
+def cache_paths(csv_path):
+    base_path = os.path.splitext(csv_path)[0]
+    if feather is not None:
+        cache_path = base_path + ".feather"
+    else:
+        cache_path = base_path + ".pkl"
+    return cache_path, base_path + ".cache.json"
+
+
+# Function to describe the current state of a csv, using the modified time
+# and size, plus a hash of the contents if asked for
+def source_signature(csv_path, use_hash=False):
+    stat = os.stat(csv_path)
+    signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    if use_hash:
+        digest = hashlib.sha1()
+        with open(csv_path, "rb") as csvfile:
+            for block in iter(lambda: csvfile.read(1 << 20), b""):
+                digest.update(block)
+        signature["sha1"] = digest.hexdigest()
+    return signature
+
+
+# Function to read a csv with the types we want for each column
+def read_typed_csv(csv_path):
+    frame = parallel_csv.read_frame(csv_path, encoding="utf-8")
+
+    # Store the repeated values as categories and the markers as bools
+    for column in categorical_columns:
+        if column in frame:
+            frame[column] = frame[column].astype("category")
+    for column in boolean_columns:
+        if column in frame:
+            frame[column] = frame[column].astype(bool)
+    return frame
+
+
+# Function to check if the cache for a csv is still valid
+def cache_valid(csv_path, use_hash=False):
+    cache_path, meta_path = cache_paths(csv_path)
+    if not os.path.isfile(cache_path) or not os.path.isfile(meta_path):
+        return False
+
+    with open(meta_path, encoding="utf-8") as meta_file:
+        cached_signature = json.load(meta_file)
+
+    # Compare against the csv as it is now
+    return cached_signature == source_signature(csv_path, use_hash)
+
+
+# Function to write the cache for a csv
+def write_cache(frame, csv_path, use_hash=False):
+    cache_path, meta_path = cache_paths(csv_path)
+
+    # Write to temporary files then replace so readers never see half a cache.
+    # The temporary names are kept apart for each process, as several may
+    # build the same cache at once
+    temp_suffix = ".{}.tmp".format(os.getpid())
+    if feather is not None:
+        feather.write_feather(frame, cache_path + temp_suffix)
+    else:
+        frame.to_pickle(cache_path + temp_suffix, compression=None)
+    os.replace(cache_path + temp_suffix, cache_path)
+
+    with open(meta_path + temp_suffix, "w", encoding="utf-8") as meta_file:
+        json.dump(source_signature(csv_path, use_hash), meta_file)
+    os.replace(meta_path + temp_suffix, meta_path)
+
+
+# Function to load a data set, from the cache if it is up to date, otherwise
+# from the csv (which then refreshes the cache)
+@instrumentation.timed()
+def load_data(csv_path, use_hash=False):
+    cache_path = cache_paths(csv_path)[0]
+
+    if cache_valid(csv_path, use_hash):
+        if feather is not None:
+            return feather.read_feather(cache_path, memory_map=True)
+        return pd.read_pickle(cache_path, compression=None)
+
+    frame = read_typed_csv(csv_path)
+    write_cache(frame, csv_path, use_hash)
+    return frame
+
+
+# Function to get a data set that is loaded on first use, after which the
+# same copy is shared by everything in this process until the csv changes
+def get_data(csv_path):
+    signature = source_signature(csv_path)
+    if csv_path not in loaded or loaded[csv_path][0] != signature:
+        loaded[csv_path] = (signature, load_data(csv_path))
+    return loaded[csv_path][1]
+
+
+# Function to remove the cache for a csv
+def clear_cache(csv_path):
+    for file_path in cache_paths(csv_path):
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+    # Drop any copy already loaded in this process too
+    loaded.pop(csv_path, None)
@@ -2,32 +2,74 @@
 # The methods can be called to get the results, or if ran as main will
 # output the results in a terminal
 import csv
+import bulk_writer
 import data_manipulation as dm
+import instrumentation
+import parallel_csv
 
 # File paths
 invest_path = "Data/invest_ni.csv"  # Invest NI data path
 append_path = "Data/appended_data.csv"  # Invest NI data with added columns
 zero_removed_path = "Data/zero_removed_data.csv"    # Remove 0 gain entries
 
-# Data lists to hold our information
-invest_list = []
-gain_list = []
-append_list = []
+# Number of rows marked and written at a time by derive_data
+chunk_size = 10000
+
+
+# Generator that reads the values from a csv one row at a time, or in lists
+# of chunk_rows rows if given, so the whole file is never held in memory
+def iterate_data(data_source, chunk_rows=None):
+    # Create a data reader object, which reads with several processes if
+    # the parallel csv backend is chosen
+    data_reader = parallel_csv.iterate_rows(data_source)
+    rows_read = 0
+
+    # Hand out each row as it is read
+    if chunk_rows is None:
+        for row in data_reader:
+            rows_read += 1
+            yield row
+        instrumentation.count("rows_read", rows_read)
+        return
+
+    # Otherwise gather the rows into chunks
+    chunk = []
+    for row in data_reader:
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            rows_read += len(chunk)
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        rows_read += len(chunk)
+        yield chunk
+    instrumentation.count("rows_read", rows_read)
 
 
 # Function to get the values from a csv and put into a list
 def data_retrieve(data_list, data_source):
-    # Open our connection to the given source
-    with open(data_source, newline='') as csvfile:
-        # Create a data reader object
-        data_reader = csv.DictReader(csvfile)
-        # For each row, append to our data list
-        for row in data_reader:
-            data_list.append(row)
+    # For each row, append to our data list
+    data_list.extend(iterate_data(data_source))
+
+
+# Function to calculate the grade for an entry using 1 - (Total Assistance /
+# Total Investment) so that the values are normalised
+def grade_score(entry):
+    # If either are 0, then just grade score to 0
+    if entry["Total Assistance"] == "0" or entry["Total Investment"] == "0":
+        return 0
+    # Otherwise calculate the grade score
+    return 1 - (float(entry["Total Assistance"]) /
+                float(entry["Total Investment"]))
 
 
-# Function to calculate the average investment gain
-def average_gain(data_list):
+# Function to calculate the average investment gain. Entries with a gain are
+# added to the gain list if one is given
+@instrumentation.timed()
+def average_gain(data_list, gain_list=None):
+    # Use our own list for the entries with a gain if one isn't given
+    if gain_list is None:
+        gain_list = []
 
     # Check if this has an investment gain column, otherwise print err + return
     if "Investment Gain" not in data_list[0]:
@@ -39,25 +81,17 @@ def average_gain(data_list):
 
     # Iterate through the list
     for entry in data_list:
-        # Calculate the grade for this entry using 1 - (Total Assistance/Total
-        # Investment) so that the values are normalised
-        # If either are 0, then just grade score to 0
-        if entry["Total Assistance"] == "0" or entry["Total Investment"] == "0":
-            # Set grade score to 0
-            grade_score = 0
-        # Otherwise calculate the grade score
-        else:
-            grade_score = 1 - (float(entry["Total Assistance"]) /
-                               float(entry["Total Investment"]))
+        # Calculate the grade for this entry
+        entry_score = grade_score(entry)
 
         # Add the investment gain value to the total gain
-        total_grade += grade_score
+        total_grade += entry_score
         # If the gain is 0, add to the zero gain list
         if float(entry["Investment Gain"]) == 0:
             entry["Investment Grade"] = 0
         else:
             gain_list.append(entry)
-            entry["Investment Grade"] = grade_score
+            entry["Investment Grade"] = entry_score
 
     # Get average and average without 0 values
     average_grade = total_grade / len(data_list)
@@ -66,6 +100,7 @@ def average_gain(data_list):
 
 
 # Function to add the marker for job creation feature
+@instrumentation.timed()
 def job_creation_marker(data_list):
     # Iterate through the data list
     for entry in data_list:
@@ -79,6 +114,7 @@ def job_creation_marker(data_list):
 
 
 # Function to add the marker for the below average investment return
+@instrumentation.timed()
 def average_mean_watermark(data_list, average):
     # Iterate through the list and see which investment gains fall below
     for entry in data_list:
@@ -93,6 +129,7 @@ def average_mean_watermark(data_list, average):
 
 # Function to add the marker for the below business estimations
 # (Taken from 5 year strategy bullet points - £1 in, £6 return)
+@instrumentation.timed()
 def business_estimation_watermark(data_list):
     # Iterate through the list and see which investments are below
     for entry in data_list:
@@ -106,43 +143,113 @@ def business_estimation_watermark(data_list):
         entry["Business Value"] = business_value
 
 
+# Function to work out both average grades with a single cheap pass over the
+# numeric columns of the csv, without holding on to any of the rows
+@instrumentation.timed()
+def stream_averages(data_source):
+    # Values to hold the total and the counts
+    total_grade = 0
+    row_count = 0
+    gain_count = 0
+
+    for entry in iterate_data(data_source):
+        total_grade += grade_score(entry)
+        row_count += 1
+        # Count the entries that have a gain
+        if not float(entry["Investment Gain"]) == 0:
+            gain_count += 1
+
+    # Get average and average without 0 values
+    return [total_grade / row_count, total_grade / gain_count]
+
+
+# Function to create the appended and zero removed csv files together. The
+# averages are worked out first, then the rows are read, marked and written
+# to both files a chunk at a time so neither full list is ever held in
+# memory
+@instrumentation.timed()
+def derive_data(data_source, append_file, zero_removed_file,
+                overwrite=False):
+    # Check if either output exists already
+    for file_path in (append_file, zero_removed_file):
+        if dm.check_file(file_path) and not overwrite:
+            # Print out that the file exists
+            print("File exists already")
+            return None
+
+    # First pass for the averages
+    avg_gain, non_zero_avg = stream_averages(data_source)
+
+    # Second pass to mark each row and send it to the writers. Both files
+    # are written to temporary copies which only replace them once every row
+    # is written, so a failed run leaves the old files as they were
+    with bulk_writer.atomic_path(append_file) as append_temp, \
+            bulk_writer.atomic_path(zero_removed_file) as zero_removed_temp, \
+            open(append_temp, "w", newline="", encoding="utf-8") as \
+            append_csv, \
+            open(zero_removed_temp, "w", newline="", encoding="utf-8") as \
+            zero_removed_csv:
+        append_writer = csv.DictWriter(append_csv,
+                                       fieldnames=dm.append_headers)
+        zero_removed_writer = csv.DictWriter(zero_removed_csv,
+                                             fieldnames=dm.append_headers)
+        append_writer.writeheader()
+        zero_removed_writer.writeheader()
+
+        for chunk in iterate_data(data_source, chunk_size):
+            # Entries with no gain are given a grade of 0
+            gain_entries = []
+            for entry in chunk:
+                if float(entry["Investment Gain"]) == 0:
+                    entry["Investment Grade"] = 0
+                else:
+                    entry["Investment Grade"] = grade_score(entry)
+                    gain_entries.append(entry)
+
+            # Add the markers for the appended data
+            job_creation_marker(chunk)
+            business_estimation_watermark(chunk)
+            average_mean_watermark(chunk, avg_gain)
+            dm.write_rows(append_csv, chunk)
+
+            # Entries with a gain are compared to the zero removed average
+            average_mean_watermark(gain_entries, non_zero_avg)
+            dm.write_rows(zero_removed_csv, gain_entries)
+
+    return [avg_gain, non_zero_avg]
+
+
+# Function to bring the csv up to date with the datastore, only downloading
+# the records that are new or have changed, then create the appended and
+# zero removed files again if anything changed or they are missing.
+#
+# The derived files are written again in full rather than only the changed
+# rows. The Average Grade of every row is marked against the average grade
+# of all the rows, so one new or changed record moves the average and can
+# flip the marker of rows that didn't change. Working out the average needs
+# a pass over every row anyway, and a row in the middle of a csv can't be
+# replaced without writing the rest of the file, so the single streamed
+# pass of derive_data costs no more than patching the changed rows would.
+# Returns the averages, as derive_data does
+def refresh_data(data_source, append_file, zero_removed_file):
+    changed = dm.invest_data_refresh(data_source)
+
+    # Nothing changed, so only the averages are needed
+    if len(changed) == 0 and dm.check_file(append_file) and \
+            dm.check_file(zero_removed_file):
+        return stream_averages(data_source)
+    return derive_data(data_source, append_file, zero_removed_file, True)
+
+
 # Run as main method
 if __name__ == '__main__':
 
-    # Check that the file exists
-    if not dm.check_file(invest_path):
-        # Create the file
-        dm.invest_data_retrieve(invest_path)
-
-    # If investment list is empty, run function get the values from csv
-    if len(invest_list) == 0:
-        # Run the data retrieval
-        data_retrieve(invest_list, invest_path)
+    # Refresh the data and create both of our files with the added columns
+    avg_gain, non_zero_avg = refresh_data(invest_path, append_path,
+                                          zero_removed_path)
 
-    # Get average gain on investment
-    avg_gain, non_zero_avg = average_gain(invest_list)
     # Print out the average
     print("Grades are a ratio of 1 - (Total Assistance / Total Investment)")
-    print("Average Investment Grade Across "
-          "" + str(len(invest_list)) + " investments: " + str(avg_gain))
-    print("\nAverage Investment Grade not including Zero-Gainers Across " +
-          str(len(gain_list)) + " investments: "
-                                                        "" + str(non_zero_avg))
-    print("\n\n\n")
-
-    # Copy the data list into the append list and run it through the functions
-    append_list = invest_list.copy()
-    job_creation_marker(append_list)
-    average_mean_watermark(append_list, avg_gain)
-    business_estimation_watermark(append_list)
-
-    # Write this to a new csv
-    dm.append_data(append_list, append_path, True)
-    
-    # Repeat for our gain list 
-    job_creation_marker(gain_list)
-    average_mean_watermark(gain_list, non_zero_avg)
-    business_estimation_watermark(gain_list)
-    
-    # Write to new csv 
-    dm.append_data(gain_list, zero_removed_path, True)
+    print("Average Investment Grade: " + str(avg_gain))
+    print("\nAverage Investment Grade not including Zero-Gainers: " +
+          str(non_zero_avg))
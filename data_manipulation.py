@@ -2,10 +2,58 @@
 import requests
 import os
 import csv
+import json
+import hashlib
+from urllib.parse import urlencode, urljoin
+from requests.adapters import HTTPAdapter
+import bulk_writer
+import instrumentation
 
 invest_ni_api = "https://www.opendatani.gov.uk/api/3/action/datastore_search?" \
                 "resource_id=cd00d300-fcde-4ad8-921e-f1324b75d37e&limit=10000"
 
+# Base API and resource used by the paged retrieval
+invest_ni_base_api = "https://www.opendatani.gov.uk/api/3/action/" \
+                     "datastore_search"
+invest_ni_resource = "cd00d300-fcde-4ad8-921e-f1324b75d37e"
+# Number of records requested for each page
+page_limit = 1000
+
+# Headings of the Invest NI csv
+invest_headers = ["Client Name", "Total Assistance",
+                  "Total Investment", "Investment Gain",
+                  "Condition", "Estimated Jobs",
+                  "Country", "SME", "Ownership", "Status",
+                  "Constituency", "Sector"]
+
+# Field of the API records each heading of the Invest NI csv is read from,
+# apart from the investment gain which is worked out
+source_columns = {"Client Name": "Client Name",
+                  "Total Assistance": "Total Assistance Offered by Invest NI "
+                                      "(£)",
+                  "Total Investment": "Total Investment (Includes Invest NI "
+                                      "Assistance) £",
+                  "Condition": "Conditions of Offer",
+                  "Estimated Jobs": "Jobs to be Created (Assisted)",
+                  "Country": "Country of Ownership when the offer was made",
+                  "SME": "SME",
+                  "Ownership": "Ownership when the offer was made",
+                  "Status": "Project Status",
+                  "Constituency": "Constituency in which business was "
+                                  "located when offer was made",
+                  "Sector": "SIC Sector"}
+
+# Headings of the csv files with the added columns
+append_headers = ["Client Name", "Total Assistance",
+                  "Total Investment", "Investment Gain", "Investment Grade",
+                  "Condition", "Estimated Jobs",
+                  "Country", "SME", "Ownership", "Status",
+                  "Constituency", "Sector", "Business Plan Grade",
+                  "Average Grade", "Jobs Created"]
+
+# Keys of the rows with the added columns that differ from their heading
+derived_names = {"Business Plan Grade": "Business Value"}
+
 
 # Function to check for the csv is present
 def check_file(file_name):
@@ -19,14 +67,101 @@ def check_file(file_name):
         return False
 
 
+# Function to convert a page of records from the API into columns of our
+# csv, reading each field once per page rather than once per record. Fields
+# maps each heading to the field it is read from, if not source_columns
+def record_columns(records, fields=None):
+    if fields is None:
+        fields = source_columns
+    columns = {heading: [data_row[source] for data_row in records]
+               for heading, source in fields.items()}
+
+    # Calculate the investment gain (investment - assistance)
+    columns["Investment Gain"] = [
+        float(investment) - float(assistance) for investment, assistance
+        in zip(columns["Total Investment"], columns["Total Assistance"])]
+    return columns
+
+
+# Function to convert a record from the API into a row of our csv
+def format_record(data_row):
+    columns = record_columns([data_row])
+    return {heading: columns[heading][0] for heading in invest_headers}
+
+
+# Function to create a session that keeps its connections open between pages
+def create_session(pool_size=4, retries=3):
+    # Mount an adapter with a connection pool and retries for both schemes
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Function to read the checkpoint of a paged retrieval, None if there is none
+def load_checkpoint(checkpoint_path):
+    # No checkpoint means we start from the first page
+    if not check_file(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, encoding="utf-8") as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+# Function to save the position after a page has been fully written
+def save_checkpoint(checkpoint_path, checkpoint):
+    # Write to a temporary file then replace so a crash never leaves half a
+    # checkpoint behind
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, checkpoint_path)
+
+
+# Generator that requests one page at a time from the datastore, yielding the
+# records of the page along with the url of the next page (None when done)
+# and the number of records retrieved so far
+def iterate_pages(session, page_url, api_url, offset=0):
+    # Keep requesting pages until we run out of records
+    while page_url is not None:
+        api_request = session.get(page_url)
+        api_request.raise_for_status()
+        result = api_request.json()["result"]
+
+        records = result["records"]
+        offset += len(records)
+        instrumentation.count("api_pages")
+        instrumentation.count("api_records", len(records))
+
+        # Work out the next page from the cursor, stopping on an empty page
+        # or once we have every record
+        next_link = result.get("_links", {}).get("next")
+        if len(records) == 0 or next_link is None or \
+                ("total" in result and offset >= result["total"]):
+            page_url = None
+        else:
+            page_url = urljoin(api_url, next_link)
+
+        yield records, page_url, offset
+
+
 # Function to create the file
-def invest_data_retrieve(file_name, overwrite=False):
+@instrumentation.timed()
+def invest_data_retrieve(file_name, overwrite=False, paged=False,
+                         compress=None, **kwargs):
+    # The paged retrieval handles the file checks itself so it can resume
+    if paged:
+        return invest_data_paged_retrieve(file_name, overwrite,
+                                          compress=compress, **kwargs)
+
     # Check if the file name exists already
     if check_file(file_name):
-        # If we want to overwrite, then delete the file
+        # If we want to overwrite, the original is replaced once the new
+        # file is written
         if overwrite:
-            print("Overwriting file - deleting original")
-            os.remove(file_name)
+            print("Overwriting file - replacing original")
         # Otherwise, we want to print an error and return
         else:
             # Print out that the file exists
@@ -38,121 +173,274 @@ def invest_data_retrieve(file_name, overwrite=False):
     api_request = requests.get(invest_ni_api)
     output = api_request.json()
 
-    print(api_request)
+    # Write the records to the csv as a block of columns
+    records = output['result']["records"]
+    instrumentation.count("api_pages")
+    instrumentation.count("api_records", len(records))
+    bulk_writer.write_blocks(file_name, invest_headers,
+                             [record_columns(records)], compress)
+
+
+# Function to create the file one page at a time, following the datastore
+# cursor so no records are cut off and only one page is held in memory
+def invest_data_paged_retrieve(file_name, overwrite=False,
+                               api_url=invest_ni_base_api,
+                               resource_id=invest_ni_resource,
+                               limit=page_limit, checkpoint_path=None,
+                               session=None, compress=None):
+    # Keep the checkpoint next to the csv unless told otherwise
+    if checkpoint_path is None:
+        checkpoint_path = file_name + ".checkpoint"
+    # The pages are written to a partial file, which replaces the csv once
+    # every page is in, so the csv is never missing or half written
+    partial_path = file_name + ".partial"
+
+    # If a previous run failed part way through, resume from its last page
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint is not None and check_file(partial_path):
+        print("Resuming retrieval from offset " + str(checkpoint["offset"]))
+        # Cut off anything written after the last completed page
+        with open(partial_path, "r+b") as csvfile:
+            csvfile.truncate(checkpoint["size"])
+        page_url = checkpoint["next"]
+        offset = checkpoint["offset"]
+        mode = "a"
+    else:
+        # Check if the file name exists already
+        if check_file(file_name):
+            # If we want to overwrite, the original is replaced once the new
+            # file is written
+            if overwrite:
+                print("Overwriting file - replacing original")
+            # Otherwise, we want to print an error and return
+            else:
+                # Print out that the file exists
+                print("File exists already")
+                return None
+
+        # Start from the first page
+        page_url = api_url + "?" + urlencode({"resource_id": resource_id,
+                                              "limit": limit, "offset": 0})
+        offset = 0
+        mode = "w"
+
+    # Use our own pooled session if one has not been given
+    own_session = session is None
+    if own_session:
+        session = create_session()
 
-    # Open our csv writer
-    with open(file_name, "w", newline="", encoding="utf-8") as csvfile:
-        # Create headings and the writer object
-        headers = ["Client Name", "Total Assistance",
-                   "Total Investment", "Investment Gain",
-                   "Condition", "Estimated Jobs",
-                   "Country", "SME", "Ownership", "Status",
-                   "Constituency", "Sector"]
-        data_writer = csv.DictWriter(csvfile, fieldnames=headers)
+    try:
+        with open(partial_path, mode, newline="",
+                  encoding="utf-8") as csvfile:
+            # Only write the header for a new file
+            if mode == "w":
+                csv.writer(csvfile).writerow(invest_headers)
 
-        # Write the header
+            # Write each page as a block of columns as it is parsed
+            for records, page_url, offset in iterate_pages(session, page_url,
+                                                           api_url, offset):
+                csvfile.write(bulk_writer.block_text(
+                    invest_headers, record_columns(records)))
+
+                # Make sure the page is on disk before recording it
+                csvfile.flush()
+                os.fsync(csvfile.fileno())
+                save_checkpoint(checkpoint_path,
+                                {"next": page_url, "offset": offset,
+                                 "size": csvfile.tell()})
+    finally:
+        if own_session:
+            session.close()
+
+    # Finished, so swap in the csv and drop the checkpoint
+    os.replace(partial_path, file_name)
+    os.remove(checkpoint_path)
+    if compress is not None:
+        bulk_writer.compress_file(file_name, compress)
+    return offset
+
+
+# Function to create a fingerprint of a csv row so changes can be detected
+def record_hash(row):
+    # Join the values in heading order and hash them
+    row_text = "\x1f".join(str(row[heading]) for heading in invest_headers)
+    return hashlib.sha1(row_text.encode("utf-8")).hexdigest()
+
+
+# Function to describe the contents of a csv, so an index can tell if it
+# was written for the csv as it is now
+def csv_signature(file_name):
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as csvfile:
+        for block in iter(lambda: csvfile.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": os.path.getsize(file_name), "sha1": digest.hexdigest()}
+
+
+# Function to read the index of datastore ids for a csv, in csv row order,
+# with the hash of each row. Returns an empty dict if there is no index yet,
+# or if the csv has changed since the index was written, as its rows can
+# then no longer be matched to the ids by position
+def load_index(index_path, file_name):
+    if not check_file(index_path) or not check_file(file_name):
+        return {}
+
+    with open(index_path, encoding="utf-8") as index_file:
+        saved = json.load(index_file)
+    if not isinstance(saved, dict) or \
+            saved.get("signature") != csv_signature(file_name):
+        print("Index doesn't match the csv - rebuilding it")
+        return {}
+    return dict(saved["rows"])
+
+
+# Function to save the index of datastore ids, in csv row order, along with
+# the signature of the csv it was written for
+def save_index(index_path, index, file_name):
+    # Write to a temporary file then replace it
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as index_file:
+        json.dump({"signature": csv_signature(file_name),
+                   "rows": list(index.items())}, index_file)
+    os.replace(temp_path, index_path)
+
+
+# Function to refresh the csv with only the records that are new or have
+# changed since the last refresh, keyed by the datastore _id.
+# Returns a dict of _id to the new csv row for every changed record, with
+# None for records that are no longer in the datastore.
+# With new_only, only records past the ones we already hold are requested,
+# which relies on the datastore only ever having records added
+@instrumentation.timed()
+def invest_data_refresh(file_name, api_url=invest_ni_base_api,
+                        resource_id=invest_ni_resource, limit=page_limit,
+                        index_path=None, session=None, new_only=False):
+    # Keep the index next to the csv unless told otherwise
+    if index_path is None:
+        index_path = file_name + ".index"
+
+    # Without both the csv and an index written for it we can't tell what
+    # has changed, so every record will be treated as new
+    index = load_index(index_path, file_name)
+
+    # Start from the first page, or after the records we have for new only
+    params = {"resource_id": resource_id, "limit": limit, "offset": 0}
+    if new_only:
+        params["offset"] = len(index)
+        params["sort"] = "_id asc"
+    page_url = api_url + "?" + urlencode(params)
+
+    # Use our own pooled session if one has not been given
+    own_session = session is None
+    if own_session:
+        session = create_session()
+
+    # Compare each record against the index as the pages arrive, only
+    # keeping hold of the ones that changed
+    changed = {}
+    seen = set()
+    try:
+        for records, _, _ in iterate_pages(session, page_url, api_url,
+                                           params["offset"]):
+            for data_row in records:
+                row = format_record(data_row)
+                key = str(data_row["_id"])
+                seen.add(key)
+                if index.get(key) != record_hash(row):
+                    changed[key] = row
+    finally:
+        if own_session:
+            session.close()
+
+    # A full scan also tells us which records have been removed
+    if not new_only:
+        for key in index:
+            if key not in seen:
+                changed[key] = None
+
+    # Nothing to merge so leave the csv untouched
+    if len(changed) == 0:
+        print("No changes found")
+        return changed
+
+    # Merge the changes into a temporary copy of the csv
+    temp_path = file_name + ".tmp"
+    new_index = {}
+    with open(temp_path, "w", newline="", encoding="utf-8") as temp_file:
+        data_writer = csv.DictWriter(temp_file, fieldnames=invest_headers)
         data_writer.writeheader()
-        # Go through each row in the output and write to csv
-        for data_row in output['result']["records"]:
-
-            # Calculate the investment gain (investment - assistance)
-            gain = float(data_row["Total Investment (Includes Invest NI " \
-                                  "Assistance) £"]) - float(data_row["Total " \
-                                                                     "Assistance " \
-                                                                     "Offered by " \
-                                                                     "Invest NI (£)"])
-
-            # Write this row to the csv
-            data_writer.writerow({"Client Name": data_row["Client Name"],
-                                  "Total Assistance": data_row[
-                                      "Total Assistance "
-                                      "Offered by "
-                                      "Invest NI (£)"],
-                                  "Total Investment": data_row[
-                                      "Total Investment (Includes "
-                                      "Invest NI Assistance) £"],
-                                  "Investment Gain": gain,
-                                  "Condition": data_row[
-                                      "Conditions of Offer"],
-
-                                  "Estimated Jobs": data_row["Jobs "
-                                                             "to be "
-                                                             "Created "
-                                                             "(Assisted)"],
-                                  "Country": data_row[
-                                      "Country of Ownership "
-                                      "when the offer "
-                                      "was made"], "SME": data_row["SME"],
-                                  "Ownership": data_row[
-                                      "Ownership when the "
-                                      "offer was made"],
-                                  "Status": data_row["Project Status"],
-                                  "Constituency": data_row["Constituency "
-                                                           "in which "
-                                                           "business was "
-                                                           "located when "
-                                                           "offer "
-                                                           "was made"],
-                                  "Sector": data_row["SIC Sector"]})
-
-
-# Function for appending data
-def append_data(data_list, file_path, overwrite=False):
+
+        # Go through the existing rows, which are in the same order as the
+        # index, replacing or dropping the ones that changed
+        if len(index) > 0:
+            with open(file_name, newline="", encoding="utf-8") as csvfile:
+                data_reader = csv.DictReader(csvfile)
+                for key, row in zip(index, data_reader):
+                    if record_hash(row) != index[key]:
+                        raise ValueError("Row of " + file_name + " doesn't "
+                                         "match its index entry " + key)
+                    if key in changed:
+                        row = changed[key]
+                        if row is None:
+                            continue
+                    data_writer.writerow(row)
+                    new_index[key] = record_hash(row)
+
+        # Add the records we didn't have before to the end
+        for key, row in changed.items():
+            if key not in index:
+                data_writer.writerow(row)
+                new_index[key] = record_hash(row)
+
+    # Swap in the merged csv and its index
+    os.replace(temp_path, file_name)
+    save_index(index_path, new_index, file_name)
+
+    print("Refreshed " + str(len(changed)) + " records")
+    return changed
+
+
+# Function to write rows with the added columns to an open csv file. The
+# rows can be any iterable of row dicts or of data frame chunks, which are
+# written a block at a time so nothing needs to be held in memory
+def write_rows(csvfile, data_rows):
+    rows_written = 0
+    for block in bulk_writer.row_blocks(data_rows, append_headers,
+                                        derived_names):
+        csvfile.write(bulk_writer.block_text(append_headers, block))
+        rows_written += bulk_writer.block_rows(append_headers, block)
+    instrumentation.count("rows_written", rows_written)
+
+
+# Function for appending data. The data list can be any iterable of row
+# dicts or data frame chunks. A compressed copy ("gzip" or "zstd") can be
+# written alongside
+@instrumentation.timed()
+def append_data(data_list, file_path, overwrite=False, compress=None):
     # Check if the file name exists already
     if check_file(file_path):
-        # If we want to overwrite, then delete the file
+        # If we want to overwrite, the original is replaced once the new
+        # file is written
         if overwrite:
-            print("Overwriting file - deleting original")
-            os.remove(file_path)
+            print("Overwriting file - replacing original")
         # Otherwise, we want to print an error and return
         else:
             # Print out that the file exists
             print("File exists already")
             return None
 
-    # Go through the data list and write to the csv
-    with open(file_path, "w", newline="", encoding="utf-8") as csvfile:
-        # Create headings and the writer object
-        headers = ["Client Name", "Total Assistance",
-                   "Total Investment", "Investment Gain", "Investment Grade",
-                   "Condition", "Estimated Jobs",
-                   "Country", "SME", "Ownership", "Status",
-                   "Constituency", "Sector", "Business Plan Grade",
-                   "Average Grade", "Jobs Created"]
-        data_writer = csv.DictWriter(csvfile, fieldnames=headers)
-
-        # Write the header for our file
-        data_writer.writeheader()
-
-        # Go through each entry in the datalist and write to the csv
-        for data_row in data_list:
-            # write row
-            data_writer.writerow({"Client Name": data_row["Client Name"],
-                                  "Total Assistance":
-                                      data_row["Total Assistance"],
-                                  "Total Investment": data_row[
-                                      "Total Investment"],
-                                  "Investment Gain":
-                                      data_row["Investment Gain"],
-                                  "Investment Grade":
-                                      data_row["Investment Grade"],
-                                  "Condition": data_row["Condition"],
-
-                                  "Estimated Jobs": data_row["Estimated Jobs"],
-                                  "Country": data_row["Country"],
-                                  "SME": data_row["SME"],
-                                  "Ownership": data_row["Ownership"],
-                                  "Status": data_row["Status"],
-                                  "Constituency": data_row["Constituency"],
-                                  "Sector": data_row["Sector"],
-                                  "Jobs Created": data_row["Jobs Created"],
-                                  "Average Grade":
-                                      data_row["Average Grade"],
-                                  "Business Plan Grade":
-                                      data_row["Business Value"]})
+    # Write the data list to a temporary file a block at a time, which then
+    # replaces the csv
+    rows_written = bulk_writer.write_blocks(
+        file_path, append_headers,
+        bulk_writer.row_blocks(data_list, append_headers, derived_names),
+        compress)
+    instrumentation.count("rows_written", rows_written)
 
 
 # Run the retrieval for the Invest NI data if this is the main file
+# Every record is downloaded the first time, then only the ones that are new
+# or have changed
 if __name__ == '__main__':
-    invest_data_retrieve("Data/invest_ni.csv", True)
+    invest_data_refresh("Data/invest_ni.csv")
 
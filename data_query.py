@@ -0,0 +1,277 @@
+# This file answers breakdowns of the Invest NI data - such as the average
+# Investment Grade, total assistance and jobs by Sector, Constituency,
+# Ownership or Condition - without writing a loop for each one.
+#
+# The data is held in a record store. For every text and marker column an
+# index from each category code to the positions of its rows is built once,
+# and grouping by several columns combines their codes. Filters and
+# aggregations (count, sum, mean, min, max, median and quantiles such as
+# "q0.9") are worked out on the NumPy arrays of the store. Each result is
+# cached against the query and the version of the data, so asking again is
+# free until the data changes.
+#
+# Usage: python data_query.py --by Sector [Constituency ...]
+#            [--stats "Investment Grade:mean,median" ...]
+#            [--where "Condition=Covid Support" "Total Assistance=0..5000"]
+#            [--data <csv>]
+import argparse
+import functools
+import json
+import numpy as np
+import pandas as pd
+import data_cache
+import data_investigation
+import record_store
+
+# Aggregations that can be asked for, along with quantiles written as "q"
+# and the fraction, e.g. "q0.25"
+aggregations = ["count", "sum", "mean", "min", "max", "median"]
+
+
+# Function to get the codes of a column to group or filter on, along with
+# the value each code stands for
+def column_codes(store, name):
+    column = store.column(name)
+    if isinstance(column, record_store.CategoryColumn):
+        return column.array(), column.categories
+    if isinstance(column, record_store.BooleanColumn):
+        return column.array().astype(np.uint32), ["False", "True"]
+    raise ValueError("Can't group by the numeric column " + name)
+
+
+# Function to work out one aggregation of the values of a group
+def aggregate_values(values, aggregation):
+    if aggregation == "count":
+        return len(values)
+    if len(values) == 0:
+        return np.nan
+    if aggregation == "sum":
+        return values.sum()
+    if aggregation == "mean":
+        return values.mean()
+    if aggregation == "min":
+        return values.min()
+    if aggregation == "max":
+        return values.max()
+    if aggregation == "median":
+        return np.median(values)
+    if aggregation.startswith("q"):
+        return np.quantile(values, float(aggregation[1:]))
+    raise ValueError("Unknown aggregation " + aggregation)
+
+
+# The group-by indexes of a record store, and the cache of the results of
+# queries on it
+class QueryEngine:
+
+    def __init__(self, store, version=""):
+        self.store = store
+        # Version of the source the store came from, such as the signature
+        # of its csv
+        self.version = version
+        self.indexes = {}
+        self.results = {}
+        self.built_version = None
+        self.check_version()
+
+    # Function to get the version of the data, which changes whenever the
+    # source or the store does
+    def dataset_version(self):
+        return "{}:{}".format(self.version, self.store.version)
+
+    # Function to throw away the indexes and results if the data has changed
+    # since they were built, then build the index of every column again
+    def check_version(self):
+        if self.built_version == self.dataset_version():
+            return
+        self.indexes = {}
+        self.results = {}
+        for name, column in self.store.columns.items():
+            if not isinstance(column, record_store.NumberColumn):
+                self.group_index((name,))
+        self.built_version = self.dataset_version()
+
+    # Function to get the index of a set of columns. Gives the values of
+    # each group, the group of each row and the positions of each group's
+    # rows
+    def group_index(self, names):
+        if names in self.indexes:
+            return self.indexes[names]
+
+        if len(names) == 0:
+            index = {"keys": [()],
+                     "groups": np.zeros(len(self.store), np.intp),
+                     "positions": [np.arange(len(self.store))]}
+        else:
+            # Combine the codes of each column into a single code per row
+            codes = [column_codes(self.store, name) for name in names]
+            combined = np.ravel_multi_index(
+                [column.astype(np.intp) for column, _ in codes],
+                [max(len(categories), 1) for _, categories in codes])
+            group_codes, groups = np.unique(combined, return_inverse=True)
+            keys = np.unravel_index(group_codes, [max(len(categories), 1)
+                                                  for _, categories in codes])
+
+            # Sort the rows by group once, then split them up
+            order = np.argsort(groups, kind="stable")
+            counts = np.bincount(groups, minlength=len(group_codes))
+            index = {"keys": [tuple(categories[code] for code, (_, categories)
+                                    in zip(key, codes))
+                              for key in zip(*keys)],
+                     "groups": groups,
+                     "positions": np.split(order, np.cumsum(counts)[:-1])}
+
+        self.indexes[names] = index
+        return index
+
+    # Function to get the rows that pass the filters. Each filter is a
+    # column name with a value or list of values the column can equal, or
+    # for numbers a range given as {"low": low, "high": high}, where either
+    # end can be left out
+    def filter_mask(self, filters):
+        mask = np.ones(len(self.store), bool)
+        for name, condition in filters.items():
+            column = self.store.column(name)
+            if isinstance(column, record_store.NumberColumn):
+                values = column.array()
+                if isinstance(condition, dict):
+                    if condition.get("low") is not None:
+                        mask &= values >= float(condition["low"])
+                    if condition.get("high") is not None:
+                        mask &= values <= float(condition["high"])
+                else:
+                    if not isinstance(condition, (list, tuple, set)):
+                        condition = [condition]
+                    mask &= np.isin(values,
+                                    [float(value) for value in condition])
+                continue
+            if isinstance(condition, dict):
+                raise ValueError("Can't filter the text column " + name +
+                                 " by a range")
+
+            # Use the index of the column to pick out the matching rows
+            if not isinstance(condition, (list, tuple, set)):
+                condition = [condition]
+            wanted = {str(value) for value in condition}
+            index = self.group_index((record_store.column_name(name),))
+            matches = np.zeros(len(self.store), bool)
+            for key, positions in zip(index["keys"], index["positions"]):
+                if key[0] in wanted:
+                    matches[positions] = True
+            mask &= matches
+        return mask
+
+    # Function to work out aggregations of columns for each group of the
+    # by columns, on the rows that pass the filters. Values maps a numeric
+    # column to the aggregations wanted for it. Gives a data frame with a
+    # row for each group that has any rows
+    def aggregate(self, by=(), values=None, filters=None):
+        self.check_version()
+        by = tuple(record_store.column_name(name) for name in by)
+        if values is None:
+            values = {}
+        if filters is None:
+            filters = {}
+
+        # Give back the cached result if we've been asked this before
+        query = json.dumps([by, values, filters], sort_keys=True, default=str)
+        if query in self.results:
+            return self.results[query].copy()
+
+        index = self.group_index(by)
+        mask = self.filter_mask(filters)
+        groups = index["groups"][mask]
+        counts = np.bincount(groups, minlength=len(index["keys"]))
+        result = {"count": counts}
+
+        for name, wanted in values.items():
+            column_values = self.store.array(name).astype(np.float64)
+            for aggregation in wanted:
+                if aggregation in ("sum", "mean"):
+                    # Sums and means for every group at once
+                    sums = np.bincount(groups, weights=column_values[mask],
+                                       minlength=len(index["keys"]))
+                    if aggregation == "mean":
+                        with np.errstate(divide="ignore", invalid="ignore"):
+                            sums = sums / counts
+                    result[name + " " + aggregation] = sums
+                else:
+                    result[name + " " + aggregation] = [
+                        aggregate_values(
+                            column_values[positions[mask[positions]]],
+                            aggregation)
+                        for positions in index["positions"]]
+
+        # Build the frame, leaving out the groups with no rows
+        frame = pd.DataFrame(result)
+        for position, name in enumerate(by):
+            frame.insert(position, name,
+                         [key[position] for key in index["keys"]])
+        frame = frame[counts > 0].reset_index(drop=True)
+
+        self.results[query] = frame
+        return frame.copy()
+
+
+# Function to get the query engine for a csv, which is only built again
+# when the csv changes
+def get_engine(csv_path):
+    signature = data_cache.source_signature(csv_path)
+    return load_engine(csv_path, signature["mtime_ns"], signature["size"])
+
+
+@functools.lru_cache(maxsize=4)
+def load_engine(csv_path, mtime_ns, size):
+    return QueryEngine(record_store.load_store(csv_path),
+                       "{}:{}".format(mtime_ns, size))
+
+
+# Function to read the "low..high" range of a numeric filter, where either
+# end can be left out
+def parse_range(value):
+    low, high = value.split("..", 1)
+    return {"low": float(low) if low else None,
+            "high": float(high) if high else None}
+
+
+# Function to turn the "column:agg,agg" and "column=value" arguments into a
+# query. Giving a column more than one value matches any of them, and a
+# numeric column can be given a range as "column=low..high"
+def parse_query(stats, where):
+    values = {}
+    for stat in stats:
+        name, wanted = stat.rsplit(":", 1)
+        values[name] = wanted.split(",")
+    filters = {}
+    for condition in where:
+        name, value = condition.split("=", 1)
+        numeric = record_store.column_name(name) in \
+            record_store.numeric_columns
+        if numeric and ".." in value:
+            filters[name] = parse_range(value)
+        else:
+            filters.setdefault(name, []).append(
+                float(value) if numeric else value)
+    return values, filters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Break down the Invest NI data by its categories")
+    parser.add_argument("--data", default=data_investigation.append_path,
+                        help="csv to query")
+    parser.add_argument("--by", nargs="*", default=[],
+                        help="columns to group by")
+    parser.add_argument("--stats", nargs="*",
+                        default=["Investment Grade:mean"],
+                        help="aggregations as column:agg,agg")
+    parser.add_argument("--where", nargs="*", default=[],
+                        help="filters as column=value, or "
+                             "column=low..high for numbers")
+    arguments = parser.parse_args()
+
+    values, filters = parse_query(arguments.stats, arguments.where)
+    with pd.option_context("display.max_rows", None,
+                           "display.max_columns", None, "display.width", 0):
+        print(get_engine(arguments.data).aggregate(arguments.by, values,
+                                                   filters))
@@ -0,0 +1,203 @@
+# This file is a columnar version of the feature derivations in
+# data_investigation. The data is loaded once into typed arrays and every
+# added column is worked out as a vectorised expression, rather than looping
+# over a list of row dicts and converting the strings to floats on each pass.
+# The functions in data_investigation are kept as the reference and both give
+# the same output.
+#
+# derive_files_chunked does the same a chunk of rows at a time, for files
+# too large to load at once
+import csv
+import numpy as np
+import pandas as pd
+import bulk_writer
+import data_manipulation as dm
+import instrumentation
+import parallel_csv
+
+
+# Columns needed to work out the averages
+average_columns = ["Total Assistance", "Total Investment", "Investment Gain"]
+
+# Number of rows read at a time by derive_files_chunked
+chunk_size = 100000
+
+
+# Function to read a csv keeping every value as the text in the file, so
+# empty strings stay empty and the output matches the file exactly. Gives
+# data frames of chunk_rows rows if it is set
+def read_strings(data_source, chunk_rows=None, usecols=None):
+    if chunk_rows is not None:
+        return pd.read_csv(data_source, dtype=str, keep_default_na=False,
+                           chunksize=chunk_rows, usecols=usecols)
+    return parallel_csv.read_frame(data_source, dtype=str,
+                                   keep_default_na=False, usecols=usecols)
+
+
+# Function to convert the numeric columns we need to float arrays
+def numeric_columns(frame):
+    return {"assistance": frame["Total Assistance"].to_numpy(np.float64),
+            "investment": frame["Total Investment"].to_numpy(np.float64),
+            "gain": frame["Investment Gain"].to_numpy(np.float64)}
+
+
+# Function to load a csv into a data frame of strings along with the numeric
+# columns we need as float arrays
+@instrumentation.timed()
+def load_columns(data_source):
+    frame = read_strings(data_source)
+    # Convert the numeric columns a single time
+    return frame, numeric_columns(frame)
+
+
+# Function to work out the grade score of each row, along with the rows
+# where it is 0 because the assistance or investment is 0
+def grade_scores(frame, columns):
+    # Grades are 1 - (Total Assistance / Total Investment), or 0 when either
+    # value is 0
+    zero_mask = (frame["Total Assistance"].to_numpy() == "0") | \
+        (frame["Total Investment"].to_numpy() == "0")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grade_score = np.where(zero_mask, 0.0,
+                               1 - columns["assistance"] /
+                               columns["investment"])
+    return grade_score, zero_mask
+
+
+# Function to add the grade scores on to a running total in row order, the
+# same as the reference loop, so the averages are identical to the last bit
+def running_total(grade_score, total_grade=0.0):
+    return float(np.cumsum(np.concatenate([[total_grade], grade_score]))[-1])
+
+
+# Function to work out the investment grade of each row and the two
+# averages. Averages worked out over the whole file can be passed in when
+# the frame is only a chunk of it
+def investment_grades(frame, columns, averages=None):
+    grade_score, zero_mask = grade_scores(frame, columns)
+
+    # Entries with no gain are given a grade of 0 and left out of the zero
+    # removed average
+    gain_mask = columns["gain"] != 0
+    investment_grade = np.where(gain_mask, grade_score, 0.0)
+
+    if averages is None:
+        total_grade = running_total(grade_score)
+        averages = [total_grade / len(grade_score),
+                    total_grade / int(gain_mask.sum())]
+    return investment_grade, gain_mask, zero_mask, averages
+
+
+# Function to work out the two averages a chunk at a time, only reading the
+# columns they need
+def chunked_averages(data_source, chunk_rows=chunk_size):
+    total_grade = 0.0
+    row_count = 0
+    gain_count = 0
+    for frame in read_strings(data_source, chunk_rows, average_columns):
+        columns = numeric_columns(frame)
+        total_grade = running_total(grade_scores(frame, columns)[0],
+                                    total_grade)
+        row_count += len(frame)
+        gain_count += int((columns["gain"] != 0).sum())
+    return [total_grade / row_count, total_grade / gain_count]
+
+
+# Function to turn a boolean array into the "True"/"False" strings we write
+def marker_strings(mask):
+    return np.where(mask, "True", "False")
+
+
+# Function to add all of the columns for both data sets in one pass.
+# Returns the appended data, the zero removed data and the two averages
+@instrumentation.timed()
+def derive_features(frame, columns, averages=None):
+    investment_grade, gain_mask, zero_mask, averages = \
+        investment_grades(frame, columns, averages)
+    average_grade, zero_removed_average_grade = averages
+
+    # Investment grade is written as 0 for no gain or when it wasn't worked
+    # out, otherwise the full float
+    grade_text = np.where(gain_mask & ~zero_mask,
+                          investment_grade.astype(str), "0")
+
+    # Markers that don't depend on the average are shared by both sets
+    jobs_created = marker_strings(frame["Estimated Jobs"].to_numpy() != "0")
+    business_value = marker_strings(columns["assistance"] * 6 <
+                                    columns["investment"])
+
+    # Build the appended data in the order of our headings
+    appended = frame.assign(**{
+        "Investment Grade": grade_text,
+        "Business Plan Grade": business_value,
+        "Average Grade": marker_strings(investment_grade > average_grade),
+        "Jobs Created": jobs_created})[dm.append_headers]
+
+    # The zero removed set compares against its own average
+    zero_removed = appended[gain_mask].assign(**{
+        "Average Grade": marker_strings(investment_grade[gain_mask] >
+                                       zero_removed_average_grade)})
+
+    return appended, zero_removed, averages
+
+
+# Function to write a derived data frame, in the same format as append_data
+@instrumentation.timed()
+def write_frame(frame, file_path, overwrite=False):
+    # Check if the file name exists already
+    if dm.check_file(file_path) and not overwrite:
+        # Print out that the file exists
+        print("File exists already")
+        return None
+
+    # Use the same line endings as the csv writer in append_data, writing to
+    # a temporary copy that replaces the file once it is complete
+    with bulk_writer.atomic_path(file_path) as temp_path:
+        frame.to_csv(temp_path, index=False, lineterminator="\r\n",
+                     encoding="utf-8")
+    instrumentation.count("rows_written", len(frame))
+
+
+# Function to create both derived files from the Invest NI data
+def derive_files(data_source, append_path, zero_removed_path,
+                 overwrite=False):
+    frame, columns = load_columns(data_source)
+    appended, zero_removed, averages = derive_features(frame, columns)
+    write_frame(appended, append_path, overwrite)
+    write_frame(zero_removed, zero_removed_path, overwrite)
+    return averages
+
+
+# Function to create both derived files a chunk at a time, so only one
+# chunk of the Invest NI data is ever in memory. The averages need the whole
+# file, so they are worked out first from the numeric columns alone
+@instrumentation.timed()
+def derive_files_chunked(data_source, append_path, zero_removed_path,
+                         overwrite=False, chunk_rows=chunk_size):
+    # Check if either file exists already
+    if not overwrite and (dm.check_file(append_path) or
+                          dm.check_file(zero_removed_path)):
+        # Print out that the file exists
+        print("File exists already")
+        return None
+
+    averages = chunked_averages(data_source, chunk_rows)
+
+    with bulk_writer.atomic_path(append_path) as append_temp, \
+            bulk_writer.atomic_path(zero_removed_path) as zero_removed_temp, \
+            open(append_temp, "w", newline="", encoding="utf-8") as \
+            append_csv, \
+            open(zero_removed_temp, "w", newline="", encoding="utf-8") as \
+            zero_removed_csv:
+        csv.writer(append_csv).writerow(dm.append_headers)
+        csv.writer(zero_removed_csv).writerow(dm.append_headers)
+
+        # Derive each chunk against the averages of the whole file and write
+        # it out before reading the next
+        for frame in read_strings(data_source, chunk_rows):
+            appended, zero_removed, _ = derive_features(
+                frame, numeric_columns(frame), averages)
+            dm.write_rows(append_csv, appended)
+            dm.write_rows(zero_removed_csv, zero_removed)
+
+    return averages
@@ -0,0 +1,205 @@
+# This file encodes the categorical features of a data set once, into a
+# sparse one-hot matrix with a saved vocabulary, so that every classifier
+# and every fold of a grid search can share it rather than refitting the
+# encoder each time.
+#
+# The encoder is fitted on the whole data set, so categories that only turn
+# up in a held out fold still get a column. That column is all zeros in the
+# rows being trained on, so a tree can never split on it and the fitted
+# models are the same as fitting the encoder on each fold. Set per_fold to
+# fit the encoder inside each fold as before
+import os
+import json
+import pandas as pd
+import scipy.sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder, FunctionTransformer
+import data_cache
+import instrumentation
+
+# Categorical features of our data
+categorical_features = ["SME", "Ownership", "Jobs Created",
+                        "Sector", "Condition"]
+# The feature store of each csv built in this process
+stores = {}
+
+
+# Function to turn the typed columns of the cached data (categories and
+# bools) back into plain objects, as the imputer can't handle a mix of them
+def as_objects(features):
+    return features.astype(object)
+
+
+# Function to create our categorical transformer
+def categorical_pipeline():
+    return Pipeline(steps=[
+        ('objects', FunctionTransformer(as_objects)),
+        ('imputer', SimpleImputer(strategy='constant', fill_value="missing")),
+        ('onehot', OneHotEncoder(handle_unknown="ignore"))
+    ])
+
+
+# Function to apply our pipeline to the given features
+def column_transformer():
+    return ColumnTransformer(
+        transformers=[
+            ("cat", categorical_pipeline(), categorical_features)
+        ]
+    )
+
+
+# The encoded features of a data set, along with the encoder used for them
+class FeatureStore:
+
+    def __init__(self, frame):
+        # Fit and encode every row of the data set a single time
+        self.frame = frame
+        self.encoder = column_transformer()
+        with instrumentation.stage("encoding", rows=len(frame)):
+            self.matrix = self.encoder.fit_transform(frame).tocsr()
+
+        # The categories behind each column of the matrix
+        self.vocabulary = encoder_vocabulary(self.encoder)
+
+    # The store is never changed once it is encoded, so copies share it.
+    # sklearn's clone deep copies the parameters of every fold and
+    # candidate, which would otherwise copy the whole frame and matrix
+    def __deepcopy__(self, memo):
+        return self
+
+    # Function to get the encoded rows for a set of features, which are
+    # looked up in the matrix if they came from this data set, otherwise
+    # encoded with the saved vocabulary
+    @instrumentation.timed("store_rows")
+    def rows(self, features):
+        positions = self.frame.index.get_indexer(features.index)
+        if (positions >= 0).all() and \
+                (self.frame["Client Name"].to_numpy()[positions] ==
+                 features["Client Name"].to_numpy()).all():
+            return self.matrix[positions]
+        return self.encoder.transform(features)
+
+    # Function to save the vocabulary to a json file
+    def save_vocabulary(self, file_path):
+        with open(file_path, "w", encoding="utf-8") as vocab_file:
+            json.dump(self.vocabulary, vocab_file, indent=1)
+
+
+# Transformer for a pipeline which gets its rows from a feature store. There
+# is nothing to fit, as the store has already been encoded
+class StoreEncoder(BaseEstimator, TransformerMixin):
+
+    def __init__(self, store=None):
+        self.store = store
+
+    def fit(self, features, labels=None):
+        return self
+
+    # The store is already encoded, so it counts as fitted from the start
+    def __sklearn_is_fitted__(self):
+        return True
+
+    def transform(self, features):
+        return self.store.rows(features)
+
+
+# Transformer that adds columns for categories a fitted encoder hasn't seen,
+# after the columns it already has. Those columns stay where they are, so a
+# booster fitted on them can carry on training with the new columns on the
+# end. Each addition is a one-hot encoder over the features it adds to
+class ExtendedEncoder(BaseEstimator, TransformerMixin):
+
+    def __init__(self, encoder=None, additions=()):
+        self.encoder = encoder
+        self.additions = additions
+
+    def fit(self, features, labels=None):
+        return self
+
+    # The encoder and its additions are fitted as they are made
+    def __sklearn_is_fitted__(self):
+        return True
+
+    def transform(self, features):
+        blocks = [self.encoder.transform(features)] + \
+            [addition.transform(features[columns])
+             for columns, addition in self.additions]
+        return scipy.sparse.hstack(blocks).tocsr()
+
+
+# Function to get the categories behind the columns of a fitted encoder for
+# each feature, including any added to an extended encoder
+def encoder_categories(encoder):
+    if isinstance(encoder, ExtendedEncoder):
+        categories = encoder_categories(encoder.encoder)
+        for columns, addition in encoder.additions:
+            onehot = addition.named_steps["onehot"]
+            for feature, added in zip(columns, onehot.categories_):
+                categories[feature] = categories[feature] + list(added)
+        return categories
+
+    onehot = encoder.named_transformers_["cat"].named_steps["onehot"]
+    return {feature: list(categories)
+            for feature, categories in zip(categorical_features,
+                                           onehot.categories_)}
+
+
+# Function to get the vocabulary of a fitted encoder, as strings
+def encoder_vocabulary(encoder):
+    return {feature: [str(category) for category in categories]
+            for feature, categories in encoder_categories(encoder).items()}
+
+
+# Function to extend a fitted encoder with the categories in a set of
+# features that it hasn't seen, such as a new sector. Gives back the encoder
+# as it was when there are none
+def extend_encoder(encoder, features):
+    base = encoder.encoder if isinstance(encoder, ExtendedEncoder) \
+        else encoder
+    additions = list(encoder.additions) \
+        if isinstance(encoder, ExtendedEncoder) else []
+    known = encoder_categories(encoder)
+
+    # Clean the features as the encoder does before the one-hot step
+    cleaned = base.named_transformers_["cat"][:-1].transform(
+        features[categorical_features])
+    added = {}
+    for position, feature in enumerate(categorical_features):
+        values = [value for value in pd.unique(cleaned[:, position])
+                  if value not in known[feature]]
+        if len(values) > 0:
+            added[feature] = sorted(values, key=str)
+    if len(added) == 0:
+        return encoder
+
+    # Encode the new categories with a one-hot encoder of their own
+    columns = list(added)
+    addition = categorical_pipeline()
+    addition.set_params(onehot__categories=[added[feature]
+                                            for feature in columns])
+    addition.fit(features[columns])
+    return ExtendedEncoder(base, additions + [(columns, addition)])
+
+
+# Function to get the feature store for a csv, which is built the first time
+# it is needed and saves its vocabulary next to the csv. It is built again
+# once the csv changes, as the data it was built from is then loaded again
+def get_store(csv_path):
+    frame = data_cache.get_data(csv_path)
+    if csv_path not in stores or stores[csv_path].frame is not frame:
+        store = FeatureStore(frame)
+        store.save_vocabulary(os.path.splitext(csv_path)[0] +
+                              ".vocabulary.json")
+        stores[csv_path] = store
+    return stores[csv_path]
+
+
+# Function to get the preprocessing step for a classifier on a csv, either
+# sharing its feature store or fitting the encoder in each fold
+def preprocessor(csv_path, per_fold=False):
+    if per_fold:
+        return column_transformer()
+    return StoreEncoder(get_store(csv_path))
@@ -0,0 +1,256 @@
+# This file times the stages of the pipeline and counts what they handle,
+# so the hot path can be found without editing any code. It is off unless
+# turned on, and costs next to nothing when off.
+#
+# Turn it on with environment variables, which worker processes inherit:
+#   INVEST_TRACE=trace.jsonl    writes a line of json for every stage run
+#   INVEST_PROFILE=profiles     also writes a cProfile dump of each stage
+# or run any of the scripts through this one:
+#   python -m instrumentation --trace trace.jsonl [--profile profiles]
+#       classifiers.py [arguments]
+# and sum up a trace with:
+#   python -m instrumentation --summary trace.jsonl
+#
+# Each line of the trace holds the stage name, the process, the seconds it
+# took, the resident memory at the end and the change over the stage, the
+# counters added while it was open (rows read, rows written, api pages...)
+# and any fields given when it was opened. Stages inside other stages name
+# their parent
+import argparse
+import cProfile
+import functools
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+
+# The high water mark of the memory is only kept on POSIX platforms, so the
+# memory isn't traced where there is neither it nor /proc
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Where the trace and the profiles are written, None when off
+trace_path = os.environ.get("INVEST_TRACE") or None
+profile_dir = os.environ.get("INVEST_PROFILE") or None
+
+# Totals of every counter in this process
+counters = {}
+# The stages open in each thread
+open_stages = threading.local()
+# Number of profiles written by this process, to keep their names apart
+profile_count = [0]
+
+
+# Function to check if the instrumentation is on
+def enabled():
+    return trace_path is not None or profile_dir is not None
+
+
+# Function to turn the instrumentation on from code. The environment is set
+# too so any worker processes started afterwards trace as well. Modules
+# imported before this keep their functions untimed
+def enable(trace=None, profile=None):
+    global trace_path, profile_dir
+    if trace is not None:
+        trace_path = os.path.abspath(trace)
+        os.environ["INVEST_TRACE"] = trace_path
+    if profile is not None:
+        os.makedirs(profile, exist_ok=True)
+        profile_dir = os.path.abspath(profile)
+        os.environ["INVEST_PROFILE"] = profile_dir
+
+
+# Function to get the resident memory of this process in bytes. Reads
+# /proc where there is one, otherwise falls back to the high water mark.
+# Gives None where there is neither
+def resident_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError):
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Function to get the stages open in this thread, innermost last
+def stage_stack():
+    if not hasattr(open_stages, "stack"):
+        open_stages.stack = []
+    return open_stages.stack
+
+
+# Function to write an event as a line of the trace. Each line is written
+# in a single call, so lines from several processes don't get mixed up
+def write_event(event):
+    if trace_path is None:
+        return
+    event["pid"] = os.getpid()
+    event["time"] = time.time()
+    with open(trace_path, "a", encoding="utf-8") as trace_file:
+        trace_file.write(json.dumps(event, default=str) + "\n")
+
+
+# Function to add to a counter, both for the process and for every stage
+# that is open
+def count(name, amount=1):
+    if not enabled():
+        return
+    counters[name] = counters.get(name, 0) + amount
+    for open_stage in stage_stack():
+        open_stage.counters[name] = open_stage.counters.get(name, 0) + amount
+
+
+# Context manager that times a stage of the pipeline and writes it to the
+# trace. Extra fields can be given when it is opened or set while it runs.
+# Stages that wrap the others, like a whole script, can be left unprofiled
+# so the stages inside them get a profile each
+class Stage:
+
+    def __init__(self, name, profiled=True, **fields):
+        self.name = name
+        self.profiled = profiled
+        self.fields = fields
+        self.counters = {}
+        self.profiler = None
+
+    # Function to add fields to the event, such as the number of rows
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        if not enabled():
+            return self
+        stack = stage_stack()
+        self.parent = stack[-1].name if len(stack) > 0 else None
+        self.depth = len(stack)
+
+        # Only the outermost stage is profiled, as profilers can't be nested
+        if profile_dir is not None and self.profiled and \
+                not any(stage.profiler for stage in stack):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        stack.append(self)
+        self.start_rss = resident_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not enabled() or self not in stage_stack():
+            return False
+        seconds = time.perf_counter() - self.start
+        stage_stack().remove(self)
+        rss = resident_bytes()
+        rss_delta = None
+        if rss is not None and self.start_rss is not None:
+            rss_delta = rss - self.start_rss
+
+        event = {"stage": self.name, "seconds": seconds,
+                 "rss_bytes": rss, "rss_delta_bytes": rss_delta,
+                 "depth": self.depth, "parent": self.parent,
+                 "counters": self.counters}
+        event.update(self.fields)
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_count[0] += 1
+            event["profile"] = os.path.join(
+                profile_dir, "{}-{}-{}.pstats".format(
+                    self.name, os.getpid(), profile_count[0]))
+            self.profiler.dump_stats(event["profile"])
+            self.profiler = None
+
+        write_event(event)
+        return False
+
+
+# Function to open a stage, for use in a with statement
+def stage(name, **fields):
+    return Stage(name, **fields)
+
+
+# Decorator to time every call of a function as a stage, named after the
+# function unless a name is given. When the instrumentation is off as the
+# function is defined it is left as it is
+def timed(name=None):
+    def decorator(function):
+        if not enabled():
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Stage(name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Function to sum up a trace by stage - the number of runs, the total and
+# largest times, the most memory and the totals of the counters
+def summarise(trace_file_path):
+    stages = {}
+    with open(trace_file_path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            event = json.loads(line)
+            summary = stages.setdefault(event["stage"], {
+                "runs": 0, "seconds": 0.0, "max_seconds": 0.0,
+                "max_rss_bytes": 0, "counters": {}})
+            summary["runs"] += 1
+            summary["seconds"] += event["seconds"]
+            summary["max_seconds"] = max(summary["max_seconds"],
+                                         event["seconds"])
+            summary["max_rss_bytes"] = max(summary["max_rss_bytes"],
+                                           event["rss_bytes"] or 0)
+            for name, amount in event["counters"].items():
+                summary["counters"][name] = \
+                    summary["counters"].get(name, 0) + amount
+    return stages
+
+
+# Function to print the summary of a trace, slowest stages first
+def print_summary(stages):
+    print("{:<28}{:>6}{:>11}{:>11}{:>10}  {}".format(
+        "stage", "runs", "total s", "max s", "max MB", "counters"))
+    for name, summary in sorted(stages.items(),
+                                key=lambda item: -item[1]["seconds"]):
+        print("{:<28}{:>6}{:>11.3f}{:>11.3f}{:>10.1f}  {}".format(
+            name, summary["runs"], summary["seconds"],
+            summary["max_seconds"], summary["max_rss_bytes"] / 1e6,
+            ", ".join("{}={}".format(counter, amount) for counter, amount
+                      in sorted(summary["counters"].items()))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run a script of the pipeline with tracing turned on, "
+                    "or sum up a trace")
+    parser.add_argument("--trace", help="json lines file to write")
+    parser.add_argument("--profile", help="folder for the cProfile dumps")
+    parser.add_argument("--summary", help="trace to sum up")
+    parser.add_argument("script", nargs="?", help="script to run")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    arguments = parser.parse_args()
+
+    # Let the modules of the script share this copy of the module
+    sys.modules["instrumentation"] = sys.modules[__name__]
+
+    if arguments.summary is not None:
+        print_summary(summarise(arguments.summary))
+        sys.exit(0)
+    if arguments.script is None:
+        parser.error("a script to run or --summary is needed")
+
+    # Turn tracing on before the script imports anything, so every timed
+    # function is wrapped, then run it as if it was run directly
+    enable(arguments.trace or "trace.jsonl", arguments.profile)
+    sys.argv = [arguments.script] + arguments.arguments
+    sys.path.insert(0, os.path.dirname(os.path.abspath(arguments.script)))
+    with Stage("script", profiled=False, script=arguments.script):
+        runpy.run_path(arguments.script, run_name="__main__")
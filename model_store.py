@@ -0,0 +1,213 @@
+# This file saves the best model found for each classification problem, so
+# they can be reused without running the grid searches again. Each model is
+# saved with a manifest holding the hash of the data it was trained on, its
+# parameters and the vocabulary of its features. Saved models are only
+# reused while the hash of the data matches
+import os
+import json
+import hashlib
+import contextlib
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+import classifiers
+import data_cache
+import feature_store
+
+# Models trained in parallel processes share the manifest, so updates to it
+# are made under a file lock where the platform has one
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Folder the models are saved in
+models_path = "Models"
+manifest_name = "manifest.json"
+
+# Functions that train each of the classification problems
+trainers = {"average_grade": classifiers.grade_classifier,
+            "non_zero_grade": classifiers.non_zero_grade_classifier,
+            "business_plan": classifiers.business_plan_classifier}
+
+
+# Function to get the hash of the data a target is trained on, which covers
+# the csv, the rows used for training and the grid that was searched
+def data_hash(target):
+    settings = classifiers.targets[target]
+    signature = data_cache.source_signature(settings["source"],
+                                            use_hash=True)
+    return "{}:{}:{}".format(signature["sha1"],
+                             len(settings["data"]()),
+                             json.dumps(settings["param_grid"],
+                                        sort_keys=True))
+
+
+# Function to get a hash of the values in the rows of a data frame, so a
+# later copy of the csv can be checked for the same rows at its start. The
+# numbers are hashed as floats, as a column read as ints can be read as
+# floats once a row with a fraction is added
+def rows_hash(frame):
+    columns = {name: values.astype(np.float64)
+               if pd.api.types.is_numeric_dtype(values) and
+               not pd.api.types.is_bool_dtype(values) else values
+               for name, values in frame.items()}
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(columns), index=False)
+    return hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+
+
+# Function to get the number of rows in the csv of a target, along with the
+# hash of their values
+def source_state(target):
+    data = data_cache.get_data(classifiers.targets[target]["source"])
+    return {"source_rows": len(data), "source_hash": rows_hash(data)}
+
+
+# Function to make a fitted pipeline stand on its own, by swapping a shared
+# feature store step for the encoder that was fitted for the store. Models
+# of the native backend already stand on their own
+def portable_pipeline(pipeline):
+    if not isinstance(pipeline, Pipeline):
+        return pipeline
+    preprocessor = pipeline.named_steps["preprocessor"]
+    if isinstance(preprocessor, feature_store.StoreEncoder):
+        return Pipeline(steps=[("preprocessor", preprocessor.store.encoder),
+                               ("regressor",
+                                pipeline.named_steps["regressor"])])
+    return pipeline
+
+
+# Function to get the vocabulary of the features of a fitted pipeline
+def pipeline_vocabulary(pipeline):
+    if not isinstance(pipeline, Pipeline):
+        return pipeline.vocabulary()
+    return feature_store.encoder_vocabulary(
+        pipeline.named_steps["preprocessor"])
+
+
+# Function to read the manifest of the saved models
+def load_manifest(directory=models_path):
+    manifest_path = os.path.join(directory, manifest_name)
+    if not os.path.isfile(manifest_path):
+        return {}
+
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+# Context manager that holds the lock on the manifest of a folder
+@contextlib.contextmanager
+def manifest_lock(directory=models_path):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, manifest_name + ".lock"),
+              "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Function to save the best model of a grid search for a target. Holdout
+# end is the row the holdout rows end at if the model was trained on rows
+# past them, as a retrained model is
+def save_model(target, search, directory=models_path, holdout_end=None):
+    os.makedirs(directory, exist_ok=True)
+    pipeline = portable_pipeline(search.best_estimator_)
+    file_name = target + ".joblib"
+    joblib.dump(pipeline, os.path.join(directory, file_name))
+
+    # Record the model in the manifest, along with the number of rows its
+    # csv had and their hash, so the rows added later can be told apart
+    entry = {"file": file_name,
+             "data_hash": data_hash(target),
+             "params": search.best_params_,
+             "best_score": float(search.best_score_),
+             "label": classifiers.targets[target]["label"],
+             "vocabulary": pipeline_vocabulary(pipeline),
+             "holdout_end": holdout_end}
+    entry.update(source_state(target))
+    write_entry(target, entry, directory)
+    return pipeline
+
+
+# Function to save a model that has carried on training on the rows added
+# to its csv, keeping the details of the search it came from
+def save_update(target, pipeline, accuracy=None, directory=models_path):
+    entry = dict(load_manifest(directory)[target])
+    joblib.dump(pipeline, os.path.join(directory, entry["file"]))
+
+    # The rows trained on by the first update are the ones after the
+    # holdout, so the holdout now ends where they start
+    if entry.get("holdout_end") is None:
+        entry["holdout_end"] = entry["source_rows"]
+    entry.update({"data_hash": data_hash(target),
+                  "vocabulary": pipeline_vocabulary(pipeline),
+                  "updates": entry.get("updates", 0) + 1,
+                  "update_accuracy": accuracy})
+    entry.update(source_state(target))
+    write_entry(target, entry, directory)
+    return pipeline
+
+
+# Function to record the saved model of a target as current for its csv as
+# it is now, when the csv has changed without giving it rows to train on
+def refresh_hash(target, directory=models_path):
+    entry = dict(load_manifest(directory)[target])
+    entry["data_hash"] = data_hash(target)
+    write_entry(target, entry, directory)
+
+
+# Function to write the manifest entry of a target
+def write_entry(target, entry, directory=models_path):
+    manifest_path = os.path.join(directory, manifest_name)
+    with manifest_lock(directory):
+        manifest = load_manifest(directory)
+        manifest[target] = entry
+        with open(manifest_path + ".tmp", "w",
+                  encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+
+# Function to get the row the holdout rows of a target end at, leaving out
+# the rows after them its saved model has been trained on. None if the
+# holdout runs to the end of the csv
+def holdout_end(target, directory=models_path):
+    return load_manifest(directory).get(target, {}).get("holdout_end")
+
+
+# Function to load a saved model, or None if there isn't one
+def load_model(target, directory=models_path):
+    entry = load_manifest(directory).get(target)
+    if entry is None:
+        return None
+    return joblib.load(os.path.join(directory, entry["file"]))
+
+
+# Function to check if the saved model of a target was trained on the data
+# we have now
+def model_current(target, directory=models_path):
+    entry = load_manifest(directory).get(target)
+    return entry is not None and entry["data_hash"] == data_hash(target) and \
+        os.path.isfile(os.path.join(directory, entry["file"]))
+
+
+# Function to get the model for each target, reusing the saved models where
+# the data hasn't changed and training (then saving) the rest
+def get_models(target_names=None, directory=models_path):
+    if target_names is None:
+        target_names = list(trainers)
+
+    models = {}
+    for target in target_names:
+        if model_current(target, directory):
+            models[target] = load_model(target, directory)
+        else:
+            print("Training " + target)
+            models[target] = save_model(target, trainers[target](),
+                                        directory)
+    return models
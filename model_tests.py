@@ -6,7 +6,18 @@ hold out data for our data analysis
 import pandas as pd
 import numpy as np
 import classifiers
-import csv
+import model_store
+import feature_store
+import instrumentation
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import rankdata
+from sklearn.model_selection import RepeatedStratifiedKFold, \
+    StratifiedShuffleSplit
+from sklearn.pipeline import Pipeline
+from xgboost.sklearn import XGBClassifier
+import search_modes
 
 # File paths
 data_path = "Data/appended_data.csv"
@@ -15,17 +26,27 @@ avg_grade_test_path = "Data/testing/avg_grade_test.csv"
 zero_removed_test_path = "Data/testing/zero_removed_data_test.csv"
 business_grade_test_path = "Data/testing/business_grade_test.csv"
 
-# Read in our data
-overall_data = pd.read_csv(data_path, engine="python")
-zero_removed_data = pd.read_csv(zero_removed_path, engine="python")
-
-# Create the testing sets
-overall_testing = overall_data[6500:]
-zero_removed_testing = zero_removed_data[6000:]
+# Number of folds for the outer cross validation, and the size of the held
+# out data for the repeated splits (the same share as the fixed split)
+outer_folds = 5
+holdout_size = 0.25
 
 np.random.seed(0)
 
 
+# Functions to create the testing sets, using the same copy of the data as
+# the classifiers so it is only read in once, and only when needed. The
+# testing set of a model ends at its holdout end, if it has been trained on
+# the rows added to the csv after it
+def overall_testing(holdout_end=None):
+    return classifiers.overall_data()[classifiers.training_rows:holdout_end]
+
+
+def zero_removed_testing(holdout_end=None):
+    return classifiers.zero_removed_data()[
+        classifiers.zero_training_rows:holdout_end]
+
+
 # Function to drop the given column for testing
 def drop_column(col, testing_set):
     # If average grade given, drop it
@@ -38,112 +59,198 @@ def drop_column(col, testing_set):
     return new_set
 
 
-# Function to compare two csv files
+# Function to get the labels for a column of a testing set as 0s and 1s
+def holdout_labels(testing_set, label):
+    return testing_set[label].to_numpy().astype(int)
+
+
+# Function to compare two csv files, the original data from the starting row
+# onwards against a csv of predictions
 def compare_csv(control_path, test_path, starting_row, comp_value):
-    # Create a control list to test against
-    control_list = []
-    test_list = []
-    # Iterate through and add values to the control list
-    with open(control_path, newline='') as control:
-        reader = csv.reader(control, delimiter=',')
-        # Skip the header
-        next(reader, None)
-
-        # We want to skip a number of rows equal to our starting row value
-        skip_row = 0
-        for row in reader:
-            # If less than starting row, skip
-            if skip_row < starting_row:
-                skip_row += 1
-                continue
-            # Otherwise, begin adding to the control list - check which value
-            # we are comparing
-            if comp_value == "Mean Average":
-                if row[14] == "True":
-                    translate_val = "1"
-                else:
-                    translate_val = "0"
-            else:
-                if row[13] == "True":
-                    translate_val = "1"
-                else:
-                    translate_val = "0"
-            # Append to the control list
-            control_list.append(translate_val)
-        # Close the connection
-        control.close()
-
-    # Now load in our comparison csv
-    with open(test_path, newline='') as test_file:
-        reader = csv.reader(test_file, delimiter=',')
-
-        # Skip the header
-        next(reader, None)
-
-        # Iterate through the rest of the list
-        for row in reader:
-            # Append the second value to the list
-            test_list.append(row[1])
-
-        # Close connection
-        test_file.close()
-
-    # Value to track our the values needed for accuracy
-    success = 0
-
-    # Iterate through and compare the values
-    for comp_value in range(len(test_list)):
-        # Compare the two and see if they match
-        if test_list[comp_value] == control_list[comp_value]:
-            # Iterate the success counter
-            success += 1
+    # Check which value we are comparing
+    if comp_value == "Mean Average":
+        label = "Average Grade"
+    else:
+        label = "Business Plan Grade"
+
+    # Load the control column and our predictions, which are the second
+    # column of the comparison csv
+    control = pd.read_csv(control_path, usecols=[label], encoding="utf-8")
+    control = control[label].to_numpy()[starting_row:]
+    predictions = pd.read_csv(test_path).iloc[:, 1].to_numpy()
 
     # Calculate success rate
-    success_rate = success / len(test_list)
+    return float(np.mean(control[:len(predictions)].astype(int) ==
+                         predictions.astype(int)))
+
+
+# Function to work out the area under the ROC curve from the probabilities,
+# using the ranks of the positive rows (ties share an average rank)
+def roc_auc(labels, probabilities):
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    # Not defined unless both classes are in the labels
+    if positives == 0 or negatives == 0:
+        return float("nan")
+
+    ranks = rankdata(probabilities)
+    return float((ranks[labels == 1].sum() - positives * (positives + 1) / 2)
+                 / (positives * negatives))
+
+
+# Function to work out the metrics for a set of predictions against the
+# labels, with the ROC AUC if the probabilities are given
+def evaluate(predictions, labels, probabilities=None):
+    predictions = np.asarray(predictions).astype(int)
+    labels = np.asarray(labels).astype(int)
+
+    # Confusion matrix laid out as [[tn, fp], [fn, tp]]
+    confusion = np.bincount(labels * 2 + predictions,
+                            minlength=4).reshape(2, 2)
+    true_positives = confusion[1, 1]
+    predicted_positives = confusion[:, 1].sum()
+    actual_positives = confusion[1, :].sum()
+
+    metrics = {
+        "accuracy": float(np.mean(predictions == labels)),
+        "precision": float(true_positives / predicted_positives)
+        if predicted_positives > 0 else 0.0,
+        "recall": float(true_positives / actual_positives)
+        if actual_positives > 0 else 0.0,
+        "confusion_matrix": confusion.tolist()
+    }
+    if probabilities is not None:
+        metrics["roc_auc"] = roc_auc(labels, np.asarray(probabilities))
+    return metrics
+
 
-    # Return the success rate
-    return success_rate
+# Function to evaluate a model on a testing set. The predictions are written
+# to a csv as well if given an output path
+def evaluate_model(model, testing_set, label, output_path=None):
+    features = drop_column(label, testing_set)
+    with instrumentation.stage("predict", rows=len(features), label=label):
+        probabilities = model.predict_proba(features)[:, 1]
+    predictions = (probabilities > 0.5).astype(int)
+
+    if output_path is not None:
+        pd.DataFrame({label: predictions}).to_csv(output_path)
+
+    return evaluate(predictions, holdout_labels(testing_set, label),
+                    probabilities)
+
+
+# Function to print out the metrics for a model
+def print_metrics(metrics):
+    print("Success Rate: " + str(metrics["accuracy"]))
+    print("Precision: " + str(metrics["precision"]))
+    print("Recall: " + str(metrics["recall"]))
+    if "roc_auc" in metrics:
+        print("ROC AUC: " + str(metrics["roc_auc"]))
+    print("Confusion Matrix [[TN, FP], [FN, TP]]: " +
+          str(metrics["confusion_matrix"]))
+
+
+# Function to get the encoded features and labels for the whole data set of
+# a target, using the feature store shared with the classifiers
+def evaluation_data(target):
+    settings = classifiers.targets[target]
+    store = feature_store.get_store(settings["source"])
+    return store.matrix, holdout_labels(store.frame, settings["label"])
+
+
+# Function to tune and score one split, run in the process pool. The grid
+# of the target is searched again on the training rows of the split alone,
+# so the score covers picking the parameters as well as fitting the model.
+# The search reuses the boosting rounds of each model, so it costs a fit per
+# max depth and inner fold rather than one per grid point
+def evaluate_split(task):
+    target, train_rows, test_rows = task
+    matrix, labels = evaluation_data(target)
+
+    # Each process runs a single fit at a time, so give xgboost one thread
+    model = Pipeline(steps=[
+        ("regressor", XGBClassifier(objective="binary:logistic", seed=1,
+                                    n_jobs=1))])
+    search = search_modes.make_search(
+        model, classifiers.targets[target]["param_grid"], "rounds",
+        n_jobs=1)
+    search.fit(matrix[train_rows], labels[train_rows])
+    return search.score(matrix[test_rows], labels[test_rows])
+
+
+# Function to evaluate each target over many splits of its data rather than
+# the one fixed slice, searching its grid again inside each training split.
+# The mode is "cv" for an outer cross validation repeated a number of times
+# (nested cross validation), or "holdout" for that many random stratified
+# holdout splits. Returns a dict of target to the mean, std and scores
+def repeated_evaluation(target_names=None, repeats=5, mode="cv",
+                        n_workers=None):
+    if target_names is None:
+        target_names = list(classifiers.targets)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # Queue every split of every target
+    tasks = []
+    for target in target_names:
+        # Encode the data before starting the pool so the processes share it
+        matrix, labels = evaluation_data(target)
+        if mode == "cv":
+            splitter = RepeatedStratifiedKFold(n_splits=outer_folds,
+                                               n_repeats=repeats,
+                                               random_state=0)
+        else:
+            splitter = StratifiedShuffleSplit(n_splits=repeats,
+                                              test_size=holdout_size,
+                                              random_state=0)
+        for train_rows, test_rows in splitter.split(np.zeros(len(labels)),
+                                                    labels):
+            tasks.append((target, train_rows, test_rows))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        scores = list(pool.map(evaluate_split, tasks))
+
+    # Collect the scores for each target
+    results = {}
+    for target in target_names:
+        target_scores = np.array([score for task, score in zip(tasks, scores)
+                                  if task[0] == target])
+        results[target] = {"mean": float(target_scores.mean()),
+                           "std": float(target_scores.std()),
+                           "scores": target_scores.tolist()}
+    return results
 
 
 # Function to run our tests
 if __name__ == '__main__':
-    # Get our grid searches from classifier
-    avg_grade_grid = classifiers.grade_classifier()
-    zero_removed_grid = classifiers.non_zero_grade_classifier()
-    business_grade_grid = classifiers.business_plan_classifier()
-
-    # Drop some of our columns for our tests
-    avg_grade_test = drop_column("Average Grade", overall_testing)
-    zero_removed_grade_test = drop_column("Average Grade",
-                                          zero_removed_testing)
-    business_grade_test = drop_column("Business Plan Grade", overall_testing)
-
-    # Run predictions for our data
-    avg_grade_pred = avg_grade_grid.predict(avg_grade_test)
-    zero_removed_pred = zero_removed_grid.predict(zero_removed_grade_test)
-    business_grade_pred = business_grade_grid.predict(business_grade_test)
-
-    # Output the files to testing folder
-    pd.DataFrame({'Average Grade': avg_grade_pred}).to_csv(avg_grade_test_path)
-    pd.DataFrame({'Average Grade': zero_removed_pred}).\
-        to_csv(zero_removed_test_path)
-    pd.DataFrame({'Business Plan Grade': business_grade_pred})\
-        .to_csv(business_grade_test_path)
-
-    # Compare our CSVs and return the score
+    # Evaluate over repeated splits instead if asked for
+    if "repeated" in sys.argv[1:]:
+        for target, result in repeated_evaluation().items():
+            print("{}: accuracy {:.4f} +/- {:.4f} over {} splits".format(
+                target, result["mean"], result["std"],
+                len(result["scores"])))
+        sys.exit(0)
+
+    # Get our models, only training the ones whose data has changed since
+    # they were saved
+    models = model_store.get_models()
+
+    # Evaluate each model on its testing set, also writing the predictions
+    # to the testing folder
     print("Testing Mean Average Grades:")
-    avg_grade_results = compare_csv(data_path, avg_grade_test_path,
-                                    6500, "Mean Average")
-    print("Success Rate: " + str(avg_grade_results))
+    print_metrics(evaluate_model(
+        models["average_grade"],
+        overall_testing(model_store.holdout_end("average_grade")),
+        "Average Grade", avg_grade_test_path))
 
     print("\n\nTesting Zero Removed Mean Average Grades:")
-    zero_removed_results = compare_csv(zero_removed_path,
-                                       zero_removed_test_path,
-                                       6000, "Mean Average")
-    print("Success Rate: " + str(zero_removed_results))
+    print_metrics(evaluate_model(
+        models["non_zero_grade"],
+        zero_removed_testing(model_store.holdout_end("non_zero_grade")),
+        "Average Grade", zero_removed_test_path))
 
     print("\n\nTesting Business Grades:")
-    business_grade_results = compare_csv(data_path, business_grade_test_path,
-                                         6500, "Business Grade")
-    print("Success Rate: " + str(business_grade_results))
-
+    print_metrics(evaluate_model(
+        models["business_plan"],
+        overall_testing(model_store.holdout_end("business_plan")),
+        "Business Plan Grade", business_grade_test_path))
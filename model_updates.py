@@ -0,0 +1,186 @@
+# This file carries on training the saved models on the rows added to their
+# csv since they were trained, rather than training them from zero.
+#
+# New offers are added to the end of the csv files, so the rows past the
+# number the csv had when a model was saved (kept in its manifest entry) are
+# the new ones. The manifest also keeps a hash of the rows the csv had, and
+# if they have changed rather than only had rows added after them, the model
+# is trained from zero. Otherwise the saved booster is given a few more
+# boosting rounds fitted on those rows alone. Categories the encoder hasn't
+# seen, such as a new sector, get columns of their own after the columns the
+# booster already has, so its trees still read the same columns.
+#
+# Before each update the model is scored on the new rows. If its accuracy
+# has fallen too far below the best score of the search it came from, the
+# model is trained from zero instead, on its training rows and the new ones.
+#
+# The rows a model is trained on this way come after its holdout rows, so
+# the manifest records where the holdout ends and model_tests leaves them
+# out. The pipeline runs these updates for its model stages when only the
+# csv has changed, and running this file records the updated models in the
+# pipeline's state, so neither trains them again from zero.
+#
+# Usage: python model_updates.py [target ...] [--rounds 10] [--tolerance 0.05]
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import xgboost
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+import classifiers
+import data_cache
+import feature_store
+import instrumentation
+import model_store
+import model_tests
+import search_modes
+
+# Boosting rounds added by each update
+update_rounds = 10
+# Fewest new rows that the accuracy is checked on
+drift_rows = 50
+# Fall in accuracy from the best score of the search that counts as drift
+drift_tolerance = 0.05
+
+
+# Function to get the rows added to the csv of a target since its model was
+# saved. Gives None if the rows the csv had then have changed since
+def new_rows(target, entry):
+    data = data_cache.get_data(classifiers.targets[target]["source"])
+    rows = entry["source_rows"]
+    if len(data) < rows or entry.get("source_hash") != \
+            model_store.rows_hash(data[:rows]):
+        return None
+    return data[rows:]
+
+
+# Function to get the row the holdout of a saved model ends at. Every row
+# after it is trained on when the model is trained from zero
+def holdout_end(entry):
+    if entry.get("holdout_end") is None:
+        return entry["source_rows"]
+    return entry["holdout_end"]
+
+
+# Function to let a booster take extra columns on the end of its features.
+# Its trees only split on the columns it had, so its predictions don't change
+def widen_booster(booster, n_features):
+    model = json.loads(bytes(booster.save_raw("json")))
+    model["learner"]["learner_model_param"]["num_feature"] = str(n_features)
+    return xgboost.Booster(model_file=bytearray(json.dumps(model).encode()))
+
+
+# Function to carry on training a saved pipeline on new rows, giving back a
+# new pipeline with the extended encoder and the booster with the added
+# rounds
+def continue_training(pipeline, features, labels, rounds=update_rounds):
+    encoder = feature_store.extend_encoder(
+        pipeline.named_steps["preprocessor"], features)
+    matrix = encoder.transform(features)
+
+    booster = pipeline.named_steps["regressor"].get_booster()
+    if matrix.shape[1] > booster.num_features():
+        booster = widen_booster(booster, matrix.shape[1])
+
+    regressor = clone(pipeline.named_steps["regressor"])
+    regressor.set_params(n_estimators=rounds)
+    regressor.fit(matrix, np.ravel(labels), xgb_model=booster)
+    return Pipeline(steps=[("preprocessor", encoder),
+                           ("regressor", regressor)])
+
+
+# Function to train the model of a target from zero, on its training rows
+# and every row of its csv after the holdout end, including the rows earlier
+# updates carried on training on
+def retrain(target, holdout_end, directory=model_store.models_path):
+    settings = classifiers.targets[target]
+    data = pd.concat([settings["data"](),
+                      data_cache.get_data(settings["source"])[holdout_end:]])
+    label = settings["label"]
+
+    search = search_modes.make_search(classifiers.build_pipeline(target),
+                                      settings["param_grid"])
+    search.fit(data.drop(columns=[label]), data[[label]])
+    return model_store.save_model(target, search, directory, holdout_end)
+
+
+# Function to bring the saved model of a target up to date with the rows
+# added to its csv. Gives back the model
+@instrumentation.timed()
+def update_model(target, rounds=update_rounds, tolerance=drift_tolerance,
+                 directory=model_store.models_path):
+    entry = model_store.load_manifest(directory).get(target)
+
+    # Without a record of the rows it was trained on, train it as normal
+    if entry is None or "source_rows" not in entry:
+        print("No record of the rows " + target + " was trained on, "
+              "training it from zero")
+        return model_store.save_model(target, model_store.trainers[target](),
+                                      directory)
+
+    model = model_store.load_model(target, directory)
+
+    # Models of the native backend have no encoder to extend, so they are
+    # trained from zero with the same backend
+    if not isinstance(model, Pipeline):
+        print("The native model of " + target + " can't carry on training, "
+              "training it from zero")
+        return model_store.save_model(
+            target, model_store.trainers[target](backend="native"),
+            directory)
+
+    rows = new_rows(target, entry)
+    if rows is None:
+        print("The rows " + target + " was trained on have changed, "
+              "training it from zero")
+        return retrain(target, holdout_end(entry), directory)
+    if len(rows) == 0:
+        print("No new rows for " + target)
+        model_store.refresh_hash(target, directory)
+        return model
+
+    # Check the accuracy on the new rows before they are trained on
+    label = entry["label"]
+    accuracy = None
+    if len(rows) >= drift_rows:
+        accuracy = model_tests.evaluate_model(model, rows, label)["accuracy"]
+        if accuracy < entry["best_score"] - tolerance:
+            print("Accuracy of " + target + " on the new rows fell to " +
+                  str(accuracy) + ", training it from zero")
+            return retrain(target, holdout_end(entry), directory)
+
+    # A booster can only carry on training on rows of both classes. The
+    # rows are kept as new, so the next update trains on them
+    if rows[label].nunique() < 2:
+        print("Only one class in the new rows for " + target +
+              ", leaving it as it is")
+        model_store.refresh_hash(target, directory)
+        return model
+
+    print("Updating " + target + " with " + str(len(rows)) + " new rows")
+    model = continue_training(model, rows.drop(columns=[label]),
+                              rows[[label]], rounds)
+    return model_store.save_update(target, model, accuracy, directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Carry on training the saved models on new rows")
+    parser.add_argument("targets", nargs="*",
+                        default=list(model_store.trainers),
+                        help="targets to update (all of them by default)")
+    parser.add_argument("--rounds", type=int, default=update_rounds,
+                        help="boosting rounds added by each update")
+    parser.add_argument("--tolerance", type=float, default=drift_tolerance,
+                        help="fall in accuracy that trains from zero")
+    arguments = parser.parse_args()
+
+    for target in arguments.targets:
+        update_model(target, arguments.rounds, arguments.tolerance)
+
+    # Record the models in the pipeline's state, so it doesn't see them as
+    # changed and train them again. It is imported here as the pipeline
+    # imports this file for its updates
+    import pipeline
+    pipeline.mark_built(["model_" + target for target in arguments.targets])
@@ -0,0 +1,132 @@
+# This file is an alternative backend for the classifiers which gives the
+# categorical features straight to xgboost, rather than one-hot encoding them
+# through sklearn first. Each target's data is put into a DMatrix once, with
+# xgboost's own categorical support and the hist tree method, and every fold
+# of the grid search uses a slice of it rather than converting the data again.
+# It is picked with the backend option of the classifier functions
+import functools
+import time
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+import classifiers
+import data_cache
+import feature_store
+import search_modes
+
+# Parameters shared by every booster, matching the XGBClassifier in the
+# one-hot pipeline apart from the native categorical support
+booster_params = {"objective": "binary:logistic", "seed": 1,
+                  "tree_method": "hist"}
+
+
+# Function to get the categories of each feature across the whole data set
+# of a target, so every slice and any new rows use the same codes
+@functools.lru_cache(maxsize=None)
+def feature_categories(target):
+    data = data_cache.get_data(classifiers.targets[target]["source"])
+    return {feature: pd.Index(data[feature].astype(str).unique())
+            .sort_values() for feature in feature_store.categorical_features}
+
+
+# Function to turn the features of a data frame into pandas categoricals,
+# using the categories of the target unless others are given
+def categorical_features(target, features, categories=None):
+    if categories is None:
+        categories = feature_categories(target)
+    return pd.DataFrame({
+        feature: pd.Categorical(features[feature].astype(str),
+                                categories=categories[feature])
+        for feature in feature_store.categorical_features},
+        index=features.index)
+
+
+# Function to build the DMatrix for the training data of a target, which is
+# only done the first time it is needed
+@functools.lru_cache(maxsize=None)
+def get_dmatrix(target):
+    features, labels = classifiers.target_data(target)
+    return xgb.DMatrix(categorical_features(target, features),
+                       label=np.ravel(labels).astype(int),
+                       enable_categorical=True)
+
+
+# Function to turn grid parameters for the one-hot pipeline into booster
+# parameters and the number of rounds
+def booster_settings(params):
+    settings = dict(booster_params)
+    settings["max_depth"] = params["regressor__max_depth"]
+    return settings, params["regressor__n_estimators"]
+
+
+# A fitted booster for a target, which predicts from a data frame in the same
+# way as the one-hot pipeline. The categories it was trained with are kept
+# with it, so a saved model gives each one the same code once the data set
+# has new ones
+class NativeModel:
+
+    def __init__(self, target, booster):
+        self.target = target
+        self.booster = booster
+        self.categories = feature_categories(target)
+
+    # Function to get the categories of each feature, as a saved model
+    # vocabulary
+    def vocabulary(self):
+        return {feature: [str(category) for category in categories]
+                for feature, categories in self.categories.items()}
+
+    def predict_proba(self, features):
+        matrix = xgb.DMatrix(categorical_features(self.target, features,
+                                                  self.categories),
+                             enable_categorical=True)
+        positive = self.booster.predict(matrix)
+        return np.column_stack([1 - positive, positive])
+
+    def predict(self, features):
+        return (self.predict_proba(features)[:, 1] > 0.5).astype(int)
+
+
+# The results of the grid search for a target, with the same attributes and
+# predict as a fitted GridSearchCV
+class NativeSearch(search_modes.SearchResult):
+
+    def __init__(self, target):
+        self.target = target
+
+    def fit(self):
+        matrix = get_dmatrix(self.target)
+        labels = matrix.get_label()
+        splits = list(StratifiedKFold(search_modes.folds).split(
+            np.zeros(len(labels)), labels))
+
+        # Train and score each set of parameters on slices of the DMatrix
+        all_params = list(ParameterGrid(
+            classifiers.targets[self.target]["param_grid"]))
+        split_scores = np.zeros((len(all_params), len(splits)))
+        self.fit_times_ = np.zeros((len(all_params), len(splits)))
+        for index, params in enumerate(all_params):
+            settings, rounds = booster_settings(params)
+            for fold, (train_rows, test_rows) in enumerate(splits):
+                start = time.perf_counter()
+                booster = xgb.train(settings, matrix.slice(train_rows),
+                                    num_boost_round=rounds)
+                self.fit_times_[index, fold] = time.perf_counter() - start
+                predictions = booster.predict(matrix.slice(test_rows)) > 0.5
+                split_scores[index, fold] = accuracy_score(
+                    labels[test_rows], predictions)
+
+        self.set_results(all_params, split_scores)
+
+        # Refit the best parameters on all of the training data
+        settings, rounds = booster_settings(self.best_params_)
+        self.best_estimator_ = NativeModel(
+            self.target, xgb.train(settings, matrix, num_boost_round=rounds))
+        return self
+
+
+# Function to run the grid search for a target with the native backend
+def native_classifier(target):
+    return NativeSearch(target).fit()
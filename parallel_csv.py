@@ -0,0 +1,224 @@
+# This file reads a csv with several processes. The file is split into byte
+# ranges that each start and end on a record boundary, each range is parsed
+# in a process of its own and the pieces are joined back up in file order.
+#
+# A newline only ends a record when it is outside quotes, as values such as
+# "PROFESSIONAL, SCIENTIFIC AND TECHNICAL ACTIVITIES" are quoted and could
+# hold a newline too. Doubled quotes inside a value come in pairs, so a
+# position is inside quotes when an odd number of quotes come before it in
+# the record.
+#
+# A range read on its own would guess the type of each column from its own
+# rows, so one range could give a column as ints and the next as text. The
+# columns without a type given are read as text in every range instead, and
+# their types are worked out once over the whole file after the ranges are
+# joined. Each column is joined on its own, with a single copy of the values
+# of every range, rather than joining whole frames and copying them again as
+# the types are worked out.
+#
+# The loaders in data_cache, feature_engine and data_investigation read
+# through here. The serial backend is the same as before. Choose the
+# parallel one with the CSV_BACKEND environment variable or by setting
+# default_backend. Small files are always read serially, as starting the
+# processes would cost more than it saves
+import csv
+import io
+import os
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Backend used when none is given, "serial" or "parallel"
+default_backend = os.environ.get("CSV_BACKEND", "serial")
+# Files smaller than this are read serially whatever the backend
+min_parallel_bytes = 8 << 20
+# Number of ranges each worker is given, so the work stays balanced when
+# some ranges are slower to parse than others
+ranges_per_worker = 4
+# read_csv options that change which rows are read, which need the serial
+# reader
+serial_options = ["chunksize", "iterator", "nrows", "skiprows", "header",
+                  "skipfooter"]
+# Text read_csv takes as True or False by default
+true_values = {"True", "TRUE", "true"}
+false_values = {"False", "FALSE", "false"}
+
+
+# Function to get the start of the next record at or after a position,
+# given whether the position is inside quotes
+def next_record(data, position, quoted):
+    while True:
+        newline = data.find(b"\n", position)
+        if newline == -1:
+            return len(data)
+        quoted ^= data[position:newline].count(b'"') & 1
+        if not quoted:
+            return newline + 1
+        position = newline + 1
+
+
+# Function to split a csv into about the given number of byte ranges, each
+# holding whole records. Gives the header names and the ranges
+def record_ranges(csv_path, parts, encoding="utf-8"):
+    with open(csv_path, "rb") as csvfile, \
+            mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        header_end = next_record(data, 0, 0)
+        names = next(csv.reader(io.StringIO(
+            data[:header_end].decode(encoding).lstrip("\ufeff"),
+            newline="")))
+
+        # Move each evenly spaced split point on to the next record
+        boundaries = [header_end]
+        for part in range(1, parts):
+            target = header_end + (size - header_end) * part // parts
+            if target <= boundaries[-1]:
+                continue
+            quoted = data[boundaries[-1]:target].count(b'"') & 1
+            boundary = next_record(data, target, quoted)
+            if boundary >= size:
+                break
+            boundaries.append(boundary)
+        boundaries.append(size)
+
+    return names, [(start, end) for start, end in
+                   zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+
+# Function to read the bytes of a range of a csv
+def read_range(csv_path, start, end):
+    with open(csv_path, "rb") as csvfile:
+        csvfile.seek(start)
+        return csvfile.read(end - start)
+
+
+# Function run in each worker to parse a range into a data frame, with the
+# same options as the whole file
+def parse_frame(csv_path, start, end, names, options):
+    return pd.read_csv(io.BytesIO(read_range(csv_path, start, end)),
+                       header=None, names=names, **options)
+
+
+# Function run in each worker to parse a range into lists of values
+def parse_rows(csv_path, start, end, encoding):
+    text = read_range(csv_path, start, end).decode(encoding)
+    return list(csv.reader(io.StringIO(text, newline="")))
+
+
+# Function to get the read_csv options for each range, which read every
+# column without a type or converter given as text. Gives the options and
+# the names of the columns read as text
+def text_options(names, options):
+    dtype = options.get("dtype")
+    if dtype is not None and not isinstance(dtype, dict):
+        return options, []
+    given = set(dtype or {}) | set(options.get("converters") or {})
+    usecols = options.get("usecols")
+    if usecols is not None and not callable(usecols):
+        names = [name for position, name in enumerate(names)
+                 if name in usecols or position in usecols]
+    untyped = [name for name in names if name not in given]
+    return dict(options, dtype=dict(dtype or {}, **{name: str
+                                                    for name in untyped})), \
+        untyped
+
+
+# Function to give a column read as text the type read_csv would have given
+# it over the whole file: numbers where every value is one, bools where every
+# value is True or False, and text otherwise
+def infer_column(values):
+    try:
+        return pd.to_numeric(values)
+    except (ValueError, TypeError):
+        pass
+    distinct = set(values.unique())
+    if distinct <= true_values | false_values:
+        return values.isin(true_values)
+    return values
+
+
+# Function to join the pieces of a column read from each range, in file
+# order, copying the values once. Categories can differ between the ranges,
+# so they are joined by pandas
+def join_column(pieces):
+    dtype = pieces[0].dtype
+    if isinstance(dtype, pd.CategoricalDtype) or \
+            any(piece.dtype != dtype for piece in pieces):
+        return pd.concat(pieces, ignore_index=True)
+    return pd.Series(np.concatenate([piece.to_numpy() for piece in pieces]),
+                     dtype=dtype)
+
+
+# Function to check if a csv should be read with several processes
+def use_parallel(csv_path, backend=None):
+    if backend is None:
+        backend = default_backend
+    return backend == "parallel" and \
+        os.path.getsize(csv_path) >= min_parallel_bytes
+
+
+# Function to get the number of workers and ranges to split a csv into
+def worker_count(workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    return workers, workers * ranges_per_worker
+
+
+# Function to read a csv into a data frame, taking the same options as
+# pd.read_csv
+def read_frame(csv_path, backend=None, workers=None, **options):
+    if not use_parallel(csv_path, backend) or \
+            any(option in options for option in serial_options):
+        return pd.read_csv(csv_path, **options)
+
+    workers, parts = worker_count(workers)
+    names, ranges = record_ranges(csv_path, parts,
+                                  options.get("encoding", "utf-8"))
+    range_options, untyped = text_options(names, options)
+    with ProcessPoolExecutor(workers) as executor:
+        chunks = list(executor.map(
+            parse_frame, *zip(*[(csv_path, start, end, names, range_options)
+                                for start, end in ranges])))
+
+    # The pieces are already in file order, so each column is joined up,
+    # letting go of its pieces as it goes, and given its type
+    if len(chunks) == 0:
+        return pd.read_csv(csv_path, **options)
+    columns = {}
+    for name in list(chunks[0].columns):
+        columns[name] = join_column([chunk.pop(name) for chunk in chunks])
+        if name in untyped:
+            columns[name] = infer_column(columns[name])
+    return pd.DataFrame(columns)
+
+
+# Generator that gives the rows of a csv as dicts, the same as a
+# csv.DictReader. With the parallel backend a few ranges are parsed ahead
+# of the one being handed out, so memory stays bounded
+def iterate_rows(csv_path, backend=None, workers=None, encoding="utf-8"):
+    if not use_parallel(csv_path, backend):
+        with open(csv_path, newline="", encoding=encoding) as csvfile:
+            yield from csv.DictReader(csvfile)
+        return
+
+    workers, parts = worker_count(workers)
+    names, ranges = record_ranges(csv_path, parts, encoding)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        ranges = iter(ranges)
+        while True:
+            # Keep two ranges queued for each worker
+            while len(pending) < workers * 2:
+                next_range = next(ranges, None)
+                if next_range is None:
+                    break
+                pending.append(executor.submit(parse_rows, csv_path,
+                                               *next_range, encoding))
+            if len(pending) == 0:
+                return
+            for values in pending.popleft().result():
+                # Skip blank lines, as csv.DictReader does
+                if len(values) > 0:
+                    yield dict(zip(names, values))
@@ -0,0 +1,410 @@
+# This file runs the whole project as a graph of stages, from the Invest NI
+# data through the derived files and the models to the testing predictions.
+#
+# Each stage lists the files it reads (including the code it runs), the
+# files it writes and its parameters. A stage depends on the stages that
+# write the files it reads. It is keyed by a hash of its parameters and the
+# contents of the files it reads, and is only run again when that key
+# changes or one of its outputs is missing or has been changed since it was
+# written. The code a stage reads is the module it runs along with every
+# module of the project that module imports. Stages whose dependencies are
+# done run side by side in separate processes, so the three models are
+# trained together. The two derived files come from the same pass over the
+# Invest NI data, so they are written by a single stage.
+#
+# A stage can also have an update, run instead of the stage when it has run
+# before, the only inputs that have changed are ones its update takes and
+# its check passes. Each model stage carries on training its saved model on
+# the rows added to its csv this way (see model_updates.py), rather than
+# training from zero, as long as the rows it was trained on are still the
+# first rows of the csv.
+#
+# The Invest NI csv is only downloaded when it is missing, or when forced.
+# Forcing it merges in only the records that are new or have changed since
+# the last download, and the stages after it only run again if any did.
+#
+# Usage: python pipeline.py [stage ...] [--force [stage ...]] [--workers 3]
+#            [--status]
+import argparse
+import ast
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import classifiers
+import data_cache
+import data_investigation
+import data_manipulation as dm
+import feature_engine
+import instrumentation
+import model_store
+import model_tests
+import model_updates
+
+# File holding the key and output hashes of every stage that has run
+state_path = "Data/build_state.json"
+
+# Manifest of the saved models, which the tests read the holdout ends from
+manifest_path = os.path.join(model_store.models_path,
+                             model_store.manifest_name)
+
+# Testing set, label and output of each target
+test_sets = {"average_grade": ("overall", "Average Grade",
+                               "Data/testing/avg_grade_test.csv"),
+             "non_zero_grade": ("zero_removed", "Average Grade",
+                                "Data/testing/zero_removed_data_test.csv"),
+             "business_plan": ("overall", "Business Plan Grade",
+                               "Data/testing/business_grade_test.csv")}
+
+
+# Function to get the path a target's model is saved to
+def model_path(target):
+    return os.path.join(model_store.models_path, target + ".joblib")
+
+
+# Function to get the code a stage runs, so changing it runs the stage
+# again. This is the files given and every file of the project they import,
+# directly or through other files. The pipeline itself is left out, as it
+# only declares the stages
+def stage_code(*files):
+    code = set()
+    pending = list(files)
+    while len(pending) > 0:
+        path = pending.pop()
+        if path in code or path == "pipeline.py":
+            continue
+        code.add(path)
+        with open(path, encoding="utf-8") as code_file:
+            tree = ast.parse(code_file.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(name + ".py" for name in names
+                           if os.path.isfile(name + ".py"))
+    return sorted(code)
+
+
+# Functions run for each stage, in a worker process
+def fetch_invest_data():
+    dm.invest_data_refresh(data_investigation.invest_path)
+
+
+def write_derived_data():
+    feature_engine.derive_files(data_investigation.invest_path,
+                                data_investigation.append_path,
+                                data_investigation.zero_removed_path, True)
+
+
+def train_model(target):
+    model_store.save_model(target, model_store.trainers[target]())
+
+
+def update_model(target):
+    model_updates.update_model(target)
+
+
+# Function to check if the rows the saved model of a target was trained on
+# are still the first rows of its csv, so it can be updated with the rows
+# after them. Any other change to the csv trains the model from zero
+def rows_appended(target):
+    entry = model_store.load_manifest().get(target)
+    return entry is not None and "source_rows" in entry and \
+        model_updates.new_rows(target, entry) is not None
+
+
+def test_model(target):
+    testing_set, label, output_path = test_sets[target]
+    holdout_end = model_store.holdout_end(target)
+    if testing_set == "overall":
+        testing = model_tests.overall_testing(holdout_end)
+    else:
+        testing = model_tests.zero_removed_testing(holdout_end)
+    metrics = model_tests.evaluate_model(model_store.load_model(target),
+                                         testing, label, output_path)
+    print("Tested " + target + ": accuracy " + str(metrics["accuracy"]))
+
+
+# Function to declare every stage, with the function it runs and its
+# arguments, the files it reads and writes and its parameters, along with
+# its update, the inputs the update takes and the check that has to pass
+# for it to run if it has one
+def declare_stages():
+    derive_code = stage_code("feature_engine.py", "data_investigation.py")
+    model_code = stage_code("model_store.py", "model_updates.py")
+    test_code = stage_code("model_tests.py")
+    stages = {
+        "invest_data": {
+            "run": fetch_invest_data, "args": (),
+            "inputs": [], "outputs": [data_investigation.invest_path],
+            "params": {"api": dm.invest_ni_base_api,
+                       "resource": dm.invest_ni_resource},
+            # Downloaded data can't be rebuilt from the inputs, so it is
+            # kept for as long as the file is there
+            "source": True},
+        "derived_data": {
+            "run": write_derived_data, "args": (),
+            "inputs": [data_investigation.invest_path] + derive_code,
+            "outputs": [data_investigation.append_path,
+                        data_investigation.zero_removed_path],
+            "params": {}}
+    }
+
+    for target, settings in classifiers.targets.items():
+        stages["model_" + target] = {
+            "run": train_model, "args": (target,),
+            "inputs": [settings["source"]] + model_code,
+            "outputs": [model_path(target)],
+            "params": {"param_grid": settings["param_grid"]},
+            "update": update_model, "update_inputs": [settings["source"]],
+            "update_check": rows_appended}
+        stages["test_" + target] = {
+            "run": test_model, "args": (target,),
+            "inputs": [settings["source"], model_path(target),
+                       manifest_path] + test_code,
+            "outputs": [test_sets[target][2]],
+            "params": {"label": test_sets[target][1]}}
+    return stages
+
+
+# Function to get the names of the stages each stage depends on
+def dependencies(stages):
+    writers = {output: name for name, stage in stages.items()
+               for output in stage["outputs"]}
+    return {name: sorted({writers[path] for path in stage["inputs"]
+                          if path in writers})
+            for name, stage in stages.items()}
+
+
+# Function to get the stages asked for along with everything they depend
+# on, in an order where every stage comes after its dependencies
+def build_order(stages, wanted=None):
+    depends = dependencies(stages)
+    if not wanted:
+        wanted = list(stages)
+
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        for dependency in depends[name]:
+            visit(dependency)
+        order.append(name)
+
+    for name in wanted:
+        if name not in stages:
+            raise KeyError("Unknown stage: " + name)
+        visit(name)
+    return order
+
+
+# Function to read the state of the stages that have run
+def load_state():
+    if not os.path.isfile(state_path):
+        return {"stages": {}, "hashes": {}}
+    with open(state_path, encoding="utf-8") as state_file:
+        return json.load(state_file)
+
+
+# Function to write the state, replacing the old one in a single step
+def save_state(state):
+    with open(state_path + ".tmp", "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=1)
+    os.replace(state_path + ".tmp", state_path)
+
+
+# Function to get the hash of the contents of a file, or None if it doesn't
+# exist. Hashes are kept in the state against the modified time and size, so
+# files that haven't changed aren't read again
+def file_hash(path, state):
+    if not os.path.isfile(path):
+        return None
+    signature = data_cache.source_signature(path)
+    known = state["hashes"].get(path)
+    if known is not None and known["mtime_ns"] == signature["mtime_ns"] \
+            and known["size"] == signature["size"]:
+        return known["sha1"]
+    signature = data_cache.source_signature(path, use_hash=True)
+    state["hashes"][path] = signature
+    return signature["sha1"]
+
+
+# Function to get the hash of the parameters of a stage
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+# Function to get the key of a stage from its parameters and the contents
+# of the files it reads
+def stage_key(name, stage, state):
+    key = {"stage": name, "params": stage["params"],
+           "inputs": {path: file_hash(path, state)
+                      for path in stage["inputs"]}}
+    return hashlib.sha1(json.dumps(key, sort_keys=True,
+                                   default=str).encode()).hexdigest()
+
+
+# Function to check if a stage can be skipped, as it has already run with
+# the same key and its outputs haven't changed since
+def up_to_date(name, stage, key, state):
+    if stage.get("source"):
+        return all(os.path.isfile(path) for path in stage["outputs"])
+
+    record = state["stages"].get(name)
+    return record is not None and record["key"] == key and \
+        all(file_hash(path, state) == record["outputs"].get(path)
+            for path in stage["outputs"])
+
+
+# Function to check if a stage that isn't up to date can run its update
+# instead. It needs to have run before with the same parameters, its outputs
+# can't have changed since, the only inputs that have changed are ones its
+# update takes and its check has to pass
+def can_update(name, stage, state):
+    record = state["stages"].get(name)
+    if "update" not in stage or record is None or "inputs" not in record:
+        return False
+    return record["params"] == params_hash(stage["params"]) and \
+        all(file_hash(path, state) == record["outputs"].get(path)
+            for path in stage["outputs"]) and \
+        all(path in stage["update_inputs"] or
+            file_hash(path, state) == record["inputs"].get(path)
+            for path in stage["inputs"]) and \
+        stage["update_check"](*stage["args"])
+
+
+# Function to record a stage as run with its key, its parameters and the
+# hashes of the files it reads and writes as they are now
+def record_stage(name, stage, state):
+    state["stages"][name] = {
+        "key": stage_key(name, stage, state),
+        "params": params_hash(stage["params"]),
+        "inputs": {path: file_hash(path, state) for path in stage["inputs"]},
+        "outputs": {path: file_hash(path, state)
+                    for path in stage["outputs"]}}
+
+
+# Function to record stages as up to date once their outputs have been
+# built outside of the pipeline, such as by model_updates.py
+def mark_built(names):
+    stages = declare_stages()
+    state = load_state()
+    for name in names:
+        record_stage(name, stages[name], state)
+    save_state(state)
+
+
+# Function run in a worker process for each stage
+def run_stage(name, function, args):
+    with instrumentation.stage("build_" + name):
+        function(*args)
+
+
+# Function to run the stages asked for (every stage by default) and the
+# stages they depend on, skipping the ones that are up to date and running
+# the update of the ones that can be updated. Forced stages are run in full
+# whatever their state. Returns the names of the stages that were run
+def run_pipeline(wanted=None, forced=(), workers=None):
+    stages = declare_stages()
+    order = build_order(stages, wanted)
+    depends = dependencies(stages)
+    state = load_state()
+
+    done = set()
+    ran = []
+    running = {}
+    with ProcessPoolExecutor(workers) as executor:
+        while len(done) < len(order):
+            # Start every stage whose dependencies are done, skipping the
+            # ones that are up to date
+            for name in order:
+                if name in done or name in running.values() or \
+                        not all(dependency in done
+                                for dependency in depends[name]):
+                    continue
+                stage = stages[name]
+                key = stage_key(name, stage, state)
+                if name not in forced and up_to_date(name, stage, key,
+                                                     state):
+                    print("Up to date: " + name)
+                    done.add(name)
+                    continue
+                function = stage["run"]
+                if name not in forced and can_update(name, stage, state):
+                    print("Updating: " + name)
+                    function = stage["update"]
+                else:
+                    print("Running: " + name)
+                running[executor.submit(run_stage, name, function,
+                                        stage["args"])] = name
+
+            if len(running) == 0:
+                continue
+
+            # Record each stage as it finishes, then look for the stages
+            # it lets start
+            finished = wait(running, return_when=FIRST_COMPLETED)[0]
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                record_stage(name, stages[name], state)
+                save_state(state)
+                done.add(name)
+                ran.append(name)
+    return ran
+
+
+# Function to print whether each stage would run, given the files as they
+# are now. A stage after one that would run is shown as waiting on it
+def print_status(wanted=None):
+    stages = declare_stages()
+    depends = dependencies(stages)
+    state = load_state()
+    stale = set()
+    for name in build_order(stages, wanted):
+        stage = stages[name]
+        waiting = [dependency for dependency in depends[name]
+                   if dependency in stale]
+        if len(waiting) > 0:
+            status = "waiting on " + ", ".join(waiting)
+        elif up_to_date(name, stage, stage_key(name, stage, state), state):
+            status = "up to date"
+        elif can_update(name, stage, state):
+            status = "update"
+        else:
+            status = "stale"
+        if status != "up to date":
+            stale.add(name)
+        print("{:<24}{}".format(name, status))
+    save_state(state)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the Invest NI data, models and test results")
+    parser.add_argument("stages", nargs="*",
+                        help="stages to build, with what they depend on "
+                             "(all of them by default)")
+    parser.add_argument("--force", nargs="*",
+                        help="run these stages even if up to date (every "
+                             "stage if none are named)")
+    parser.add_argument("--workers", type=int,
+                        help="most stages to run at once")
+    parser.add_argument("--status", action="store_true",
+                        help="only show which stages would run")
+    arguments = parser.parse_args()
+
+    if arguments.status:
+        print_status(arguments.stages)
+    else:
+        forced = arguments.force
+        if forced is not None and len(forced) == 0:
+            forced = build_order(declare_stages(), arguments.stages)
+        ran = run_pipeline(arguments.stages, forced or (),
+                           arguments.workers)
+        print("Ran " + str(len(ran)) + " stages")
@@ -0,0 +1,286 @@
+# This file holds rows of Invest NI data in a compact store, in place of a
+# list of csv.DictReader dicts of strings. Each column is kept on its own:
+#   - Amounts, gains, grades and jobs as arrays of floats, so they are only
+#     parsed once
+#   - Text columns (Sector, Condition, Constituency, Client Name...) as codes
+#     into a table of their distinct values
+#   - The "True"/"False" markers as bits, eight to a byte
+#
+# Indexing or iterating over a store gives row views, which can be read and
+# written like the row dicts, so code written for the dicts works on a store
+# unchanged. A view turns each value back into the text it was read from, so
+# reading a row through one costs more than reading a dict. Work over whole
+# columns should take them as NumPy arrays instead, and set whole marker
+# columns with set_array
+from array import array
+import numpy as np
+import data_investigation
+
+# Columns held as floats
+numeric_columns = ["Total Assistance", "Total Investment", "Investment Gain",
+                   "Investment Grade", "Estimated Jobs"]
+# Columns held as bits
+boolean_columns = ["Business Plan Grade", "Average Grade", "Jobs Created"]
+# Other names the columns go by in the row dicts
+column_aliases = {"Business Value": "Business Plan Grade"}
+
+
+# Function to get the name a column is stored under
+def column_name(name):
+    return column_aliases.get(name, name)
+
+
+# A column of booleans packed into the bits of a byte array
+class BitColumn:
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.size = 0
+
+    def append(self, value):
+        if self.size & 7 == 0:
+            self.bits.append(0)
+        self.size += 1
+        self.set(self.size - 1, value)
+
+    def set(self, index, value):
+        if value:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+    def is_set(self, index):
+        return (self.bits[index >> 3] >> (index & 7)) & 1 == 1
+
+    # Function to set every value from a NumPy boolean array
+    def set_mask(self, mask):
+        self.bits = bytearray(np.packbits(mask, bitorder="little"))
+        self.size = len(mask)
+
+    # Function to get every value as a NumPy boolean array
+    def mask(self):
+        return np.unpackbits(np.frombuffer(bytes(self.bits), np.uint8),
+                             count=self.size, bitorder="little").astype(bool)
+
+
+# Function to read a marker, given as "True"/"False" or as a bool
+def marker_value(value):
+    if isinstance(value, str):
+        return value == "True"
+    return bool(value)
+
+
+# A column of "True"/"False" markers
+class BooleanColumn(BitColumn):
+    empty = "False"
+
+    def append(self, value):
+        super().append(marker_value(value))
+
+    def set(self, index, value):
+        super().set(index, marker_value(value))
+
+    def get(self, index):
+        return "True" if self.is_set(index) else "False"
+
+    def array(self):
+        return self.mask()
+
+
+# A column of numbers, along with a bit for each saying if it was a whole
+# number, so it is given back as the same text it was read from
+class NumberColumn:
+    empty = 0
+
+    def __init__(self):
+        self.values = array("d")
+        self.whole = BitColumn()
+
+    def append(self, value):
+        self.values.append(float(value))
+        self.whole.append(isinstance(value, int) or
+                          (isinstance(value, str) and
+                           value.lstrip("-").isdigit()))
+
+    def set(self, index, value):
+        self.values[index] = float(value)
+        self.whole.set(index, isinstance(value, int) or
+                       (isinstance(value, str) and
+                        value.lstrip("-").isdigit()))
+
+    def get(self, index):
+        if self.whole.is_set(index):
+            return str(int(self.values[index]))
+        return repr(self.values[index])
+
+    # The floats are shared with the array, not copied
+    def array(self):
+        return np.frombuffer(self.values, np.float64)
+
+
+# A column of text, held as a code for each row into a table of the distinct
+# values
+class CategoryColumn:
+    empty = ""
+
+    def __init__(self):
+        self.codes = array("I")
+        self.categories = []
+        self.lookup = {}
+
+    def code(self, value):
+        value = str(value)
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.lookup[value] = code
+            self.categories.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(self.code(value))
+
+    def set(self, index, value):
+        self.codes[index] = self.code(value)
+
+    def get(self, index):
+        return self.categories[self.codes[index]]
+
+    # The codes of each row, shared with the array rather than copied
+    def array(self):
+        return np.frombuffer(self.codes, np.uint32)
+
+
+# Function to create an empty column of the right kind for a name
+def new_column(name):
+    if name in numeric_columns:
+        return NumberColumn()
+    if name in boolean_columns:
+        return BooleanColumn()
+    return CategoryColumn()
+
+
+# A single row of a store, which reads and writes the store's columns
+class RowView:
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.store.getters[name](self.index)
+
+    def __setitem__(self, name, value):
+        setter = self.store.setters.get(name)
+        if setter is None:
+            setter = self.store.column(name, create=True).set
+        setter(self.index, value)
+        self.store.version += 1
+
+    def __contains__(self, name):
+        return column_name(name) in self.store.columns
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def keys(self):
+        return list(self.store.columns)
+
+    # Function to copy the row out into a plain dict
+    def to_dict(self):
+        return {name: self[name] for name in self.store.columns}
+
+
+# Rows of data held column by column
+class RecordStore:
+
+    def __init__(self):
+        self.columns = {}
+        # The get and set functions of each column, under its name and any
+        # aliases, so row views can look them up in one step
+        self.getters = {}
+        self.setters = {}
+        self.size = 0
+        # Counts every change to the store, so anything worked out from it
+        # can tell when it is out of date
+        self.version = 0
+
+    # Function to get a column by name. A column that doesn't exist yet is
+    # added, filled with 0, "False" or "" for the rows so far, if create is
+    # set
+    def column(self, name, create=False):
+        name = column_name(name)
+        if name not in self.columns:
+            if not create:
+                raise KeyError(name)
+            column = new_column(name)
+            for _ in range(self.size):
+                column.append(column.empty)
+            self.add_column(name, column)
+        return self.columns[name]
+
+    # Function to add a column, with its get and set functions under its
+    # name and any aliases
+    def add_column(self, name, column):
+        self.columns[name] = column
+        for alias in [name] + [alias for alias, alias_name
+                               in column_aliases.items()
+                               if alias_name == name]:
+            self.getters[alias] = column.get
+            self.setters[alias] = column.set
+
+    # Function to set a whole marker column from a NumPy boolean array, in
+    # one step rather than a row at a time
+    def set_array(self, name, mask):
+        name = column_name(name)
+        if name not in self.columns:
+            self.add_column(name, new_column(name))
+        self.columns[name].set_mask(np.asarray(mask, dtype=bool))
+        self.version += 1
+
+    # Function to add a row dict to the end of the store. Every row needs
+    # the same columns
+    def append(self, row):
+        for name, value in row.items():
+            self.column(name, create=True).append(value)
+        self.size += 1
+        self.version += 1
+
+    # Function to get a column as a NumPy array - floats for numbers, bools
+    # for markers and codes for text
+    def array(self, name):
+        return self.column(name).array()
+
+    # Function to get the distinct values of a text column, in code order
+    def categories(self, name):
+        return self.column(name).categories
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("row index out of range")
+        return RowView(self, index)
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield RowView(self, index)
+
+
+# Function to build a store from any iterable of row dicts
+def build_store(rows):
+    store = RecordStore()
+    for row in rows:
+        store.append(row)
+    return store
+
+
+# Function to load a csv straight into a store, a row at a time
+def load_store(data_source):
+    return build_store(data_investigation.iterate_data(data_source))
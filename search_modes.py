@@ -0,0 +1,211 @@
+# This file holds the different ways of searching for the best parameters of
+# a classifier. As well as the exhaustive grid search there is:
+#   - "halving", sklearn's successive halving grid search, which tries every
+#     combination on a small part of the data and only keeps the best ones
+#     as the amount of data is increased
+#   - "rounds", which fits one model per fold with the largest number of
+#     estimators in the grid and scores every smaller number from the first
+#     trees of that model, so a 300 tree model is never trained separately
+#     from its 100 tree prefix. It can also use xgboost's early stopping on
+#     a validation split held out of each training fold, so the fold being
+#     scored plays no part in choosing the rounds. The best number of
+#     estimators is then the number of rounds it stopped at, which is what
+#     the refit uses
+# Every mode gives back an object with the same best_score_, best_params_,
+# cv_results_ and predict as a fitted GridSearchCV
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import GridSearchCV, ParameterGrid, check_cv
+from sklearn.model_selection import train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV
+from scipy.stats import rankdata
+
+# Names of the search modes
+search_modes = ["grid", "halving", "rounds"]
+# Number of folds in every search, unless make_search is given another
+folds = 5
+# Part of each training fold held out for early stopping
+validation_size = 0.2
+
+
+# Function to take rows by position from a data frame or a matrix
+def take_rows(features, rows):
+    if hasattr(features, "iloc"):
+        return features.iloc[rows]
+    return features[rows]
+
+
+# Function to fit the largest model for one fold and score it at each number
+# of rounds. Returns the accuracy for each number of rounds, along with the
+# round it stopped at
+def fit_fold(estimator, params, rounds, rounds_param, features, labels,
+             train_rows, test_rows, early_stopping_rounds):
+    model = clone(estimator).set_params(**params)
+    model.set_params(**{rounds_param: rounds[-1]})
+
+    # Hold a validation split out of the training rows to stop early on
+    validation_rows = None
+    if early_stopping_rounds is not None:
+        train_rows, validation_rows = train_test_split(
+            train_rows, test_size=validation_size,
+            stratify=labels[train_rows], random_state=0)
+
+    # Fit the preprocessing steps and transform every side of the fold, if
+    # the features aren't encoded already
+    train_features = take_rows(features, train_rows)
+    test_features = take_rows(features, test_rows)
+    if validation_rows is not None:
+        validation_features = take_rows(features, validation_rows)
+    if len(model) > 1:
+        preprocessing = model[:-1]
+        train_features = preprocessing.fit_transform(train_features,
+                                                     labels[train_rows])
+        test_features = preprocessing.transform(test_features)
+        if validation_rows is not None:
+            validation_features = preprocessing.transform(
+                validation_features)
+
+    # Fit the booster with the largest number of rounds, stopping early if
+    # the validation split stops improving
+    booster = model[-1]
+    if validation_rows is None:
+        booster.fit(train_features, labels[train_rows])
+        last_round = rounds[-1]
+    else:
+        booster.set_params(early_stopping_rounds=early_stopping_rounds)
+        booster.fit(train_features, labels[train_rows],
+                    eval_set=[(validation_features,
+                               labels[validation_rows])],
+                    verbose=False)
+        last_round = booster.best_iteration + 1
+
+    # Score the first trees for each number of rounds
+    return [accuracy_score(labels[test_rows], booster.predict(
+        test_features, iteration_range=(0, min(n_rounds, last_round))))
+        for n_rounds in rounds], last_round
+
+
+# Class holding the results of a search in the same way as a fitted
+# GridSearchCV, for the searches that don't use sklearn's. The search sets
+# its scores with set_results and its best_estimator_ once it is refitted
+class SearchResult:
+
+    # Function to record the score of each set of parameters on each fold,
+    # laid out as GridSearchCV's cv_results_. The first best is picked, like
+    # GridSearchCV
+    def set_results(self, all_params, split_scores):
+        mean_scores = split_scores.mean(axis=1)
+        self.cv_results_ = {
+            "params": all_params,
+            "mean_test_score": mean_scores,
+            "std_test_score": split_scores.std(axis=1),
+            "rank_test_score": rankdata(-mean_scores,
+                                        method="min").astype(int),
+            "split_test_scores": split_scores
+        }
+        self.best_index_ = int(np.argmax(mean_scores))
+        self.best_params_ = all_params[self.best_index_]
+        self.best_score_ = mean_scores[self.best_index_]
+
+    def predict(self, features):
+        return self.best_estimator_.predict(features)
+
+    def predict_proba(self, features):
+        return self.best_estimator_.predict_proba(features)
+
+    def score(self, features, labels):
+        return accuracy_score(np.ravel(labels), self.predict(features))
+
+
+# Search which reuses the boosting rounds of one model for every number of
+# estimators in the grid
+class RoundSearchCV(SearchResult):
+
+    def __init__(self, estimator, param_grid, cv=folds, n_jobs=None,
+                 verbose=0, rounds_param="regressor__n_estimators",
+                 early_stopping_rounds=None):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.rounds_param = rounds_param
+        self.early_stopping_rounds = early_stopping_rounds
+
+    def fit(self, features, labels):
+        labels = np.ravel(labels)
+
+        # Split the grid into the numbers of rounds and everything else
+        rounds = sorted(self.param_grid[self.rounds_param])
+        other_grid = list(ParameterGrid(
+            {name: values for name, values in self.param_grid.items()
+             if name != self.rounds_param}))
+        splits = list(check_cv(self.cv, labels, classifier=True)
+                      .split(features, labels))
+
+        # Fit one model for each of the other parameters and fold
+        fold_results = Parallel(n_jobs=self.n_jobs)(
+            delayed(fit_fold)(self.estimator, params, rounds,
+                              self.rounds_param, features, labels,
+                              train_rows, test_rows,
+                              self.early_stopping_rounds)
+            for params in other_grid for train_rows, test_rows in splits)
+        fold_scores = np.array([scores for scores, _ in fold_results])\
+            .reshape(len(other_grid), len(splits), len(rounds))
+        last_rounds = np.array([last for _, last in fold_results])\
+            .reshape(len(other_grid), len(splits))
+
+        # Lay the scores out in the same order as GridSearchCV, along with
+        # the number of rounds each fold used
+        all_params = list(ParameterGrid(self.param_grid))
+        split_scores = np.zeros((len(all_params), len(splits)))
+        used_rounds = np.zeros((len(all_params), len(splits)), dtype=int)
+        for index, params in enumerate(all_params):
+            other = {name: value for name, value in params.items()
+                     if name != self.rounds_param}
+            n_rounds = params[self.rounds_param]
+            split_scores[index] = fold_scores[
+                other_grid.index(other), :, rounds.index(n_rounds)]
+            used_rounds[index] = np.minimum(
+                last_rounds[other_grid.index(other)], n_rounds)
+            if self.verbose:
+                print("[CV] {} mean score={:.3f}"
+                      .format(params, split_scores[index].mean()))
+
+        self.set_results(all_params, split_scores)
+        self.cv_results_["split_rounds"] = used_rounds
+
+        # The best model is the one with the number of rounds the folds
+        # stopped at, which is the grid value when there is no early stopping
+        self.best_params_ = dict(self.best_params_)
+        self.best_params_[self.rounds_param] = int(round(
+            used_rounds[self.best_index_].mean()))
+
+        # Refit the best parameters on all of the data
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_).fit(features, labels)
+        return self
+
+
+# Function to create the search for a pipeline and its grid using the given
+# mode. Only the rounds mode can stop early
+def make_search(estimator, param_grid, mode="grid", cv=folds, verbose=0,
+                n_jobs=2, early_stopping_rounds=None):
+    if early_stopping_rounds is not None and mode != "rounds":
+        raise ValueError("Early stopping needs the rounds search mode, not " +
+                         str(mode))
+    if mode == "grid":
+        return GridSearchCV(estimator, param_grid, cv=cv, verbose=verbose,
+                            n_jobs=n_jobs, scoring="accuracy")
+    if mode == "halving":
+        return HalvingGridSearchCV(estimator, param_grid, cv=cv,
+                                   verbose=verbose, n_jobs=n_jobs,
+                                   scoring="accuracy", random_state=0)
+    if mode == "rounds":
+        return RoundSearchCV(estimator, param_grid, cv=cv, n_jobs=n_jobs,
+                             verbose=verbose,
+                             early_stopping_rounds=early_stopping_rounds)
+    raise ValueError("Unknown search mode: " + str(mode))
@@ -0,0 +1,81 @@
+# This file runs a search on the encoded features held in memory mapped
+# files, rather than handing the data frame to every worker.
+#
+# In the normal mode each task of a parallel search is sent a pickled copy
+# of the training data frame and of the pipeline, which carries the whole
+# feature store with it, and each worker encodes its rows again. Here the
+# rows are encoded once, the sparse matrix and labels are written out as
+# .npy files and opened with mmap_mode. joblib passes memory mapped arrays
+# to its workers as a reference to the file, so every worker reads the same
+# pages rather than a copy of its own. The search is run on the booster
+# alone, then the feature store encoder is put back in front of the best
+# model so it predicts from the same features as before
+import os
+import json
+import tempfile
+import numpy as np
+import scipy.sparse
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+import feature_store
+import search_modes
+
+# Arrays of the sparse matrix written to disk
+matrix_arrays = ["data", "indices", "indptr"]
+
+
+# Function to write a sparse matrix and its labels to a folder
+def write_matrix(matrix, labels, directory):
+    matrix = scipy.sparse.csr_matrix(matrix)
+    for name in matrix_arrays:
+        np.save(os.path.join(directory, name + ".npy"), getattr(matrix, name))
+    np.save(os.path.join(directory, "labels.npy"), labels)
+    with open(os.path.join(directory, "shape.json"), "w",
+              encoding="utf-8") as shape_file:
+        json.dump(list(matrix.shape), shape_file)
+
+
+# Function to open a matrix and its labels written by write_matrix, without
+# reading them into memory
+def load_matrix(directory):
+    arrays = [np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+              for name in matrix_arrays]
+    with open(os.path.join(directory, "shape.json"),
+              encoding="utf-8") as shape_file:
+        shape = tuple(json.load(shape_file))
+    matrix = scipy.sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+    labels = np.load(os.path.join(directory, "labels.npy"), mmap_mode="r")
+    return matrix, labels
+
+
+# Function to run a search of a pipeline on the shared matrix of its
+# features. Gives back the fitted search, whose best estimator predicts from
+# the features as the pipeline does
+def shared_search(pipeline, features, labels, param_grid, mode="grid",
+                  verbose=0, n_jobs=2, directory=None,
+                  early_stopping_rounds=None):
+    encoder = pipeline.named_steps["preprocessor"]
+    if not isinstance(encoder, feature_store.StoreEncoder):
+        raise ValueError("The shared matrix needs the shared feature store "
+                         "rather than an encoder fitted in each fold")
+
+    # Encode the rows once and search over the booster on its own
+    matrix = encoder.transform(features)
+    booster = Pipeline(steps=[
+        ("regressor", clone(pipeline.named_steps["regressor"]))])
+    search = search_modes.make_search(
+        booster, param_grid, mode, verbose=verbose, n_jobs=n_jobs,
+        early_stopping_rounds=early_stopping_rounds)
+
+    # The files are only needed while the workers are fitting
+    with tempfile.TemporaryDirectory(dir=directory,
+                                     ignore_cleanup_errors=True) as folder:
+        write_matrix(matrix, np.ravel(labels), folder)
+        shared_features, shared_labels = load_matrix(folder)
+        search.fit(shared_features, shared_labels)
+
+    # Put the encoder back in front of the best model
+    search.best_estimator_ = Pipeline(steps=[
+        ("preprocessor", encoder),
+        ("regressor", search.best_estimator_.named_steps["regressor"])])
+    return search
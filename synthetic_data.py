@@ -0,0 +1,204 @@
+# This file generates synthetic Invest NI data, in the same format as
+# Data/invest_ni.csv, for testing how the analysis scales to far more rows.
+#
+# The distributions are learnt from an existing csv:
+#   - Sector, Condition, Constituency, SME, Ownership, Status and Country are
+#     drawn together from the combinations seen in the csv, so the joint
+#     distribution is kept. A share of rows (the smoothing) instead draws
+#     each of them on its own from its marginal distribution, so new
+#     combinations turn up as well
+#   - The assistance, investment and jobs are taken from a row of the csv
+#     with the same Condition, with both amounts scaled by the same random
+#     factor. This keeps the ratio between them, so the grades and the rows
+#     with no gain follow the csv too
+#
+# Rows are generated and written in chunks with a fixed seed, so any number
+# of rows can be made in bounded memory and the output is always the same.
+# Each chunk is drawn as whole columns of NumPy arrays: the categories as
+# codes into the values of each column, and the donor rows as positions in
+# the rows of the csv sorted by Condition.
+#
+# Usage: python synthetic_data.py <output csv> --rows 1000000 [--seed 0]
+#            [--source Data/invest_ni.csv] [--derive]
+import argparse
+import csv
+import numpy as np
+import bulk_writer
+import data_manipulation as dm
+import data_investigation
+import feature_engine
+
+# Columns drawn together from the combinations in the csv
+category_columns = ["Sector", "Condition", "Constituency", "SME",
+                    "Ownership", "Status", "Country"]
+
+# Number of rows generated and written at a time
+chunk_size = 100000
+# Share of rows whose categories are drawn on their own
+default_smoothing = 0.05
+# Spread of the factor the amounts are scaled by (standard deviation of its
+# natural log)
+amount_spread = 0.25
+
+
+# Function to learn the distributions of a csv of Invest NI data
+def learn_distributions(source_path):
+    with open(source_path, newline="", encoding="utf-8") as csvfile:
+        source_rows = list(csv.DictReader(csvfile))
+
+    # Count each combination of the categories
+    combinations = {}
+    for row in source_rows:
+        key = tuple(row[column] for column in category_columns)
+        combinations[key] = combinations.get(key, 0) + 1
+
+    # Count each value of each category on its own
+    marginals = {}
+    for position, column in enumerate(category_columns):
+        counts = {}
+        for key, count in combinations.items():
+            counts[key[position]] = counts.get(key[position], 0) + count
+        marginals[column] = (list(counts), np.array(list(counts.values())) /
+                             len(source_rows))
+
+    # Each combination as the codes of its values in the marginals
+    codes = {column: {value: code for code, value in
+                      enumerate(marginals[column][0])}
+             for column in category_columns}
+    combination_codes = np.array([[codes[column][value] for column, value
+                                   in zip(category_columns, key)]
+                                  for key in combinations], dtype=np.intp)
+
+    # Keep the amounts and jobs of the rows sorted by Condition, along with
+    # where the rows of each Condition start and how many there are
+    conditions = np.array([codes["Condition"][row["Condition"]]
+                           for row in source_rows], dtype=np.intp)
+    order = np.argsort(conditions, kind="stable")
+    counts = np.bincount(conditions,
+                         minlength=len(marginals["Condition"][0]))
+
+    return {"rows": len(source_rows),
+            "combination_codes": combination_codes,
+            "combination_p": np.array(list(combinations.values())) /
+            len(source_rows),
+            "marginals": {column: (np.array(values, dtype=object),
+                                   probabilities)
+                          for column, (values, probabilities)
+                          in marginals.items()},
+            "donor_start": np.cumsum(counts) - counts,
+            "donor_count": counts,
+            "assistance": np.array([float(source_rows[row]
+                                          ["Total Assistance"])
+                                    for row in order]),
+            "investment": np.array([float(source_rows[row]
+                                          ["Total Investment"])
+                                    for row in order]),
+            "jobs": np.array([source_rows[row]["Estimated Jobs"]
+                              for row in order], dtype=object)}
+
+
+# Generator that yields blocks of columns of synthetic rows, a chunk at a
+# time, with every heading of the Invest NI csv
+def generate_chunks(distributions, rows, seed=0,
+                    smoothing=default_smoothing, chunk_rows=chunk_size):
+    generator = np.random.default_rng(seed)
+    combination_codes = distributions["combination_codes"]
+
+    for start in range(0, rows, chunk_rows):
+        size = min(chunk_rows, rows - start)
+
+        # Draw the categories together, then redraw the smoothed rows from
+        # the marginals
+        codes = combination_codes[generator.choice(
+            len(combination_codes), size=size,
+            p=distributions["combination_p"])]
+        smoothed = np.flatnonzero(generator.random(size) < smoothing)
+        for position, column in enumerate(category_columns):
+            values, probabilities = distributions["marginals"][column]
+            codes[smoothed, position] = generator.choice(
+                len(values), size=len(smoothed), p=probabilities)
+
+        # Take the amounts of each row from a row of the csv with the same
+        # condition, scaled by a random factor
+        conditions = codes[:, category_columns.index("Condition")]
+        donors = distributions["donor_start"][conditions] + \
+            generator.integers(distributions["donor_count"][conditions])
+        factors = generator.lognormal(0, amount_spread, size)
+        assistance = distributions["assistance"][donors]
+        investment = distributions["investment"][donors]
+        row_assistance = np.rint(assistance * factors).astype(np.int64)
+        row_investment = np.rint(investment * factors).astype(np.int64)
+        # Keep rows with no gain exactly even after rounding
+        row_investment = np.where(assistance == investment, row_assistance,
+                                  row_investment)
+
+        block = {heading: [""] * size for heading in dm.invest_headers}
+        for position, column in enumerate(category_columns):
+            block[column] = distributions["marginals"][column][0][
+                codes[:, position]]
+        block["Client Name"] = ["Synthetic Client " + str(number)
+                                for number in range(start, start + size)]
+        block["Total Assistance"] = row_assistance
+        block["Total Investment"] = row_investment
+        block["Investment Gain"] = (row_investment -
+                                    row_assistance).astype(np.float64)
+        block["Estimated Jobs"] = distributions["jobs"][donors]
+        yield block
+
+
+# Function to write a csv of synthetic rows drawn from learnt distributions.
+# Returns the number of rows written
+def write_csv(output_path, distributions, rows, seed=0,
+              smoothing=default_smoothing, chunk_rows=chunk_size):
+    with bulk_writer.block_writer(output_path, dm.invest_headers) as writer:
+        for block in generate_chunks(distributions, rows, seed, smoothing,
+                                     chunk_rows):
+            writer.write(block)
+
+    return rows
+
+
+# Function to write a csv of synthetic rows learnt from the source csv.
+# Returns the number of rows written
+def generate_csv(output_path, rows, source_path=data_investigation.invest_path,
+                 seed=0, smoothing=default_smoothing, chunk_rows=chunk_size):
+    return write_csv(output_path, learn_distributions(source_path), rows,
+                     seed, smoothing, chunk_rows)
+
+
+# Function to write a csv of synthetic rows a number of times the size of
+# the source csv, as the benchmarks use. Returns the number of rows written
+def generate_scaled(output_path, scale,
+                    source_path=data_investigation.invest_path, seed=0):
+    distributions = learn_distributions(source_path)
+    return write_csv(output_path, distributions,
+                     int(distributions["rows"] * scale), seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic Invest NI data")
+    parser.add_argument("output", help="csv file to write")
+    parser.add_argument("--rows", type=int, required=True,
+                        help="number of rows to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--source", default=data_investigation.invest_path,
+                        help="csv to learn the distributions from")
+    parser.add_argument("--smoothing", type=float, default=default_smoothing,
+                        help="share of rows with independently drawn "
+                             "categories")
+    parser.add_argument("--derive", action="store_true",
+                        help="also write the appended and zero removed "
+                             "files next to the output, for the classifiers")
+    arguments = parser.parse_args()
+
+    generate_csv(arguments.output, arguments.rows, arguments.source,
+                 arguments.seed, arguments.smoothing)
+    print("Generated " + str(arguments.rows) + " rows")
+
+    if arguments.derive:
+        base_path = arguments.output.rsplit(".", 1)[0]
+        feature_engine.derive_files_chunked(arguments.output,
+                                            base_path + "_appended.csv",
+                                            base_path + "_zero_removed.csv",
+                                            True)
@@ -0,0 +1,104 @@
+# Shared pieces of the tests: a stub of the Open Data NI datastore_search
+# api served on a local port, and records in the shape the api gives them
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlparse, parse_qs
+import pytest
+
+# The modules under test are at the top of the project
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import data_manipulation as dm  # noqa: E402
+
+
+# Function to create a record as the api gives it, with every field the
+# Invest NI csv is read from
+def make_record(number, name="Client"):
+    record = {source: "{} {}".format(heading, number)
+              for heading, source in dm.source_columns.items()}
+    record[dm.source_columns["Client Name"]] = "{} {}".format(name, number)
+    record[dm.source_columns["Total Assistance"]] = str(number * 10)
+    record[dm.source_columns["Total Investment"]] = str(number * 25)
+    record["_id"] = number + 1
+    return record
+
+
+# Class to serve pages of the records of each resource. Every request is
+# logged, the most requests open at once is kept, and a request can be made
+# to fail once with a given status
+class StubApi:
+
+    def __init__(self, resources, delay=0.0, page_cap=None):
+        self.resources = resources
+        self.delay = delay
+        self.page_cap = page_cap
+        # (resource id, offset) of the pages that fail once, and the status
+        self.failures = {}
+        self.requests = []
+        self.open = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def page(self, resource_id, limit, offset):
+        with self.lock:
+            self.requests.append((resource_id, offset))
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+            status = self.failures.pop((resource_id, offset), None)
+        time.sleep(self.delay)
+        with self.lock:
+            self.open -= 1
+        if status is not None:
+            return status, None
+
+        if self.page_cap is not None:
+            limit = min(limit, self.page_cap)
+        records = self.resources[resource_id]
+        result = {"records": records[offset:offset + limit],
+                  "total": len(records),
+                  "_links": {"next": "/api?" + urlencode(
+                      {"resource_id": resource_id, "limit": limit,
+                       "offset": offset + limit})}}
+        return 200, result
+
+
+# Fixture giving a function that starts a stub api for some resources, and
+# stops every one started once the test is done
+@pytest.fixture
+def stub_api():
+    servers = []
+
+    def start(resources, **options):
+        api = StubApi(resources, **options)
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                status, result = api.page(query["resource_id"][0],
+                                          int(query["limit"][0]),
+                                          int(query["offset"][0]))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                if result is not None:
+                    self.wfile.write(json.dumps({"result": result})
+                                     .encode("utf-8"))
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        api.url = "http://127.0.0.1:{}/api".format(server.server_port)
+        return api
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,50 @@
+# Tests of the concurrent download of several resources in async_fetch
+# against a stub api
+import pandas as pd
+import async_fetch
+from conftest import make_record
+
+
+# Function to read the client names of a csv written by the merge
+def client_names(path):
+    return list(pd.read_csv(path, dtype=str,
+                            keep_default_na=False)["Client Name"])
+
+
+def test_merge_bounds_requests_retries_and_drops_repeats(stub_api, tmp_path):
+    first = [make_record(number) for number in range(40)]
+    # The second resource repeats ten records of the first
+    second = first[:10] + [make_record(number, "Other")
+                           for number in range(25)]
+    api = stub_api({"first": first, "second": second}, delay=0.02)
+    api.failures[("first", 10)] = 503
+    api.failures[("second", 20)] = 429
+    csv_path = str(tmp_path / "merged.csv")
+
+    rows = async_fetch.merge_resources(csv_path, ["first", "second"],
+                                       api_url=api.url, limit=5,
+                                       max_requests=3, wait=0)
+
+    # No more than three requests were open at once, but more than one was
+    assert 1 < api.peak <= 3
+    # Each failed page was asked for again
+    assert api.requests.count(("first", 10)) == 2
+    assert api.requests.count(("second", 20)) == 2
+    # The records are in order, without the repeats from the second
+    assert rows == 65
+    assert client_names(csv_path) == \
+        ["Client {}".format(number) for number in range(40)] + \
+        ["Other {}".format(number) for number in range(25)]
+
+
+def test_merge_steps_by_the_records_the_server_gives(stub_api, tmp_path):
+    records = [make_record(number) for number in range(17)]
+    api = stub_api({"capped": records}, page_cap=4)
+    csv_path = str(tmp_path / "capped.csv")
+
+    rows = async_fetch.merge_resources(csv_path, ["capped"], api_url=api.url,
+                                       limit=10, wait=0)
+
+    assert rows == 17
+    assert client_names(csv_path) == ["Client {}".format(number)
+                                      for number in range(17)]
@@ -0,0 +1,29 @@
+# Tests of the data sets shared in a process by data_cache and feature_store
+import data_cache
+import feature_store
+
+
+# Function to write a small csv of the derived data
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8") as csvfile:
+        csvfile.write("Client Name,SME,Ownership,Jobs Created,Sector,"
+                      "Condition,Average Grade\n")
+        for number in range(rows):
+            csvfile.write("Client {0},SME,Local,True,Sector {0},Condition {1},"
+                          "False\n".format(number, number % 3))
+
+
+def test_shared_copies_follow_the_csv(tmp_path):
+    csv_path = str(tmp_path / "derived.csv")
+    write_csv(csv_path, 20)
+    frame = data_cache.get_data(csv_path)
+    store = feature_store.get_store(csv_path)
+
+    # The same copies are handed out while the csv is unchanged
+    assert data_cache.get_data(csv_path) is frame
+    assert feature_store.get_store(csv_path) is store
+
+    # And new ones once it is written again
+    write_csv(csv_path, 25)
+    assert len(data_cache.get_data(csv_path)) == 25
+    assert len(feature_store.get_store(csv_path).frame) == 25
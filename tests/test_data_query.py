@@ -0,0 +1,42 @@
+# Tests of the query engine over the compact column store
+import data_query
+import record_store
+
+
+# Function to create a row with the columns of the appended data
+def make_row(number, sector="Retail", assistance="10", investment="100",
+             grade="True"):
+    return {"Client Name": "Client {}".format(number), "Sector": sector,
+            "Total Assistance": assistance, "Total Investment": investment,
+            "Estimated Jobs": str(number), "Business Plan Grade": grade}
+
+
+def test_query_results_follow_changes_to_the_store():
+    store = record_store.build_store(
+        [make_row(0, "Retail", "10"), make_row(1, "Retail", "20"),
+         make_row(2, "Food", "5")])
+    engine = data_query.QueryEngine(store)
+    query = {"by": ["Sector"], "values": {"Total Assistance": ["sum"]}}
+
+    first = engine.aggregate(**query)
+    assert dict(zip(first["Sector"], first["Total Assistance sum"])) == \
+        {"Retail": 30, "Food": 5}
+    # Asked again, the cached result is given back
+    assert len(engine.results) == 1
+    assert engine.aggregate(**query).equals(first)
+
+    # A change to a row or a new row is seen by the next query
+    store[2]["Total Assistance"] = "8"
+    changed = engine.aggregate(**query)
+    assert dict(zip(changed["Sector"], changed["Total Assistance sum"])) == \
+        {"Retail": 30, "Food": 8}
+    store.append(make_row(3, "Tech", "1"))
+    grown = engine.aggregate(**query)
+    assert dict(zip(grown["Sector"], grown["Total Assistance sum"])) == \
+        {"Retail": 30, "Food": 8, "Tech": 1}
+    assert len(engine.results) == 1
+
+    # As are filters on the new values
+    filtered = engine.aggregate(
+        by=["Sector"], filters={"Total Assistance": {"low": 2, "high": 9}})
+    assert list(filtered["Sector"]) == ["Food"]
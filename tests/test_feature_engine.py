@@ -0,0 +1,41 @@
+# Tests that the vectorised feature derivations give the same files as the
+# row by row derivations in data_investigation
+import os
+import data_investigation
+import feature_engine
+
+source_path = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "Data", "invest_ni.csv")
+
+
+# Function to read the bytes of a file
+def read_bytes(path):
+    with open(path, "rb") as derived_file:
+        return derived_file.read()
+
+
+def test_vectorised_files_match_the_row_by_row_files(tmp_path):
+    # Take the first rows of the Invest NI data, which have offers with and
+    # without a gain
+    with open(source_path, encoding="utf-8", newline="") as source_file:
+        lines = source_file.readlines()[:301]
+    data_path = str(tmp_path / "invest_ni.csv")
+    with open(data_path, "w", encoding="utf-8", newline="") as data_file:
+        data_file.writelines(lines)
+
+    outputs = {}
+    for name in ("rows", "vectorised", "chunked"):
+        outputs[name] = (str(tmp_path / (name + "_appended.csv")),
+                         str(tmp_path / (name + "_zero_removed.csv")))
+    averages = data_investigation.derive_data(data_path, *outputs["rows"])
+    feature_engine.derive_files(data_path, *outputs["vectorised"])
+    # Chunks that don't divide the rows evenly
+    feature_engine.derive_files_chunked(data_path, *outputs["chunked"],
+                                        chunk_rows=37)
+
+    assert 0 < averages[0] < averages[1]
+    assert len(read_bytes(outputs["rows"][1])) < \
+        len(read_bytes(outputs["rows"][0]))
+    for name in ("vectorised", "chunked"):
+        for expected, derived in zip(outputs["rows"], outputs[name]):
+            assert read_bytes(derived) == read_bytes(expected)
@@ -0,0 +1,56 @@
+# Tests of refreshing the Invest NI csv with only the records that have
+# changed, against a stub api
+import json
+import pandas as pd
+import data_manipulation as dm
+from conftest import make_record
+
+
+# Function to read the client names of a refreshed csv
+def client_names(path):
+    return list(pd.read_csv(path, dtype=str,
+                            keep_default_na=False)["Client Name"])
+
+
+def test_refresh_merges_changed_records(stub_api, tmp_path):
+    records = [make_record(number) for number in range(12)]
+    api = stub_api({"invest": records})
+    csv_path = str(tmp_path / "invest_ni.csv")
+    options = {"api_url": api.url, "resource_id": "invest", "limit": 5}
+
+    assert len(dm.invest_data_refresh(csv_path, **options)) == 12
+    with open(csv_path + ".index", encoding="utf-8") as index_file:
+        assert json.load(index_file)["signature"] == \
+            dm.csv_signature(csv_path)
+
+    # One record changes and another is added
+    records[3] = make_record(3, "Changed")
+    records.append(make_record(12))
+    changed = dm.invest_data_refresh(csv_path, **options)
+    assert sorted(changed) == ["13", "4"]
+    names = ["Client {}".format(number) for number in range(13)]
+    names[3] = "Changed 3"
+    assert client_names(csv_path) == names
+
+    # Nothing changed, so nothing is merged
+    assert dm.invest_data_refresh(csv_path, **options) == {}
+
+
+def test_index_is_rebuilt_when_the_csv_changes(stub_api, tmp_path):
+    records = [make_record(number) for number in range(12)]
+    api = stub_api({"invest": records})
+    csv_path = str(tmp_path / "invest_ni.csv")
+    options = {"api_url": api.url, "resource_id": "invest", "limit": 5}
+    dm.invest_data_refresh(csv_path, **options)
+
+    # Sorting the csv outside of the refresh moves its rows away from the
+    # ids in the index
+    data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    data.sort_values("Client Name", ascending=False).to_csv(csv_path,
+                                                            index=False)
+
+    # The index no longer matches, so every record is taken as new and the
+    # csv is written again in the order of the datastore
+    assert len(dm.invest_data_refresh(csv_path, **options)) == 12
+    assert client_names(csv_path) == ["Client {}".format(number)
+                                      for number in range(12)]
@@ -0,0 +1,114 @@
+# Tests of carrying on training the saved models on the rows added to their
+# csv, on a small copy of the appended data
+import os
+import pandas as pd
+import pytest
+import classifiers
+import data_cache
+import model_store
+import model_updates
+import search_modes
+
+source_path = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "Data", "appended_data.csv")
+
+
+# Function to write the first rows of the appended data to a csv
+def write_rows(csv_path, rows):
+    with open(source_path, encoding="utf-8") as source_file:
+        lines = source_file.read().splitlines(True)
+    with open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+        csv_file.writelines(lines[:rows + 1])
+
+
+# Fixture giving the average grade target trained on the first 200 rows of
+# a copy of the appended data, along with a list of the number of rows each
+# search is fitted on
+@pytest.fixture
+def small_target(tmp_path, monkeypatch):
+    csv_path = str(tmp_path / "appended_data.csv")
+    models_path = str(tmp_path / "Models")
+    write_rows(csv_path, 300)
+
+    settings = {"data": lambda: data_cache.get_data(csv_path)[:200],
+                "label": "Average Grade", "source": csv_path,
+                "param_grid": {"regressor__n_estimators": [5],
+                               "regressor__max_depth": [2]}}
+    monkeypatch.setitem(classifiers.targets, "average_grade", settings)
+
+    fitted = []
+    make_search = search_modes.make_search
+
+    def counted_search(*args, **kwargs):
+        search = make_search(*args, **kwargs)
+        fit = search.fit
+
+        def counted_fit(features, labels, **fit_kwargs):
+            fitted.append(len(features))
+            return fit(features, labels, **fit_kwargs)
+        search.fit = counted_fit
+        return search
+    monkeypatch.setattr(search_modes, "make_search", counted_search)
+
+    search = search_modes.make_search(
+        classifiers.build_pipeline("average_grade"), settings["param_grid"])
+    features, labels = classifiers.target_data("average_grade")
+    search.fit(features, labels)
+    model_store.save_model("average_grade", search, models_path)
+    yield csv_path, models_path, fitted
+    data_cache.clear_cache(csv_path)
+
+
+def test_retrain_keeps_the_rows_of_earlier_updates(small_target):
+    csv_path, models_path, fitted = small_target
+
+    # Two updates carry on training on the rows added after the holdout
+    for rows in (330, 360):
+        write_rows(csv_path, rows)
+        model_updates.update_model("average_grade", directory=models_path)
+    entry = model_store.load_manifest(models_path)["average_grade"]
+    assert entry["updates"] == 2
+    assert entry["holdout_end"] == 300
+    assert fitted == [200]
+
+    # Training from zero uses the training rows and every row after the
+    # holdout, not only the rows added since the last update
+    write_rows(csv_path, 420)
+    model_updates.update_model("average_grade", tolerance=-1,
+                               directory=models_path)
+    assert fitted == [200, 200 + 120]
+    entry = model_store.load_manifest(models_path)["average_grade"]
+    assert entry["holdout_end"] == 300
+    assert entry["source_rows"] == 420
+
+
+def test_changed_rows_train_from_zero(small_target):
+    csv_path, models_path, fitted = small_target
+
+    # Changing a row the model has seen means its rows are no longer only
+    # added to
+    data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    data.loc[10, "Client Name"] = "Changed"
+    data.to_csv(csv_path, index=False)
+    assert model_updates.new_rows(
+        "average_grade",
+        model_store.load_manifest(models_path)["average_grade"]) is None
+
+    model_updates.update_model("average_grade", directory=models_path)
+    assert fitted == [200, 200]
+
+
+def test_no_new_rows_refreshes_the_manifest(small_target):
+    csv_path, models_path, fitted = small_target
+    before = model_store.load_manifest(models_path)["average_grade"]
+
+    # Rewriting the csv with the same rows changes its bytes but not its rows
+    data = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    data.to_csv(csv_path, index=False, lineterminator="\r\n")
+    model_updates.update_model("average_grade", directory=models_path)
+
+    after = model_store.load_manifest(models_path)["average_grade"]
+    assert after["data_hash"] == model_store.data_hash("average_grade")
+    assert after["data_hash"] != before["data_hash"]
+    assert after["source_rows"] == before["source_rows"]
+    assert fitted == [200]
@@ -0,0 +1,57 @@
+# Tests of the paged retrieval in data_manipulation against a stub api
+import os
+import pandas as pd
+import pytest
+import requests
+import data_manipulation as dm
+from conftest import make_record
+
+
+# Function to read a csv written by the retrieval, keeping every value as
+# text
+def read_csv(path):
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def test_pages_are_followed_to_the_last_record(stub_api, tmp_path):
+    records = [make_record(number) for number in range(23)]
+    api = stub_api({"invest": records})
+    csv_path = str(tmp_path / "invest_ni.csv")
+
+    offset = dm.invest_data_retrieve(csv_path, paged=True, api_url=api.url,
+                                     resource_id="invest", limit=5)
+
+    # Every page is asked for once, in order
+    assert offset == 23
+    assert api.requests == [("invest", offset) for offset in range(0, 25, 5)]
+    data = read_csv(csv_path)
+    assert list(data.columns) == dm.invest_headers
+    assert list(data["Client Name"]) == ["Client {}".format(number)
+                                         for number in range(23)]
+    assert not os.path.exists(csv_path + ".checkpoint")
+    assert not os.path.exists(csv_path + ".partial")
+
+
+def test_failed_retrieval_resumes_from_the_last_page(stub_api, tmp_path):
+    records = [make_record(number) for number in range(23)]
+    api = stub_api({"invest": records})
+    csv_path = str(tmp_path / "invest_ni.csv")
+    options = {"api_url": api.url, "resource_id": "invest", "limit": 5}
+
+    # The fourth page fails, leaving the first three written
+    api.failures[("invest", 15)] = 500
+    with pytest.raises(requests.HTTPError):
+        dm.invest_data_retrieve(csv_path, paged=True, **options)
+    assert not os.path.exists(csv_path)
+    assert dm.load_checkpoint(csv_path + ".checkpoint")["offset"] == 15
+
+    # The next run only asks for the pages after them
+    api.requests.clear()
+    dm.invest_data_retrieve(csv_path, paged=True, **options)
+    assert api.requests == [("invest", 15), ("invest", 20)]
+
+    # And gives the same csv as a run that didn't fail
+    complete_path = str(tmp_path / "complete.csv")
+    dm.invest_data_retrieve(complete_path, paged=True, **options)
+    with open(csv_path, "rb") as resumed, open(complete_path, "rb") as whole:
+        assert resumed.read() == whole.read()
@@ -0,0 +1,47 @@
+# Tests that the parallel csv reader gives the same rows as the serial one,
+# for values with quoted newlines, commas and quotes that fall across the
+# boundaries of the ranges
+import csv
+import pandas as pd
+import pytest
+import parallel_csv
+
+
+# Fixture giving a csv whose quoted values hold newlines, commas and
+# doubled quotes, read in parallel however small it is
+@pytest.fixture
+def quoted_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_csv, "min_parallel_bytes", 0)
+    csv_path = str(tmp_path / "quoted.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Client Name", "Sector", "Total Assistance",
+                         "Jobs Created"])
+        for number in range(300):
+            sector = "SCIENTIFIC, AND\nTECHNICAL" if number % 3 == 0 \
+                else 'The "best"\r\nsector, {}'.format(number)
+            writer.writerow(["Client {}".format(number), sector,
+                             number * 1.5, number % 2 == 0])
+    return csv_path
+
+
+def test_rows_match_the_dict_reader(quoted_csv):
+    # Enough ranges that the split points land inside quoted values
+    names, ranges = parallel_csv.record_ranges(quoted_csv, 16)
+    assert len(ranges) == 16
+
+    with open(quoted_csv, newline="", encoding="utf-8") as csv_file:
+        expected = list(csv.DictReader(csv_file))
+    assert list(parallel_csv.iterate_rows(quoted_csv, "parallel",
+                                          workers=4)) == expected
+
+
+def test_frame_matches_the_serial_frame(quoted_csv):
+    frame = parallel_csv.read_frame(quoted_csv, "parallel", workers=4)
+    pd.testing.assert_frame_equal(frame, pd.read_csv(quoted_csv))
+
+    # Columns given a type keep it
+    options = {"dtype": {"Total Assistance": "float32"}}
+    frame = parallel_csv.read_frame(quoted_csv, "parallel", workers=4,
+                                    **options)
+    pd.testing.assert_frame_equal(frame, pd.read_csv(quoted_csv, **options))
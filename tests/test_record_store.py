@@ -0,0 +1,94 @@
+# Tests of the compact column store for the Invest NI rows
+import csv
+import os
+import numpy as np
+import record_store
+
+appended_path = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "Data", "appended_data.csv")
+
+
+# Function to create a row with the columns of the appended data
+def make_row(number, sector="Retail", assistance="10", investment="100",
+             grade="True"):
+    return {"Client Name": "Client {}".format(number), "Sector": sector,
+            "Total Assistance": assistance, "Total Investment": investment,
+            "Estimated Jobs": str(number), "Business Plan Grade": grade}
+
+
+def test_numbers_are_given_back_as_they_were_read():
+    column = record_store.NumberColumn()
+    for value in ["5", "-2", "5.5", "0.1", 3, 2.0, "1e3"]:
+        column.append(value)
+
+    # Whole numbers keep their text, the rest are given as floats
+    assert [column.get(index) for index in range(7)] == \
+        ["5", "-2", "5.5", "0.1", "3", "2.0", "1000.0"]
+    assert column.array().tolist() == [5, -2, 5.5, 0.1, 3, 2, 1000]
+
+    column.set(0, "7.25")
+    column.set(2, 4)
+    assert column.get(0) == "7.25"
+    assert column.get(2) == "4"
+
+
+def test_text_is_held_as_codes_and_markers_as_bits():
+    categories = record_store.CategoryColumn()
+    for value in ["Retail", "Food", "Retail", "Tech", "Food"]:
+        categories.append(value)
+    assert categories.categories == ["Retail", "Food", "Tech"]
+    assert categories.array().tolist() == [0, 1, 0, 2, 1]
+
+    markers = record_store.BooleanColumn()
+    values = [number % 3 == 0 for number in range(11)]
+    for value in values:
+        markers.append("True" if value else "False")
+    # Eleven markers fit in two bytes
+    assert len(markers.bits) == 2
+    assert markers.array().tolist() == values
+    markers.set(1, True)
+    markers.set(0, "False")
+    assert markers.get(1) == "True" and markers.get(0) == "False"
+
+
+def test_row_views_write_to_the_store():
+    store = record_store.build_store([make_row(number)
+                                      for number in range(10)])
+    version = store.version
+
+    row = store[3]
+    row["Total Assistance"] = "25"
+    # Set through the other name of the column
+    row["Business Value"] = "False"
+    # Columns that don't exist yet are added
+    row["Average Grade"] = "True"
+
+    assert store.version == version + 3
+    assert store[3]["Total Assistance"] == "25"
+    assert store[3]["Business Plan Grade"] == "False"
+    assert store[-7]["Business Value"] == "False"
+    assert [row["Average Grade"] for row in store] == \
+        ["True" if number == 3 else "False" for number in range(10)]
+
+
+def test_set_array_replaces_a_marker_column():
+    store = record_store.build_store([make_row(number)
+                                      for number in range(10)])
+    mask = np.arange(10) % 2 == 0
+
+    store.set_array("Average Grade", mask)
+    store.set_array("Business Value", ~mask)
+
+    assert store.array("Average Grade").tolist() == mask.tolist()
+    assert [row["Business Plan Grade"] for row in store] == \
+        ["False" if even else "True" for even in mask]
+
+
+def test_store_gives_back_the_rows_of_the_csv():
+    with open(appended_path, encoding="utf-8", newline="") as csv_file:
+        reader = csv.DictReader(csv_file)
+        rows = [next(reader) for _ in range(200)]
+
+    store = record_store.build_store(dict(row) for row in rows)
+
+    assert [row.to_dict() for row in store] == rows
@@ -0,0 +1,160 @@
+# This file trains all of the classification problems in classifiers.py in
+# one scheduled run. Every (target x grid parameters x fold) fit is put into a
+# single queue and run on a pool of processes, rather than running one small
+# grid search at a time. The results for each target can be used in the same
+# way as a fitted GridSearchCV.
+#
+# With early stopping each fit holds a validation split out of its training
+# rows and stops once that stops improving, as the rounds search mode does.
+# The refit then uses the number of rounds the folds of the best parameters
+# stopped at on average
+#
+# Usage: python training_engine.py [--early-stopping-rounds 10]
+import argparse
+import os
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import StratifiedKFold, ParameterGrid
+import classifiers
+import instrumentation
+import search_modes
+
+# Parameter of the pipelines holding the number of boosting rounds
+rounds_param = "regressor__n_estimators"
+
+
+# The results of the grid search for one target, with the same attributes
+# and predict functions as a fitted GridSearchCV
+class TargetResult(search_modes.SearchResult):
+
+    def __init__(self, target, all_params, split_scores, task_times):
+        self.target = target
+        self.set_results(all_params, split_scores)
+        # List of (params, fold, seconds) for every fit in the search
+        self.task_times = task_times
+
+
+# Function to run a single fit from the queue. With no test rows this is the
+# final fit of the best parameters on all of the training data, and the
+# fitted model is returned. Otherwise the score is returned along with the
+# number of rounds the fit used
+@instrumentation.timed("cv_task")
+def run_task(task):
+    (target, per_fold, params, fold, train_rows, test_rows,
+     early_stopping_rounds) = task
+    features, labels = classifiers.target_data(target)
+    labels = np.ravel(labels)
+
+    # Each process runs a single fit at a time, so give xgboost one thread
+    model = classifiers.build_pipeline(target, per_fold)
+    model.set_params(regressor__n_jobs=1, **params)
+
+    start = time.perf_counter()
+    if test_rows is None:
+        model.fit(features, labels)
+        return model, time.perf_counter() - start
+
+    if early_stopping_rounds is not None:
+        rounds = model.get_params()[rounds_param]
+        scores, last_round = search_modes.fit_fold(
+            model, {}, [rounds], rounds_param, features, labels,
+            train_rows, test_rows, early_stopping_rounds)
+        return scores[0], time.perf_counter() - start, last_round
+
+    model.fit(features.iloc[train_rows], labels[train_rows])
+    score = accuracy_score(labels[test_rows],
+                           model.predict(features.iloc[test_rows]))
+    return score, time.perf_counter() - start, params.get(rounds_param)
+
+
+# Function to train every target together, stopping each fit early if given
+# a number of rounds. Returns a dict of target name to its TargetResult
+def train_all(target_names=None, n_workers=None, per_fold=False,
+              early_stopping_rounds=None):
+    # Default to every target and a process for each core
+    if target_names is None:
+        target_names = list(classifiers.targets)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    # Expand every target into its grid parameters and folds, using the same
+    # stratified folds as GridSearchCV
+    grids = {}
+    tasks = []
+    for target in target_names:
+        features, labels = classifiers.target_data(target)
+        splits = list(StratifiedKFold(search_modes.folds).split(
+            features, np.ravel(labels)))
+        grids[target] = list(ParameterGrid(
+            classifiers.targets[target]["param_grid"]))
+        for params, (fold, (train_rows, test_rows)) in itertools.product(
+                grids[target], enumerate(splits)):
+            tasks.append((target, per_fold, params, fold, train_rows,
+                          test_rows, early_stopping_rounds))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        # Run the whole queue at once
+        outcomes = list(pool.map(run_task, tasks))
+
+        # Collect the scores for each set of parameters
+        scores = {target: np.zeros((len(grids[target]), search_modes.folds))
+                  for target in target_names}
+        task_times = {target: [] for target in target_names}
+        used_rounds = {target: {} for target in target_names}
+        for task, (score, seconds, rounds) in zip(tasks, outcomes):
+            target, params, fold = task[0], task[2], task[3]
+            index = grids[target].index(params)
+            scores[target][index, fold] = score
+            task_times[target].append((params, fold, seconds))
+            used_rounds[target].setdefault(index, []).append(rounds)
+        results = {target: TargetResult(target, grids[target],
+                                        scores[target], task_times[target])
+                   for target in target_names}
+
+        # The best models are refitted with the rounds their folds stopped
+        # at
+        if early_stopping_rounds is not None:
+            for target, result in results.items():
+                result.best_params_ = dict(result.best_params_)
+                result.best_params_[rounds_param] = int(round(np.mean(
+                    used_rounds[target][result.best_index_])))
+
+        # Refit the best parameters of every target on all of its training
+        # data, again together
+        refits = list(pool.map(run_task, [
+            (target, per_fold, results[target].best_params_, None, None,
+             None, None) for target in target_names]))
+
+    for target, (model, seconds) in zip(target_names, refits):
+        results[target].best_estimator_ = model
+        results[target].refit_time_ = seconds
+    return results
+
+
+# Function to print the best score of each target along with the time taken
+# for each fit
+def training_report(results):
+    for target, result in results.items():
+        print("\n\n{} Grid Search\nBest Score: {}\nBest Parameters: {}"
+              .format(target, result.best_score_, result.best_params_))
+        for params, fold, seconds in result.task_times:
+            print("    {} fold {}: {:.3f}s".format(params, fold, seconds))
+        print("    refit: {:.3f}s".format(result.refit_time_))
+        print("    total fit time: {:.3f}s".format(
+            sum(times[2] for times in result.task_times) +
+            result.refit_time_))
+
+
+# If main function, train every target and print the report
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Train every classification problem together")
+    parser.add_argument("--early-stopping-rounds", type=int,
+                        help="stop each fit once a validation split hasn't "
+                             "improved for this many rounds")
+    arguments = parser.parse_args()
+    training_report(train_all(
+        early_stopping_rounds=arguments.early_stopping_rounds))